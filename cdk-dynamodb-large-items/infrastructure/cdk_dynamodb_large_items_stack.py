@@ -112,6 +112,28 @@ class CdkDynamoDBLargeItemsStack(core.Stack):
                 )
             )
 
+            # Build the function to test the client + fast deserializer call
+            fast_resource_function = _lambda.Function(
+                self,
+                id=f"measurement-fast-resource-{current_mem_size}-mb",
+                code=lambda_code_asset,
+                environment={
+                    "TEST_METHOD": "fast",
+                    "MEMORY_SIZE": str(current_mem_size),
+                    "TABLE_NAME": experiment_table.table_name
+                },
+                handler="lambda_handler.fast_resource_handler",
+                runtime=_lambda.Runtime.PYTHON_3_8,
+                memory_size=current_mem_size,
+                timeout=core.Duration.seconds(120),
+            )
+
+            fast_resource_function.add_event_source(
+                lambda_event_sources.SnsEventSource(invoker_topic)
+            )
+
+            experiment_table.grant_read_write_data(fast_resource_function)
+
             current_mem_size += LAMBDA_MEMORY_INCREMENTS_IN_MB
 
         # The function to gather and aggregate the measurements
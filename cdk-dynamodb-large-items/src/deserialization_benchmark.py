@@ -0,0 +1,198 @@
+"""
+Local micro-benchmark for the deserialization part of reading items.
+
+Reading large items is dominated by turning the response into Python objects,
+so this measures that step in isolation and without AWS:
+
+- json: just json.loads of the response body
+- client: botocore parsing the GetItem response, i.e. what boto3.client returns
+- resource: client + boto3's TypeDeserializer, i.e. what Table.get_item returns
+- converter: client + a dispatch table based AttributeValue converter
+- fast: client + the FastDeserializer
+- fast_native: client + the FastDeserializer with int/float instead of Decimal
+
+Run it with `python src/deserialization_benchmark.py --help`.
+"""
+import argparse
+import base64
+import decimal
+import gc
+import json
+import statistics
+import time
+import tracemalloc
+import typing
+
+import botocore.parsers
+import botocore.session
+from boto3.dynamodb.types import TypeDeserializer
+
+import item_size
+from fast_deserializer import FastDeserializer
+
+ITEM_SIZES_IN_KB = [4, 64, 128, 256, 400]
+
+
+class _WireFormatEncoder(json.JSONEncoder):
+    """Binary values are base64 encoded in the wire format."""
+
+    def default(self, o):
+        if isinstance(o, (bytes, bytearray)):
+            return base64.b64encode(o).decode("ascii")
+        return super().default(o)
+
+
+def _response_body(item: dict) -> bytes:
+    return json.dumps({"Item": item}, cls=_WireFormatEncoder).encode("utf-8")
+
+
+def _get_item_parser() -> typing.Callable[[bytes], dict]:
+    """Returns a function that parses a GetItem response body the way the client does."""
+
+    service_model = botocore.session.get_session().get_service_model("dynamodb")
+    output_shape = service_model.operation_model("GetItem").output_shape
+    parser = botocore.parsers.create_parser(service_model.protocol)
+
+    def _parse(body: bytes) -> dict:
+        return parser.parse({"body": body, "headers": {}, "status_code": 200}, output_shape)
+
+    return _parse
+
+
+def _dispatch_table_converter() -> typing.Callable[[dict], dict]:
+    """A recursive AttributeValue to Python converter that dispatches on a dict instead of getattr."""
+
+    def _convert(attribute_value: dict):
+        (data_type, value), = attribute_value.items()
+        return dispatch[data_type](value)
+
+    dispatch = {
+        "S": lambda value: value,
+        "N": decimal.Decimal,
+        "B": lambda value: value,
+        "BOOL": lambda value: value,
+        "NULL": lambda value: None,
+        "SS": set,
+        "NS": lambda value: {decimal.Decimal(element) for element in value},
+        "BS": set,
+        "L": lambda value: [_convert(element) for element in value],
+        "M": lambda value: {name: _convert(element) for name, element in value.items()},
+    }
+
+    def _convert_item(item: dict) -> dict:
+        return {name: _convert(attribute_value) for name, attribute_value in item.items()}
+
+    return _convert_item
+
+
+def build_candidates() -> typing.Dict[str, typing.Callable[[bytes], typing.Any]]:
+    """Functions that turn a GetItem response body into whatever the read path returns."""
+
+    parse = _get_item_parser()
+    type_deserializer = TypeDeserializer()
+    converter = _dispatch_table_converter()
+    fast_deserializer = FastDeserializer()
+    fast_native_deserializer = FastDeserializer(use_native_numbers=True)
+
+    def _resource(body: bytes) -> dict:
+        item = parse(body)["Item"]
+        return {name: type_deserializer.deserialize(value) for name, value in item.items()}
+
+    return {
+        "json": json.loads,
+        "client": parse,
+        "resource": _resource,
+        "converter": lambda body: converter(parse(body)["Item"]),
+        "fast": lambda body: fast_deserializer.deserialize_item(parse(body)["Item"]),
+        "fast_native": lambda body: fast_native_deserializer.deserialize_item(parse(body)["Item"]),
+    }
+
+
+def measure(
+        function: typing.Callable[[bytes], typing.Any],
+        body: bytes,
+        warmups: int,
+        repetitions: int
+    ) -> typing.Dict[str, float]:
+    """
+    Times the function with perf_counter_ns. retained_blocks are the memory blocks that are
+    still alive after the call, i.e. the ones that make up the result, not every allocation.
+    """
+
+    for _ in range(warmups):
+        function(body)
+
+    durations_in_ns = []
+    for _ in range(repetitions):
+        started_at = time.perf_counter_ns()
+        function(body)
+        durations_in_ns.append(time.perf_counter_ns() - started_at)
+
+    # The memory is measured separately, tracemalloc slows everything down.
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    result = function(body)
+    after = tracemalloc.take_snapshot()
+    _, peak_in_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # A snapshot diff only sees blocks that are still alive, temporary allocations are gone by now
+    retained_blocks = sum(stat.count_diff for stat in after.compare_to(before, "filename"))
+    del result
+
+    durations_in_ns.sort()
+
+    return {
+        "min_ms": durations_in_ns[0] / 1_000_000,
+        "median_ms": statistics.median(durations_in_ns) / 1_000_000,
+        "p90_ms": durations_in_ns[int(0.9 * (len(durations_in_ns) - 1))] / 1_000_000,
+        "retained_blocks": retained_blocks,
+        "peak_kib": peak_in_bytes / 1024,
+    }
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Compare the deserialization cost of the DynamoDB read paths.")
+    parser.add_argument("--size", "-s", type=int, action="append", help="Item size in KB, defaults to 4, 64, 128, 256 and 400")
+    parser.add_argument("--shape", action="append", choices=item_size.ITEM_SHAPES, help="Defaults to flat and nested")
+    parser.add_argument("--candidate", "-c", action="append", help="Defaults to all candidates")
+    parser.add_argument("--warmups", type=int, default=3)
+    parser.add_argument("--repetitions", "-r", type=int, default=20)
+    parser.add_argument("--csv", action="store_true", help="Print the results as CSV")
+    parsed = parser.parse_args()
+
+    candidates = build_candidates()
+    selected_candidates = parsed.candidate or list(candidates)
+    for name in selected_candidates:
+        if name not in candidates:
+            parser.error(f"Unknown candidate {name}, choose from {list(candidates)}")
+
+    columns = ["shape", "size_kb", "candidate", "min_ms", "median_ms", "p90_ms", "retained_blocks", "peak_kib"]
+
+    if parsed.csv:
+        print(";".join(columns))
+    else:
+        print("{0:>10} {1:>7} {2:>10} {3:>9} {4:>9} {5:>9} {6:>15} {7:>9}".format(*columns))
+
+    for shape in parsed.shape or ["flat", "nested"]:
+        for size_in_kb in parsed.size or ITEM_SIZES_IN_KB:
+
+            body = _response_body(item_size.generate_item_of_size(size_in_kb * 1024, shape))
+
+            for name in selected_candidates:
+                result = measure(candidates[name], body, parsed.warmups, parsed.repetitions)
+
+                if parsed.csv:
+                    print(";".join(str(value) for value in [shape, size_in_kb, name, *result.values()]))
+                else:
+                    print(
+                        "{0:>10} {1:>7} {2:>10} {min_ms:>9.3f} {median_ms:>9.3f} {p90_ms:>9.3f} {retained_blocks:>15} {peak_kib:>9.1f}".format(
+                            shape, size_in_kb, name, **result
+                        )
+                    )
+
+
+if __name__ == "__main__":
+    main()
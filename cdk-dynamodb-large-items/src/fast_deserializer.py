@@ -0,0 +1,137 @@
+"""
+An alternative to boto3's TypeDeserializer for large items.
+
+The TypeDeserializer recurses through every nested value, looks up the
+handler method by name for each of them and builds a new Decimal for every
+number. This deserializer walks the item iteratively with an explicit stack,
+so deeply nested items can't hit the recursion limit, dispatches through a
+dictionary that's built once, constructs each distinct number only once and
+can optionally return int/float instead of Decimal.
+
+Don't expect a big speedup from it: parsing the response in botocore takes
+most of the time, and end to end it's about as fast as the simple dispatch
+table converter in deserialization_benchmark.py.
+"""
+import typing
+
+from boto3.dynamodb.types import DYNAMODB_CONTEXT, Binary, TypeSerializer
+
+# Upper bound for the number of distinct numbers we remember per deserializer
+NUMBER_CACHE_SIZE = 10_000
+
+
+class FastDeserializer:
+
+    def __init__(self, use_native_numbers: bool = False):
+        """
+        By default the result is the same as the one of the TypeDeserializer.
+        With use_native_numbers numbers become int or float instead of Decimal,
+        which is faster but may lose precision for very large or precise values.
+        """
+
+        self.use_native_numbers = use_native_numbers
+
+        # Decimals are immutable, so we can share them between items.
+        self._number_cache: typing.Dict[str, typing.Any] = {}
+
+        self._scalar_converters: typing.Dict[str, typing.Callable[[typing.Any], typing.Any]] = {
+            "S": lambda value: value,
+            "N": self._number,
+            "B": Binary,
+            "BOOL": lambda value: value,
+            "NULL": lambda value: None,
+            "SS": set,
+            # The numbers in a set are distinct, so caching them wouldn't help
+            "NS": lambda value: set(map(self._uncached_number, value)),
+            "BS": lambda value: set(map(Binary, value)),
+        }
+
+    def _uncached_number(self, value: str):
+
+        if not self.use_native_numbers:
+            return DYNAMODB_CONTEXT.create_decimal(value)
+        if "." in value or "e" in value or "E" in value:
+            return float(value)
+        return int(value)
+
+    def _number(self, value: str):
+
+        number = self._number_cache.get(value)
+        if number is not None:
+            return number
+
+        number = self._uncached_number(value)
+
+        if len(self._number_cache) < NUMBER_CACHE_SIZE:
+            self._number_cache[value] = number
+
+        return number
+
+    def deserialize(self, attribute_value: dict):
+        """Deserializes a single AttributeValue, e.g. {"N": "1"} -> Decimal("1")"""
+
+        return self.deserialize_item({"value": attribute_value})["value"]
+
+    def deserialize_item(self, item: dict) -> dict:
+        """Turns an item in the AttributeValue format into plain Python objects."""
+
+        result = {}
+
+        # (target container, source attribute values), a container gets filled
+        # in one go, which keeps the order of list elements and map keys.
+        stack = [(result, item)]
+
+        while stack:
+            target, source = stack.pop()
+
+            if isinstance(target, dict):
+                for name, attribute_value in source.items():
+                    target[name] = self._convert(attribute_value, stack)
+            else:
+                append = target.append
+                for attribute_value in source:
+                    append(self._convert(attribute_value, stack))
+
+        return result
+
+    def _convert(self, attribute_value: dict, stack: list):
+        """Converts scalars right away, containers are created empty and put on the stack."""
+
+        for data_type, value in attribute_value.items():
+
+            if data_type == "S":
+                return value
+
+            if data_type == "M" or data_type == "L":
+                converted = {} if data_type == "M" else []
+                stack.append((converted, value))
+                return converted
+
+            converter = self._scalar_converters.get(data_type)
+            if converter is None:
+                raise TypeError(f"Dynamodb type {data_type} is not supported")
+
+            return converter(value)
+
+        raise TypeError("Empty attribute values are not supported")
+
+
+def get_item(client, table_name: str, key: dict, deserializer: FastDeserializer = None, **kwargs) -> dict:
+    """
+    Works like Table.get_item, but uses the client and the FastDeserializer.
+    The key is given in plain Python types, e.g. {"PK": "ITEM", "SK": "META"}
+    """
+
+    serializer = TypeSerializer()
+    deserializer = deserializer or FastDeserializer()
+
+    response = client.get_item(
+        TableName=table_name,
+        Key={name: serializer.serialize(value) for name, value in key.items()},
+        **kwargs
+    )
+
+    if "Item" in response:
+        response["Item"] = deserializer.deserialize_item(response["Item"])
+
+    return response
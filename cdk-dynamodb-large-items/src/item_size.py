@@ -0,0 +1,293 @@
+"""
+Calculates the size of DynamoDB items in the low-level AttributeValue format
+and generates items of a given size in different shapes.
+
+The rules follow the DynamoDB documentation and match the results of
+https://zaccharles.github.io/dynamodb-calculator/ - the sizes of numbers are
+an approximation, because DynamoDB doesn't document their encoding exactly.
+"""
+import argparse
+import base64
+import decimal
+import math
+import typing
+
+MAX_ITEM_SIZE_IN_BYTES = 400 * 1024
+
+# Each list or map costs 3 bytes plus 1 byte per element
+CONTAINER_OVERHEAD_IN_BYTES = 3
+CONTAINER_ELEMENT_OVERHEAD_IN_BYTES = 1
+
+# DynamoDB supports up to 32 levels of nesting
+MAX_NESTING_DEPTH = 32
+
+# Name of the attribute that pads generated items to their exact size
+PADDING_ATTRIBUTE_NAME = "_"
+
+ITEM_SHAPES = ["flat", "nested", "deep_map", "number_set", "binary", "wide"]
+
+
+def _size_of_string(value: str) -> int:
+    return len(value.encode("utf-8"))
+
+
+def _size_of_number(value: str) -> int:
+    """(1 byte per two significant digits) + 1 byte, negative numbers take one more byte."""
+
+    sign, digits, _ = decimal.Decimal(value).as_tuple()
+    significant_digits = "".join(str(digit) for digit in digits).strip("0")
+
+    return math.ceil(len(significant_digits) / 2) + 1 + sign
+
+
+def _size_of_binary(value: typing.Union[bytes, bytearray, str]) -> int:
+    if isinstance(value, str):
+        # The wire format (i.e. the JSON files) contains base64 encoded values
+        return len(base64.b64decode(value))
+    return len(value)
+
+
+def attribute_value_size(attribute_value: dict) -> int:
+    """Size of a single AttributeValue, e.g. {"S": "abc"} -> 3"""
+
+    (data_type, value), = attribute_value.items()
+
+    if data_type == "S":
+        return _size_of_string(value)
+    if data_type == "N":
+        return _size_of_number(value)
+    if data_type == "B":
+        return _size_of_binary(value)
+    if data_type in ("BOOL", "NULL"):
+        return 1
+    if data_type == "SS":
+        return sum(_size_of_string(element) for element in value)
+    if data_type == "NS":
+        return sum(_size_of_number(element) for element in value)
+    if data_type == "BS":
+        return sum(_size_of_binary(element) for element in value)
+    if data_type == "L":
+        return CONTAINER_OVERHEAD_IN_BYTES + sum(
+            CONTAINER_ELEMENT_OVERHEAD_IN_BYTES + attribute_value_size(element)
+            for element in value
+        )
+    if data_type == "M":
+        return CONTAINER_OVERHEAD_IN_BYTES + sum(
+            CONTAINER_ELEMENT_OVERHEAD_IN_BYTES + _size_of_string(name) + attribute_value_size(element)
+            for name, element in value.items()
+        )
+
+    raise ValueError(f"Unknown data type {data_type}")
+
+
+def item_size(item: dict) -> int:
+    """Size of an item in the AttributeValue format, i.e. what DynamoDB bills for."""
+
+    return sum(
+        _size_of_string(name) + attribute_value_size(attribute_value)
+        for name, attribute_value in item.items()
+    )
+
+
+def read_capacity_units(size_in_bytes: int, consistent: bool = False, transactional: bool = False) -> float:
+    """RCUs to read an item of that size, a read unit covers up to 4 KB."""
+
+    units = max(1, math.ceil(size_in_bytes / 4096))
+
+    if transactional:
+        return units * 2
+    if consistent:
+        return units
+    return units / 2
+
+
+def write_capacity_units(size_in_bytes: int, transactional: bool = False) -> int:
+    """WCUs to write an item of that size, a write unit covers up to 1 KB."""
+
+    units = max(1, math.ceil(size_in_bytes / 1024))
+
+    return units * 2 if transactional else units
+
+
+def _pad(item: dict, remaining_bytes: int):
+    """Adds an attribute that takes up exactly remaining_bytes bytes."""
+
+    if remaining_bytes <= 0:
+        return
+
+    # The name takes 1 byte, the rest is the (possibly empty) value
+    item[PADDING_ATTRIBUTE_NAME] = {"S": "X" * (remaining_bytes - len(PADDING_ATTRIBUTE_NAME))}
+
+
+def _fill_flat(item: dict, remaining_bytes: int):
+    item["payload"]["S"] = "X" * remaining_bytes
+
+
+def _fill_binary(item: dict, remaining_bytes: int):
+    item["payload"]["B"] = b"\x00" * remaining_bytes
+
+
+def _deep_map_payload() -> dict:
+    """A chain of maps that are nested as deep as DynamoDB allows with a string at the bottom."""
+
+    payload = {"S": ""}
+    for _ in range(MAX_NESTING_DEPTH - 1):
+        payload = {"M": {"child": payload}}
+
+    return {"payload": payload}
+
+
+def _fill_deep_map(item: dict, remaining_bytes: int):
+
+    leaf = item["payload"]
+    while "M" in leaf:
+        leaf = leaf["M"]["child"]
+
+    leaf["S"] = "X" * remaining_bytes
+
+
+def _fill_with_units(item: dict, remaining_bytes: int, unit_size: int, add_unit: typing.Callable[[int], None]) -> int:
+    """Adds units of a fixed size as long as they fit and returns the number of bytes left."""
+
+    number_of_units = remaining_bytes // unit_size
+    for idx in range(number_of_units):
+        add_unit(idx)
+
+    return remaining_bytes - number_of_units * unit_size
+
+
+def _fill_nested(item: dict, remaining_bytes: int) -> int:
+
+    list_item = {
+        "M": {
+            "time": {"S": "1614712316"},
+            "action": {"S": "list"},
+            "id": {"S": "123"},
+        }
+    }
+    unit_size = CONTAINER_ELEMENT_OVERHEAD_IN_BYTES + attribute_value_size(list_item)
+
+    return _fill_with_units(
+        item,
+        remaining_bytes,
+        unit_size,
+        lambda _: item["payload"]["L"].append(list_item)
+    )
+
+
+def _number_for_set(idx: int) -> str:
+    # Ten significant digits without trailing zeros, i.e. every number has the same size.
+    return str(1_000_000_000 + idx * 10 + 1)
+
+
+def _fill_number_set(item: dict, remaining_bytes: int) -> int:
+
+    unit_size = _size_of_number(_number_for_set(0))
+
+    return _fill_with_units(
+        item,
+        remaining_bytes,
+        unit_size,
+        lambda idx: item["payload"]["NS"].append(_number_for_set(idx))
+    )
+
+
+def _fill_wide(item: dict, remaining_bytes: int) -> int:
+    """Lots of top level attributes with short string values."""
+
+    value = "X" * 16
+    unit_size = _size_of_string("attr00000") + _size_of_string(value)
+
+    def _add_attribute(idx: int):
+        item[f"attr{idx:05d}"] = {"S": value}
+
+    return _fill_with_units(item, remaining_bytes, unit_size, _add_attribute)
+
+
+_EMPTY_PAYLOADS = {
+    "flat": lambda: {"payload": {"S": ""}},
+    "nested": lambda: {"payload": {"L": []}},
+    "deep_map": _deep_map_payload,
+    "number_set": lambda: {"payload": {"NS": []}},
+    "binary": lambda: {"payload": {"B": b""}},
+    "wide": lambda: {},
+}
+
+_FILLERS = {
+    "flat": _fill_flat,
+    "nested": _fill_nested,
+    "deep_map": _fill_deep_map,
+    "number_set": _fill_number_set,
+    "binary": _fill_binary,
+    "wide": _fill_wide,
+}
+
+
+def generate_item_of_size(
+        size_in_bytes: int,
+        shape: str,
+        pk: str = "ITEM",
+        sk: typing.Optional[str] = None,
+    ) -> dict:
+    """
+    Generates an item in the AttributeValue format that has exactly the given size.
+
+    Shapes:
+    - flat: one large string
+    - nested: a list of small maps
+    - deep_map: maps nested 32 levels deep with a string at the bottom
+    - number_set: a number set with lots of numbers
+    - binary: one large binary value
+    - wide: lots of small top level string attributes
+    """
+
+    if shape not in ITEM_SHAPES:
+        raise ValueError(f"Unknown shape {shape}, choose one of {ITEM_SHAPES}")
+
+    if size_in_bytes > MAX_ITEM_SIZE_IN_BYTES:
+        raise ValueError(f"Items can't be larger than {MAX_ITEM_SIZE_IN_BYTES} bytes")
+
+    item = {
+        "PK": {"S": pk},
+        "SK": {"S": sk or f"{size_in_bytes}B_{shape.upper()}"},
+    }
+    item.update(_EMPTY_PAYLOADS[shape]())
+
+    remaining_bytes = size_in_bytes - item_size(item)
+    if remaining_bytes < 0:
+        raise ValueError(f"An item of shape {shape} needs at least {item_size(item)} bytes")
+
+    if shape == "number_set" and remaining_bytes < _size_of_number(_number_for_set(0)):
+        # Sets can't be empty
+        raise ValueError("The target size is too small for a number set")
+
+    remaining_bytes = _FILLERS[shape](item, remaining_bytes) or 0
+    _pad(item, remaining_bytes)
+
+    return item
+
+
+def main():
+
+    parser = argparse.ArgumentParser(
+        description="Shows the size and capacity units of generated items in different shapes."
+    )
+    parser.add_argument("sizes_in_kb", type=int, nargs="*", default=[4, 64, 128, 256, 400])
+    parser.add_argument("--shape", "-s", action="append", choices=ITEM_SHAPES, help="Defaults to all shapes")
+    parsed = parser.parse_args()
+
+    print("{0:>10} {1:>8} {2:>8} {3:>8} {4:>8}".format("shape", "size_kb", "bytes", "rcu_ec", "wcu"))
+
+    for shape in parsed.shape or ITEM_SHAPES:
+        for size_in_kb in parsed.sizes_in_kb:
+            item = generate_item_of_size(size_in_kb * 1024, shape)
+            size = item_size(item)
+            print(
+                "{0:>10} {1:>8} {2:>8} {3:>8} {4:>8}".format(
+                    shape, size_in_kb, size, read_capacity_units(size), write_capacity_units(size)
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -5,14 +5,22 @@ import json
 import logging
 import os
 import random
-import statistics
 import time
+import typing
+import uuid
 
 from datetime import datetime
 
 import boto3
+from botocore.config import Config
 from boto3.dynamodb.conditions import Key
 
+import benchmark_driver
+import client_factory
+import fast_deserializer
+import item_size
+from latency_histogram import LatencyHistogram, summary_field_names
+
 
 LOGGER = logging.getLogger(__name__)
 LOGGER.setLevel(logging.DEBUG)
@@ -27,96 +35,195 @@ ITEM_SIZES_IN_KB = [4, 64, 128, 256, 400]
 FLAT_JSON_PATH = os.path.join(os.path.dirname(__file__), "flat_400kb_item.json")
 NESTED_JSON_PATH = os.path.join(os.path.dirname(__file__), "nested_400kb_item.json")
 
+# Attributes of a measurement item that aren't measurements
+MEASUREMENT_METADATA_ATTRIBUTES = {"PK", "SK", "testMethod", "memorySize"}
+
+MeasurementShard = collections.namedtuple(
+    typename="MeasurementShard",
+    field_names=[
+        "memory_size",
+        "test_method",
+        "measurements",
+    ]
+)
+
+# Reused across invocations of the same execution context, these are the ones we measure.
+DYNAMODB_CLIENT = client_factory.get_client("dynamodb")
+DYNAMODB_RESOURCE = client_factory.get_resource("dynamodb")
+
+# Recording the results goes through its own resource. The different config gives it its own
+# client and connection pool, so the recorder doesn't warm up the pool of the resource we measure.
+RECORDER_RESOURCE = client_factory.get_resource(
+    "dynamodb", config=Config(user_agent_extra="measurement-recorder")
+)
+FAST_DESERIALIZER = fast_deserializer.FastDeserializer()
+
+
+class MeasurementRecorder:
+    """
+    Collects the measurements of an invocation in memory and writes them
+    to the result table with a single update per item key once flushed.
+
+    Each recorder writes to its own shard of the measurement items, so a
+    single item never grows past the 400 KB item size limit no matter how
+    many invocations we run. Use iterate_measurement_shards to read them.
+    """
+
+    def __init__(self, memory_size: str, shard_id: typing.Optional[str] = None):
+        self.memory_size = memory_size
+        self.shard_id = shard_id or uuid.uuid4().hex
+
+        # test_method -> item_size -> [time_in_millis, ...]
+        self._measurements: typing.Dict[str, typing.Dict[str, typing.List[int]]] = \
+            collections.defaultdict(lambda: collections.defaultdict(list))
+
+    def record(self, test_method: str, item_size: str, time_in_millis: int):
+
+        LOGGER.debug(
+            "Recording result for a %s call with memory size %s that took %s ms",
+            test_method,
+            self.memory_size,
+            time_in_millis
+        )
+
+        self._measurements[test_method][item_size].append(time_in_millis)
+
+    def flush(self):
+        """Writes all buffered measurements to the table and clears the buffer."""
+
+        result_table = RECORDER_RESOURCE.Table(TABLE_NAME)
+
+        for test_method, measurements_by_item_size in self._measurements.items():
+
+            set_expressions = ["#tm = :tm", "#ms = :ms"]
+
+            expression_attribute_names = {
+                "#tm": "testMethod",
+                "#ms": "memorySize",
+            }
+
+            expression_attribute_values = {
+                ":empty_list": [],
+                ":tm": test_method,
+                ":ms": self.memory_size
+            }
+
+            for idx, (item_size, measurements) in enumerate(measurements_by_item_size.items()):
+                set_expressions.append(
+                    f"#size{idx} = list_append(if_not_exists(#size{idx}, :empty_list), :measurements{idx})"
+                )
+                expression_attribute_names[f"#size{idx}"] = item_size
+                expression_attribute_values[f":measurements{idx}"] = measurements
+
+            result_table.update_item(
+                Key={
+                    "PK": "MEASUREMENT",
+                    "SK": f"METHOD#{test_method}#MEMORY#{self.memory_size}#SHARD#{self.shard_id}"
+                },
+                UpdateExpression="SET " + ", ".join(set_expressions),
+                ExpressionAttributeNames=expression_attribute_names,
+                ExpressionAttributeValues=expression_attribute_values
+            )
+
+        self._measurements.clear()
+
+
 def record_measurement_result(memory_size: str, test_method: str, item_size: str, time_in_millis: int):
-    
-    LOGGER.debug(
-        "Recording result for a %s call with memory size %s that took %s ms",
-        test_method,
-        memory_size,
-        time_in_millis
+    """Records a single measurement right away, prefer the MeasurementRecorder for multiple ones."""
+
+    recorder = MeasurementRecorder(memory_size)
+    recorder.record(
+        test_method=test_method,
+        item_size=item_size,
+        time_in_millis=time_in_millis
     )
+    recorder.flush()
 
-    update_expression = "SET #item_size = list_append(if_not_exists(#item_size, :empty_list), :measurements)" \
-        + ", #tm = :tm, #ms = :ms"
 
-    expression_attribute_names = {
-        "#tm": "testMethod",
-        "#ms": "memorySize",
-        "#item_size": item_size,
-    }
+def query_measurement_items(table) -> typing.Iterable[dict]:
+    """Yields all measurement items (shards), one page at a time."""
 
-    expression_attribute_values = {
-        ":empty_list": [],
-        ":measurements": [time_in_millis],
-        ":tm": test_method,
-        ":ms": memory_size
+    query_arguments = {
+        "KeyConditionExpression": Key("PK").eq("MEASUREMENT")
     }
 
-    dynamodb = boto3.resource("dynamodb")
-    result_table = dynamodb.Table(TABLE_NAME)
+    while True:
+        query_result = table.query(**query_arguments)
 
-    result_table.update_item(
-        Key={
-            "PK": "MEASUREMENT",
-            "SK": f"METHOD#{test_method}#MEMORY#{memory_size}"
-        },
-        UpdateExpression=update_expression,
-        ExpressionAttributeNames=expression_attribute_names,
-        ExpressionAttributeValues=expression_attribute_values
-    )
+        yield from query_result["Items"]
 
+        if "LastEvaluatedKey" not in query_result:
+            break
 
-def result_aggregator(event: dict, context):
+        query_arguments["ExclusiveStartKey"] = query_result["LastEvaluatedKey"]
 
-    dynamodb = boto3.resource("dynamodb")
-    result_table = dynamodb.Table(TABLE_NAME)
 
-    query_result = result_table.query(
-        KeyConditionExpression=Key("PK").eq("MEASUREMENT")
-    )
+def iterate_measurement_shards(table) -> typing.Iterable[MeasurementShard]:
+    """
+    Yields the measurements of all shards, this includes items that were
+    written before the measurements were sharded (they're just one big shard).
+    """
+
+    for item in query_measurement_items(table):
+        measurements = {
+            key: value for key, value in item.items() if key not in MEASUREMENT_METADATA_ATTRIBUTES
+        }
+
+        yield MeasurementShard(
+            memory_size=item["memorySize"],
+            test_method=item["testMethod"],
+            measurements=measurements,
+        )
 
-    result_dict = collections.defaultdict(dict)
+
+def result_aggregator(event: dict, context):
+
+    result_table = RECORDER_RESOURCE.Table(TABLE_NAME)
+
+    # memory size -> column -> histogram
+    histograms: typing.Dict[str, typing.Dict[str, LatencyHistogram]] = \
+        collections.defaultdict(lambda: collections.defaultdict(LatencyHistogram))
 
     item_keys = []
     for size in ITEM_SIZES_IN_KB:
         item_keys.append(f"{size}KB_FLAT")
         item_keys.append(f"{size}KB_NESTED")
-    
-    for item in query_result["Items"]:
 
-        memory_size = item["memorySize"]
-        test_method = item["testMethod"]
-        
-        result_dict[memory_size]["memorySize"] = memory_size
+    # The histograms merge the shards of each configuration
+    for shard in iterate_measurement_shards(result_table):
+
+        memory_size = shard.memory_size
+        test_method = shard.test_method
 
         if test_method == "deserialize":
             # Special case for just the parsing
-            
-            flat_values = item["DESERIALIZED_FLAT"]
-            avg_flat_value = int(statistics.mean([int(i) for i in flat_values]))
-            result_dict[memory_size]["DESERIALIZE_FLAT"] = avg_flat_value
 
-            nested_values = item["DESERIALIZED_NESTED"]
-            avg_nested_value = int(statistics.mean([int(i) for i in nested_values]))
-            result_dict[memory_size]["DESERIALIZE_NESTED"] = avg_nested_value
+            histograms[memory_size]["DESERIALIZE_FLAT"].record_all(
+                shard.measurements.get("DESERIALIZED_FLAT", [])
+            )
+            histograms[memory_size]["DESERIALIZE_NESTED"].record_all(
+                shard.measurements.get("DESERIALIZED_NESTED", [])
+            )
 
         else:
 
             for key in item_keys:
-                values = item[key]
+                histograms[memory_size][f"{key}_{test_method[:1].upper()}"].record_all(
+                    shard.measurements.get(key, [])
+                )
 
-                avg_value = int(statistics.mean([int(i) for i in values]))
+    columns = []
+    for key in item_keys:
+        columns.append(f"{key}_C")
+        columns.append(f"{key}_R")
+        columns.append(f"{key}_F")
 
-                result_dict[memory_size][f"{key}_{test_method[:1].upper()}"] = avg_value
+    columns.append("DESERIALIZE_FLAT")
+    columns.append("DESERIALIZE_NESTED")
 
-    
     field_names = ["memorySize"]
-    for key in item_keys:
-        field_names.append(f"{key}_C")
-        field_names.append(f"{key}_R")
-
-    field_names.append("DESERIALIZE_FLAT")
-    field_names.append("DESERIALIZE_NESTED")
+    for column in columns:
+        field_names += summary_field_names(column)
 
     mem_file = io.StringIO()
     writer = csv.DictWriter(
@@ -124,11 +231,17 @@ def result_aggregator(event: dict, context):
         fieldnames=field_names,
         delimiter=";",
     )
-    
+
     writer.writeheader()
-    for value in result_dict.values():
-        writer.writerow(value)
-    
+    for memory_size in sorted(histograms, key=lambda size: int(size) if size.isdigit() else 0):
+
+        row = {"memorySize": memory_size}
+        for column in columns:
+            for stat, value in histograms[memory_size][column].summary().items():
+                row[f"{column}_{stat}"] = value
+
+        writer.writerow(row)
+
     print(mem_file.getvalue())
     return {"csvContent": mem_file.getvalue()}
 
@@ -138,7 +251,7 @@ def self_mutate(function_name: str):
     This results in old execution contexts being discarded for future events.
     """
     
-    lambda_client = boto3.client("lambda")
+    lambda_client = client_factory.get_client("lambda")
     function_config = lambda_client.get_function_configuration(
         FunctionName=function_name
     )
@@ -152,8 +265,9 @@ def self_mutate(function_name: str):
     )
 
 def client_handler(event: dict, context):
-    
-    ddb = boto3.client("dynamodb")
+
+    recorder = MeasurementRecorder(MEMORY_SIZE, shard_id=context.aws_request_id)
+    ddb = DYNAMODB_CLIENT
 
     # Get a sample item to make sure the connection to DynamoDB is already established.
     ddb.get_item(TableName=TABLE_NAME, Key={"PK": {"S": "ITEM"}, "SK": {"S": "META"}})
@@ -183,8 +297,7 @@ def client_handler(event: dict, context):
 
         print(f"Read the {size}KB flat item in {time_it_took_in_millis}ms and consumed {capacity_units} capacity units.")
 
-        record_measurement_result(
-            memory_size=MEMORY_SIZE,
+        recorder.record(
             item_size=f"{size}KB_FLAT",
             test_method="client",
             time_in_millis=time_it_took_in_millis
@@ -213,15 +326,19 @@ def client_handler(event: dict, context):
 
         print(f"Read the {size}KB nested item in {time_it_took_in_millis}ms and consumed {capacity_units} capacity units.")
 
-        record_measurement_result(
-            memory_size=MEMORY_SIZE,
+        recorder.record(
             item_size=f"{size}KB_NESTED",
             test_method="client",
             time_in_millis=time_it_took_in_millis
         )
 
+    # Write all measurements of this invocation at once
+    recorder.flush()
+
 def resource_handler(event: dict, context):
 
+    recorder = MeasurementRecorder(MEMORY_SIZE, shard_id=context.aws_request_id)
+
     # Measurements for pure json data
     with open(FLAT_JSON_PATH) as flat_file, open(NESTED_JSON_PATH) as nested_file:
         flat_file_content = flat_file.read()
@@ -236,8 +353,7 @@ def resource_handler(event: dict, context):
 
         print(f"Deserialized the 400KB flat item in {time_it_took_in_millis}ms from disk.")
 
-        record_measurement_result(
-            memory_size=MEMORY_SIZE,
+        recorder.record(
             item_size=f"DESERIALIZED_FLAT",
             test_method="deserialize",
             time_in_millis=time_it_took_in_millis
@@ -252,15 +368,14 @@ def resource_handler(event: dict, context):
 
         print(f"Deserialized the 400KB nested item in {time_it_took_in_millis}ms from disk.")
 
-        record_measurement_result(
-            memory_size=MEMORY_SIZE,
+        recorder.record(
             item_size=f"DESERIALIZED_NESTED",
             test_method="deserialize",
             time_in_millis=time_it_took_in_millis
         )
 
 
-    table = boto3.resource("dynamodb").Table(TABLE_NAME)
+    table = DYNAMODB_RESOURCE.Table(TABLE_NAME)
 
     # Get a sample item to make sure the connection to DynamoDB is already established.
     table.get_item(Key={"PK": "ITEM", "SK": "META"})
@@ -289,8 +404,7 @@ def resource_handler(event: dict, context):
 
         print(f"Read the {size}KB flat item in {time_it_took_in_millis}ms and consumed {capacity_units} capacity units.")
 
-        record_measurement_result(
-            memory_size=MEMORY_SIZE,
+        recorder.record(
             item_size=f"{size}KB_FLAT",
             test_method="resource",
             time_in_millis=time_it_took_in_millis
@@ -318,15 +432,54 @@ def resource_handler(event: dict, context):
 
         print(f"Read the {size}KB nested item in {time_it_took_in_millis}ms and consumed {capacity_units} capacity units.")
 
-        record_measurement_result(
-            memory_size=MEMORY_SIZE,
+        recorder.record(
             item_size=f"{size}KB_NESTED",
             test_method="resource",
             time_in_millis=time_it_took_in_millis
         )
 
+    # Write all measurements of this invocation at once
+    recorder.flush()
+
+def fast_resource_handler(event: dict, context):
+    """Like the resource handler, but reads through the client and the FastDeserializer."""
+
+    recorder = MeasurementRecorder(MEMORY_SIZE, shard_id=context.aws_request_id)
+    ddb = DYNAMODB_CLIENT
+
+    # Get a sample item to make sure the connection to DynamoDB is already established.
+    fast_deserializer.get_item(ddb, TABLE_NAME, {"PK": "ITEM", "SK": "META"}, FAST_DESERIALIZER)
+
+    for size in ITEM_SIZES_IN_KB:
+        for item_type in ["FLAT", "NESTED"]:
+
+            started_at = datetime.now()
+
+            response = fast_deserializer.get_item(
+                ddb,
+                TABLE_NAME,
+                {"PK": "ITEM", "SK": f"{str(size).zfill(3)}KB_{item_type}"},
+                FAST_DESERIALIZER,
+                ReturnConsumedCapacity="TOTAL"
+            )
+
+            finished_at = datetime.now()
+            capacity_units = response["ConsumedCapacity"]["CapacityUnits"]
+
+            time_it_took_in_millis = int((finished_at - started_at).total_seconds() * 1000)
+
+            print(f"Read the {size}KB {item_type.lower()} item in {time_it_took_in_millis}ms and consumed {capacity_units} capacity units.")
+
+            recorder.record(
+                item_size=f"{size}KB_{item_type}",
+                test_method="fast",
+                time_in_millis=time_it_took_in_millis
+            )
+
+    # Write all measurements of this invocation at once
+    recorder.flush()
+
 def create_flat_item_of_size(size_in_kb: int) -> dict:
-    # based on calculations here: https://zaccharles.github.io/dynamodb-calculator/
 
     if size_in_kb not in range(1, 401):
         raise ValueError("Item size has to be between 1 and 400 KB")
@@ -336,19 +489,18 @@ def create_flat_item_of_size(size_in_kb: int) -> dict:
             "S": "ITEM"
         },
         "SK": {
-            "S": "000KB_FLAT"
+            "S": f"{str(size_in_kb).zfill(3)}KB_FLAT"
         },
         "payload": {
             "S": ""
         }
-    } # This is 25 bytes
-    template["SK"]["S"] = f"{str(size_in_kb).zfill(3)}KB_FLAT"
-    payload = "X" * (1024 * size_in_kb - 25)
+    }
+
+    payload = "X" * (1024 * size_in_kb - item_size.item_size(template))
     template["payload"]["S"] = payload
     return template
 
 def create_nested_item_of_size(size_in_kb: int) -> dict:
-    # based on calculations here: https://zaccharles.github.io/dynamodb-calculator/
 
     if size_in_kb not in range(1, 401):
         raise ValueError("Item size has to be between 1 and 400 KB")
@@ -358,12 +510,12 @@ def create_nested_item_of_size(size_in_kb: int) -> dict:
             "S": "ITEM"
         },
         "SK": {
-            "S": "000KB_NESTED"
+            "S": f"{str(size_in_kb).zfill(3)}KB_NESTED"
         },
         "payload": {
             "L": []
         }
-    } # This is 30 bytes
+    }
 
     list_item = {
         "M": {
@@ -377,18 +529,18 @@ def create_nested_item_of_size(size_in_kb: int) -> dict:
                 "S": "123"
             }
         }
-    }  # 36 bytes
+    }
 
-    number_of_items = int((1024 * size_in_kb - 30) / 36)
+    list_item_size = item_size.CONTAINER_ELEMENT_OVERHEAD_IN_BYTES + item_size.attribute_value_size(list_item)
+    number_of_items = int((1024 * size_in_kb - item_size.item_size(template)) / list_item_size)
 
-    template["SK"]["S"] = f"{str(size_in_kb).zfill(3)}KB_NESTED"
     for _ in range(number_of_items):
         template["payload"]["L"].append(list_item)
     return template
 
 def create_sample_items():
 
-    ddb_client = boto3.client("dynamodb")
+    ddb_client = DYNAMODB_CLIENT
 
     for size in ITEM_SIZES_IN_KB:
         item = create_flat_item_of_size(size)
@@ -422,12 +574,33 @@ def create_sample_items():
     
 
 def invoke_handler(event: dict, context):
-
-    sns_topic = boto3.resource("sns").Topic(INVOKER_TOPIC_ARN)
+    """
+    Sends n messages to the invoker topic, the event looks like this:
+
+    {
+        "n": 100,                   # number of invocations
+        "mode": "sequential",       # or "fanout"
+        "concurrency": 10,          # fanout: number of parallel publishers
+        "rampUpSeconds": 0,         # fanout: time until the peak rate is reached
+        "rampUpProfile": "linear"   # fanout: none, linear or step
+    }
+    """
 
     create_sample_items()
 
     n = int(event.get("n", 100))
+    mode = event.get("mode", "sequential")
+
+    if mode == "fanout":
+        return benchmark_driver.fan_out(
+            topic_arn=INVOKER_TOPIC_ARN,
+            n=n,
+            concurrency=int(event.get("concurrency", 10)),
+            ramp_up_seconds=float(event.get("rampUpSeconds", 0)),
+            ramp_up_profile=event.get("rampUpProfile", "linear"),
+        )
+
+    sns_topic = client_factory.get_resource("sns").Topic(INVOKER_TOPIC_ARN)
 
     for _ in range(n):
         sns_topic.publish(Message="Go for it.")
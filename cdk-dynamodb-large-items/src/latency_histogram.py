@@ -0,0 +1,124 @@
+"""
+A small fixed-bucket latency histogram in the spirit of HdrHistogram.
+
+Samples are folded into logarithmic buckets that are linearly subdivided,
+which keeps the relative error per bucket bounded while the memory footprint
+stays constant no matter how many samples we record.
+"""
+import math
+import typing
+
+# The percentiles we report for each histogram
+REPORTED_PERCENTILES = [50, 90, 99]
+
+
+class LatencyHistogram:
+
+    def __init__(self, significant_bits: int = 5):
+        """
+        significant_bits controls the precision, each power of two gets
+        2 ** significant_bits sub-buckets, 5 bits equal roughly 3% relative error.
+        Values below 2 ** (significant_bits + 1) are recorded exactly.
+        """
+
+        if significant_bits < 1:
+            raise ValueError("significant_bits has to be at least 1")
+
+        self.significant_bits = significant_bits
+        self.sub_bucket_count = 2 ** significant_bits
+
+        self.count = 0
+        self.min_value: typing.Optional[int] = None
+        self.max_value: typing.Optional[int] = None
+
+        # bucket index -> number of samples in that bucket
+        self._counts: typing.Dict[int, int] = {}
+
+    def _index_for(self, value: int) -> int:
+
+        shift = value.bit_length() - (self.significant_bits + 1)
+        if shift <= 0:
+            return value
+
+        return shift * self.sub_bucket_count + (value >> shift)
+
+    def _highest_value_in(self, index: int) -> int:
+
+        if index < 2 * self.sub_bucket_count:
+            return index
+
+        shift = index // self.sub_bucket_count - 1
+        sub_bucket = index - shift * self.sub_bucket_count
+        return ((sub_bucket + 1) << shift) - 1
+
+    def record(self, value: int, count: int = 1):
+
+        value = int(value)
+        if value < 0:
+            raise ValueError(f"Can't record negative latencies, got {value}")
+
+        index = self._index_for(value)
+        self._counts[index] = self._counts.get(index, 0) + count
+        self.count += count
+
+        if self.min_value is None or value < self.min_value:
+            self.min_value = value
+        if self.max_value is None or value > self.max_value:
+            self.max_value = value
+
+    def record_all(self, values: typing.Iterable[int]):
+        for value in values:
+            self.record(value)
+
+    def merge(self, other: "LatencyHistogram"):
+
+        if other.significant_bits != self.significant_bits:
+            raise ValueError("Can only merge histograms with the same precision")
+
+        for index, count in other._counts.items():
+            self._counts[index] = self._counts.get(index, 0) + count
+
+        self.count += other.count
+
+        for value in (other.min_value, other.max_value):
+            if value is None:
+                continue
+            if self.min_value is None or value < self.min_value:
+                self.min_value = value
+            if self.max_value is None or value > self.max_value:
+                self.max_value = value
+
+    def percentile(self, percentile: float) -> typing.Optional[int]:
+        """
+        Returns the highest value that is equivalent to the bucket the given
+        percentile falls into, or None if the histogram is empty.
+        """
+
+        if not 0 <= percentile <= 100:
+            raise ValueError("The percentile has to be between 0 and 100")
+
+        if self.count == 0:
+            return None
+
+        rank = max(1, math.ceil(percentile / 100 * self.count))
+
+        seen = 0
+        for index in sorted(self._counts):
+            seen += self._counts[index]
+            if seen >= rank:
+                # The bucket boundary may be larger than anything we've actually seen
+                return min(self._highest_value_in(index), self.max_value)
+
+        return self.max_value
+
+    def summary(self) -> typing.Dict[str, typing.Optional[int]]:
+        """Returns the reported percentiles and the maximum, e.g. {"P50": 12, ..., "MAX": 80}"""
+
+        result = {f"P{p}": self.percentile(p) for p in REPORTED_PERCENTILES}
+        result["MAX"] = self.max_value
+        return result
+
+
+def summary_field_names(prefix: str) -> typing.List[str]:
+    """Column names for the summary of a histogram, e.g. 4KB_FLAT_C_P50"""
+    return [f"{prefix}_P{p}" for p in REPORTED_PERCENTILES] + [f"{prefix}_MAX"]
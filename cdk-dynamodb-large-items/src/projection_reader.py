@@ -0,0 +1,192 @@
+"""
+Reads slices of large items with projection expressions instead of fetching everything.
+
+A LazyList fetches a list attribute in chunks of list indexes, e.g. payload[0]
+to payload[249], so processing can start before the whole item is read and
+only one chunk is in memory at any time. get_paths reads selected map paths.
+
+Note: DynamoDB bills a read by the size of the whole item, projections only
+reduce the amount of data that's transferred and deserialized.
+"""
+import re
+import typing
+
+from boto3.dynamodb.types import TypeSerializer
+
+from fast_deserializer import FastDeserializer
+
+# Expressions are limited to 4 KB
+MAX_EXPRESSION_LENGTH = 4096
+
+# "#attr[12345], " takes up 14 characters, this stays well below the limit
+MAX_CHUNK_SIZE = 250
+
+_PATH_ELEMENT_PATTERN = re.compile(r"^([^\[\]]+)((?:\[\d+\])*)$")
+
+
+def _serialize_key(key: dict) -> dict:
+    serializer = TypeSerializer()
+    return {name: serializer.serialize(value) for name, value in key.items()}
+
+
+class LazyList:
+    """
+    A list attribute of a single item that's read in chunks when it's accessed.
+
+    Iterating over it streams the elements chunk by chunk, indexing fetches the
+    chunk that contains the index. The length isn't known until the end of the
+    list has been read once.
+    """
+
+    def __init__(
+            self,
+            client,
+            table_name: str,
+            key: dict,
+            attribute_name: str = "payload",
+            chunk_size: int = MAX_CHUNK_SIZE,
+            deserializer: typing.Optional[FastDeserializer] = None,
+            consistent_read: bool = False,
+        ):
+
+        if not 1 <= chunk_size <= MAX_CHUNK_SIZE:
+            raise ValueError(f"The chunk size has to be between 1 and {MAX_CHUNK_SIZE}")
+
+        self.client = client
+        self.table_name = table_name
+        self.key = _serialize_key(key)
+        self.attribute_name = attribute_name
+        self.chunk_size = chunk_size
+        self.deserializer = deserializer or FastDeserializer()
+        self.consistent_read = consistent_read
+
+        self.length: typing.Optional[int] = None
+        self.requests = 0
+
+        # Only the most recently fetched chunk is kept in memory
+        self._chunk_start: typing.Optional[int] = None
+        self._chunk: typing.List[typing.Any] = []
+
+    def fetch_chunk(self, start: int) -> typing.List[typing.Any]:
+        """Fetches the elements start to start + chunk_size - 1, the result is shorter at the end of the list."""
+
+        if self.length is not None and start >= self.length:
+            return []
+
+        projection_expression = ", ".join(
+            f"#attr[{idx}]" for idx in range(start, start + self.chunk_size)
+        )
+
+        response = self.client.get_item(
+            TableName=self.table_name,
+            Key=self.key,
+            ProjectionExpression=projection_expression,
+            ExpressionAttributeNames={"#attr": self.attribute_name},
+            ConsistentRead=self.consistent_read,
+        )
+        self.requests += 1
+
+        attribute_value = response.get("Item", {}).get(self.attribute_name, {"L": []})
+        chunk = self.deserializer.deserialize(attribute_value)
+
+        if len(chunk) < self.chunk_size:
+            # We've reached the end of the list
+            self.length = start + len(chunk)
+
+        self._chunk_start, self._chunk = start, chunk
+        return chunk
+
+    def chunks(self) -> typing.Iterator[typing.List[typing.Any]]:
+        """Yields the list chunk by chunk."""
+
+        start = 0
+        while True:
+            chunk = self.fetch_chunk(start)
+            if chunk:
+                yield chunk
+            if len(chunk) < self.chunk_size:
+                return
+            start += self.chunk_size
+
+    def __iter__(self) -> typing.Iterator[typing.Any]:
+        for chunk in self.chunks():
+            yield from chunk
+
+    def __getitem__(self, index: int) -> typing.Any:
+
+        if not isinstance(index, int):
+            raise TypeError("LazyList indexes must be integers")
+
+        if index < 0:
+            if self.length is None:
+                # We need to find the end of the list first
+                for _ in self.chunks():
+                    pass
+            index += self.length
+
+        if index < 0 or (self.length is not None and index >= self.length):
+            raise IndexError("LazyList index out of range")
+
+        chunk_start = index - index % self.chunk_size
+        chunk = self._chunk if chunk_start == self._chunk_start else self.fetch_chunk(chunk_start)
+
+        if index - chunk_start >= len(chunk):
+            raise IndexError("LazyList index out of range")
+
+        return chunk[index - chunk_start]
+
+
+def _path_to_expression(path: str, attribute_names: typing.Dict[str, str]) -> str:
+    """Turns a path like payload.meta[2].author into #p0.#p1[2].#p2 and records the placeholders."""
+
+    expression_elements = []
+
+    for element in path.split("."):
+        match = _PATH_ELEMENT_PATTERN.match(element)
+        if match is None:
+            raise ValueError(f"Invalid path: {path}")
+
+        name, indexes = match.groups()
+
+        # Reuse the placeholder if we've already seen the name
+        placeholder = next(
+            (placeholder for placeholder, value in attribute_names.items() if value == name),
+            f"#p{len(attribute_names)}"
+        )
+        attribute_names[placeholder] = name
+
+        expression_elements.append(placeholder + indexes)
+
+    return ".".join(expression_elements)
+
+
+def get_paths(
+        client,
+        table_name: str,
+        key: dict,
+        paths: typing.List[str],
+        deserializer: typing.Optional[FastDeserializer] = None,
+        consistent_read: bool = False,
+    ) -> dict:
+    """
+    Reads only the given document paths of an item, e.g. ["payload[0].time", "meta.author"].
+    The result keeps the structure of the item, but only contains the projected values.
+    """
+
+    deserializer = deserializer or FastDeserializer()
+
+    attribute_names: typing.Dict[str, str] = {}
+    projection_expression = ", ".join(_path_to_expression(path, attribute_names) for path in paths)
+
+    if len(projection_expression) > MAX_EXPRESSION_LENGTH:
+        raise ValueError("Too many paths for a single projection expression")
+
+    response = client.get_item(
+        TableName=table_name,
+        Key=_serialize_key(key),
+        ProjectionExpression=projection_expression,
+        ExpressionAttributeNames=attribute_names,
+        ConsistentRead=consistent_read,
+    )
+
+    return deserializer.deserialize_item(response.get("Item", {}))
@@ -110,6 +110,60 @@ class CdkPythonLambdaInitStack(core.Stack):
                 )
             )
 
+            # Build the function that profiles the phases of the boto3 initialization
+            profile_function = _lambda.Function(
+                self,
+                id=f"measurement-init-profile-{current_mem_size}-mb",
+                code=lambda_code_asset,
+                environment={
+                    "TEST_METHOD": "profile",
+                    "MEMORY_SIZE": str(current_mem_size),
+                    "TABLE_NAME": result_table.table_name
+                },
+                handler="init_profiler.profile_handler",
+                runtime=_lambda.Runtime.PYTHON_3_8,
+                memory_size=current_mem_size
+            )
+
+            profile_function.add_event_source(
+                lambda_event_sources.SnsEventSource(invoker_topic)
+            )
+
+            result_table.grant_read_write_data(profile_function)
+
+            # Allow for self-mutating function
+            profile_function.add_to_role_policy(
+                iam.PolicyStatement(
+                    actions=[
+                        "lambda:getFunctionConfiguration",
+                        "lambda:updateFunctionConfiguration",
+                    ],
+                    # CFN screams at me with circular dependencies if I use the ref here.
+                    resources=["*"]
+                )
+            )
+
+            # Build the function that compares clients per invocation with the client factory
+            factory_function = _lambda.Function(
+                self,
+                id=f"measurement-client-factory-{current_mem_size}-mb",
+                code=lambda_code_asset,
+                environment={
+                    "TEST_METHOD": "factory",
+                    "MEMORY_SIZE": str(current_mem_size),
+                    "TABLE_NAME": result_table.table_name
+                },
+                handler="factory_handler.factory_handler",
+                runtime=_lambda.Runtime.PYTHON_3_8,
+                memory_size=current_mem_size
+            )
+
+            factory_function.add_event_source(
+                lambda_event_sources.SnsEventSource(invoker_topic)
+            )
+
+            result_table.grant_read_write_data(factory_function)
+
             current_mem_size += LAMBDA_MEMORY_INCREMENTS_IN_MB
 
         # The function to gather and aggregate the measurements
@@ -122,7 +176,9 @@ class CdkPythonLambdaInitStack(core.Stack):
             },
             handler="lambda_handler.result_aggregator",
             runtime=_lambda.Runtime.PYTHON_3_8,
-            memory_size=1024
+            memory_size=1024,
+            # Reading all measurement shards takes a while for large experiments
+            timeout=core.Duration.seconds(300),
         )
 
         result_table.grant_read_write_data(result_aggregator)
@@ -137,7 +193,9 @@ class CdkPythonLambdaInitStack(core.Stack):
             },
             handler="lambda_handler.invoke_handler",
             runtime=_lambda.Runtime.PYTHON_3_8,
-            memory_size=1024
+            memory_size=1024,
+            # A ramped up fan-out may take a few minutes
+            timeout=core.Duration.seconds(300),
         )
 
         invoker_topic.grant_publish(invoker)
@@ -0,0 +1,130 @@
+"""
+Fans out the experiment invocations through SNS in parallel.
+
+Messages are published in batches of 10 (the maximum of publish_batch) from
+a pool of threads. The ramp-up profile determines when each batch is sent,
+which allows us to put the functions under controlled parallel load instead
+of a trickle of single messages.
+"""
+import concurrent.futures
+import logging
+import math
+import time
+import typing
+
+import client_factory
+
+LOGGER = logging.getLogger(__name__)
+
+# publish_batch accepts at most 10 entries per call
+SNS_MAX_BATCH_SIZE = 10
+
+RAMP_UP_PROFILES = ["none", "linear", "step"]
+
+# Number of steps for the step profile
+RAMP_UP_STEPS = 5
+
+
+def batch_start_offsets(number_of_batches: int, ramp_up_seconds: float, profile: str) -> typing.List[float]:
+    """
+    Computes when each batch should be published, relative to the start of the run.
+
+    - none: everything is published right away
+    - linear: the publish rate grows linearly until it peaks after ramp_up_seconds
+    - step: the batches are published in RAMP_UP_STEPS equally sized waves
+    """
+
+    if profile not in RAMP_UP_PROFILES:
+        raise ValueError(f"Unknown ramp-up profile {profile}, choose one of {RAMP_UP_PROFILES}")
+
+    if profile == "none" or ramp_up_seconds <= 0 or number_of_batches == 0:
+        return [0.0] * number_of_batches
+
+    if profile == "linear":
+        # A linearly increasing rate means the number of sent batches grows quadratically
+        return [ramp_up_seconds * math.sqrt(idx / number_of_batches) for idx in range(number_of_batches)]
+
+    batches_per_step = math.ceil(number_of_batches / RAMP_UP_STEPS)
+    return [
+        ramp_up_seconds * (idx // batches_per_step) / RAMP_UP_STEPS for idx in range(number_of_batches)
+    ]
+
+
+def _publish_batch(sns_client, topic_arn: str, entries: typing.List[dict], not_before: float) -> int:
+    """Publishes the entries once not_before (perf_counter) has passed, returns the number of failures."""
+
+    delay = not_before - time.perf_counter()
+    if delay > 0:
+        time.sleep(delay)
+
+    response = sns_client.publish_batch(
+        TopicArn=topic_arn,
+        PublishBatchRequestEntries=entries
+    )
+
+    failed_ids = {failure["Id"] for failure in response.get("Failed", [])}
+    if failed_ids:
+        # Try the failed ones one more time, throttling is the usual suspect here
+        response = sns_client.publish_batch(
+            TopicArn=topic_arn,
+            PublishBatchRequestEntries=[entry for entry in entries if entry["Id"] in failed_ids]
+        )
+
+    for failure in response.get("Failed", []):
+        LOGGER.warning("Failed to publish message %s: %s", failure["Id"], failure.get("Message"))
+
+    return len(response.get("Failed", []))
+
+
+def fan_out(
+        topic_arn: str,
+        n: int,
+        concurrency: int = 10,
+        ramp_up_seconds: float = 0,
+        ramp_up_profile: str = "linear",
+        message: str = "Go for it.",
+    ) -> dict:
+    """
+    Publishes n messages to the topic using a pool of `concurrency` threads.
+    Returns some statistics about the run.
+    """
+
+    if concurrency < 1:
+        raise ValueError("The concurrency has to be at least 1")
+
+    # Clients are thread safe, resources aren't
+    sns_client = client_factory.get_client("sns")
+
+    batches = [
+        [
+            {"Id": str(message_id), "Message": message}
+            for message_id in range(batch_start, min(batch_start + SNS_MAX_BATCH_SIZE, n))
+        ]
+        for batch_start in range(0, n, SNS_MAX_BATCH_SIZE)
+    ]
+
+    offsets = batch_start_offsets(len(batches), ramp_up_seconds, ramp_up_profile)
+
+    started_at = time.perf_counter()
+    failed = 0
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [
+            executor.submit(_publish_batch, sns_client, topic_arn, entries, started_at + offset)
+            for entries, offset in zip(batches, offsets)
+        ]
+
+        for future in concurrent.futures.as_completed(futures):
+            failed += future.result()
+
+    duration = time.perf_counter() - started_at
+
+    result = {
+        "published": n - failed,
+        "failed": failed,
+        "durationSeconds": round(duration, 3),
+        "messagesPerSecond": round((n - failed) / duration, 1) if duration > 0 else None,
+    }
+
+    LOGGER.info("Fan-out finished: %s", result)
+    return result
@@ -0,0 +1,46 @@
+"""
+Measures what a client costs per invocation with and without the client factory.
+
+This lives in its own module, because preloading the clients at import time
+would ruin the cold start measurements of the handlers in lambda_handler.
+"""
+import os
+import time
+
+import boto3
+
+import client_factory
+import lambda_handler
+
+MEMORY_SIZE = str(os.environ.get("MEMORY_SIZE", "N/A"))
+
+# Happens during the init phase of the execution context
+client_factory.preload("dynamodb")
+
+
+def factory_handler(event: dict, context):
+    """
+    Times getting a DynamoDB client in a warm execution context, once with
+    boto3.client and once from the client factory. Results are in microseconds.
+    """
+
+    started_at = time.perf_counter_ns()
+    boto3.client("dynamodb")
+    boto3_client_us = (time.perf_counter_ns() - started_at) // 1000
+
+    started_at = time.perf_counter_ns()
+    client_factory.get_client("dynamodb")
+    factory_client_us = (time.perf_counter_ns() - started_at) // 1000
+
+    print(f"boto3.client took {boto3_client_us}us, the client factory took {factory_client_us}us.")
+
+    for test_method, duration_in_us in [
+            ("invocation_boto3_client_us", boto3_client_us),
+            ("invocation_factory_client_us", factory_client_us),
+        ]:
+        lambda_handler.record_measurement_result(
+            memory_size=MEMORY_SIZE,
+            test_method=test_method,
+            time_in_micros=duration_in_us,
+            shard_id=context.aws_request_id
+        )
@@ -0,0 +1,265 @@
+"""
+Breaks the cold start of the first boto3 client down into its phases.
+
+The phases are timed in this order:
+
+- import_boto3: importing boto3 and everything it needs
+- create_session: creating a boto3 session
+- load_models: the botocore loader parsing the service model, endpoint rule set and endpoints JSON files
+- resolve_credentials: running through the credential provider chain
+- create_client: creating the client, once the models and credentials are available
+- resolve_endpoint: evaluating the endpoint rule set for the first request
+
+Additionally, the import time of each module is recorded, similar to `python -X importtime`.
+
+This module must not import boto3 at the top, otherwise we couldn't measure it.
+In Lambda use profile_handler, locally run `python src/init_profiler.py --samples 20`,
+which profiles each sample in a fresh interpreter.
+"""
+import argparse
+import collections
+import importlib
+import importlib.abc
+import json
+import os
+import subprocess
+import sys
+import time
+import typing
+
+PHASES = [
+    "import_boto3",
+    "create_session",
+    "load_models",
+    "resolve_credentials",
+    "create_client",
+    "resolve_endpoint",
+]
+
+MEMORY_SIZE = str(os.environ.get("MEMORY_SIZE", "N/A"))
+
+COLD_START = True
+
+
+class _TimedLoader(importlib.abc.Loader):
+    """Wraps a loader to time how long executing the module takes."""
+
+    def __init__(self, loader, timer: "ImportTimer"):
+        self._loader = loader
+        self._timer = timer
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+
+        # Children add their cumulative time to our entry on the stack
+        entry = [time.perf_counter_ns(), 0]
+        self._timer._stack.append(entry)
+
+        try:
+            self._loader.exec_module(module)
+        finally:
+            self._timer._stack.pop()
+            cumulative = time.perf_counter_ns() - entry[0]
+
+            if self._timer._stack:
+                self._timer._stack[-1][1] += cumulative
+
+            self._timer.self_time_us[module.__name__] = (cumulative - entry[1]) // 1000
+            self._timer.cumulative_time_us[module.__name__] = cumulative // 1000
+
+            # Don't leave the wrapper behind
+            if getattr(module, "__loader__", None) is self:
+                module.__loader__ = self._loader
+            if getattr(module, "__spec__", None) is not None and module.__spec__.loader is self:
+                module.__spec__.loader = self._loader
+
+
+class ImportTimer(importlib.abc.MetaPathFinder):
+    """
+    Records the self and cumulative import time of each module that is
+    imported while it's active, use it as a context manager.
+    """
+
+    def __init__(self):
+        self.self_time_us: typing.Dict[str, int] = {}
+        self.cumulative_time_us: typing.Dict[str, int] = {}
+        self._stack: typing.List[typing.List[int]] = []
+        self._finding: typing.Set[str] = set()
+
+    def find_spec(self, fullname, path, target=None):
+
+        if fullname in self._finding:
+            return None
+
+        self._finding.add(fullname)
+        try:
+            for finder in sys.meta_path:
+                if finder is self or not hasattr(finder, "find_spec"):
+                    continue
+
+                spec = finder.find_spec(fullname, path, target)
+                if spec is not None:
+                    if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+                        spec.loader = _TimedLoader(spec.loader, self)
+                    return spec
+
+            return None
+        finally:
+            self._finding.discard(fullname)
+
+    def __enter__(self) -> "ImportTimer":
+        sys.meta_path.insert(0, self)
+        return self
+
+    def __exit__(self, *args):
+        sys.meta_path.remove(self)
+
+    def self_time_by_package(self) -> typing.Dict[str, int]:
+        """Sums up the self time per top level package, e.g. botocore.client -> botocore"""
+
+        result = collections.Counter()
+        for module_name, self_time in self.self_time_us.items():
+            result[module_name.split(".")[0]] += self_time
+        return dict(result.most_common())
+
+
+def profile_initialization(service_name: str = "dynamodb", region_name: typing.Optional[str] = None) -> dict:
+    """
+    Profiles the initialization of the first client for the service.
+    The phase durations and the import times per package are in microseconds.
+    """
+
+    if "boto3" in sys.modules:
+        raise RuntimeError("Boto3 is already imported, this would ruin the measurements!")
+
+    phases = {}
+
+    def _timed(phase: str, function: typing.Callable):
+        started_at = time.perf_counter_ns()
+        result = function()
+        phases[phase] = (time.perf_counter_ns() - started_at) // 1000
+        return result
+
+    with ImportTimer() as import_timer:
+        boto3 = _timed("import_boto3", lambda: importlib.import_module("boto3"))
+
+    session = _timed(
+        "create_session",
+        lambda: boto3.session.Session(region_name=region_name or os.environ.get("AWS_REGION", "eu-central-1"))
+    )
+
+    def _load_models():
+        # The loader caches the parsed files, so the client creation won't parse them again.
+        loader = session._session.get_component("data_loader")
+        loader.load_service_model(service_name, "service-2")
+        loader.load_service_model(service_name, "endpoint-rule-set-1")
+        loader.load_data("endpoints")
+        loader.load_data("partitions")
+
+    _timed("load_models", _load_models)
+    _timed("resolve_credentials", session.get_credentials)
+    client = _timed("create_client", lambda: session.client(service_name))
+
+    def _resolve_endpoint():
+        operation_name = client.meta.service_model.operation_names[0]
+        operation_model = client.meta.service_model.operation_model(operation_name)
+        return client._ruleset_resolver.construct_endpoint(operation_model, {}, {})
+
+    _timed("resolve_endpoint", _resolve_endpoint)
+
+    return {
+        "phases": phases,
+        "importTimeByPackage": import_timer.self_time_by_package(),
+    }
+
+
+def profile_handler(event: dict, context):
+    """Profiles the cold start in Lambda and records the phases in the result table."""
+
+    global COLD_START
+
+    # Importing these here keeps boto3 out of the measurements
+    if not COLD_START:
+        import lambda_handler
+        lambda_handler.self_mutate(context.function_name)
+        raise RuntimeError("Boto3 is already cached, this would ruin the measurements!")
+
+    COLD_START = False
+
+    profile = profile_initialization()
+    print(json.dumps(profile))
+
+    import lambda_handler
+
+    for phase, duration_in_us in profile["phases"].items():
+        lambda_handler.record_measurement_result(
+            memory_size=MEMORY_SIZE,
+            test_method=f"profile_{phase}_us",
+            time_in_micros=duration_in_us,
+            shard_id=f"{context.aws_request_id}#{phase}"
+        )
+
+    # Update the function to clear up existing execution contexts
+    lambda_handler.self_mutate(context.function_name)
+
+
+def _profile_in_subprocess(service_name: str) -> dict:
+
+    output = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            f"import json, init_profiler; print(json.dumps(init_profiler.profile_initialization({service_name!r})))",
+        ],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+
+    return json.loads(output.stdout)
+
+
+def main():
+
+    from latency_histogram import LatencyHistogram
+
+    parser = argparse.ArgumentParser(description="Profile the boto3 client initialization, one fresh interpreter per sample.")
+    parser.add_argument("--samples", "-n", type=int, default=10)
+    parser.add_argument("--service", "-s", default="dynamodb")
+    parser.add_argument("--top", type=int, default=10, help="Number of packages to show the import times for")
+    parsed = parser.parse_args()
+
+    phase_histograms = collections.defaultdict(LatencyHistogram)
+    package_histograms = collections.defaultdict(LatencyHistogram)
+
+    for sample in range(parsed.samples):
+        profile = _profile_in_subprocess(parsed.service)
+
+        for phase, duration in profile["phases"].items():
+            phase_histograms[phase].record(duration)
+        for package, duration in profile["importTimeByPackage"].items():
+            package_histograms[package].record(duration)
+
+        print(f"Sample {sample + 1}/{parsed.samples} done.", file=sys.stderr)
+
+    print("{0:>30} {1:>10} {2:>10} {3:>10}".format("phase / package (us)", "p50", "p90", "max"))
+
+    for phase in PHASES:
+        summary = phase_histograms[phase].summary()
+        print("{0:>30} {P50:>10} {P90:>10} {MAX:>10}".format(phase, **summary))
+
+    print()
+
+    by_median = sorted(package_histograms.items(), key=lambda item: item[1].percentile(50), reverse=True)
+    for package, histogram in by_median[:parsed.top]:
+        print("{0:>30} {P50:>10} {P90:>10} {MAX:>10}".format(f"import {package}", **histogram.summary()))
+
+
+if __name__ == "__main__":
+    main()
@@ -4,13 +4,18 @@ import io
 import logging
 import os
 import random
-import statistics
+import typing
+import uuid
 
 from datetime import datetime
 
 import boto3
 from boto3.dynamodb.conditions import Key
 
+import benchmark_driver
+import client_factory
+from latency_histogram import LatencyHistogram, summary_field_names
+
 
 LOGGER = logging.getLogger(__name__)
 LOGGER.setLevel(logging.DEBUG)
@@ -21,38 +26,69 @@ INVOKER_TOPIC_ARN = os.environ.get("INVOKER_TOPIC_ARN", "N/A")
 
 COLD_START = True
 
-def record_measurement_result(memory_size: str, test_method: str, time_in_millis: int):
-    
+MeasurementShard = collections.namedtuple(
+    typename="MeasurementShard",
+    field_names=[
+        "memory_size",
+        "test_method",
+        "measurements",
+    ]
+)
+
+def record_measurement_result(
+        memory_size: str,
+        test_method: str,
+        time_in_millis: typing.Optional[int] = None,
+        shard_id: typing.Optional[str] = None,
+        time_in_micros: typing.Optional[int] = None
+    ):
+    """
+    Records the measurement in its own shard (usually one per invocation),
+    so a single item never grows past the 400 KB item size limit.
+
+    Pass either time_in_millis or time_in_micros, the unit is stored with the item.
+    """
+
+    if (time_in_millis is None) == (time_in_micros is None):
+        raise ValueError("Pass either time_in_millis or time_in_micros")
+
+    measurement, unit = (time_in_millis, "ms") if time_in_micros is None else (time_in_micros, "us")
+
+    shard_id = shard_id or uuid.uuid4().hex
+
     LOGGER.debug(
-        "Recording result for a %s call with memory size %s that took %s ms",
+        "Recording result for a %s call with memory size %s that took %s %s",
         test_method,
         memory_size,
-        time_in_millis
+        measurement,
+        unit
     )
 
     update_expression = "SET #measures = list_append(if_not_exists(#measures, :empty_list), :measurements)" \
-        + ", #tm = :tm, #ms = :ms"
+        + ", #tm = :tm, #ms = :ms, #unit = :unit"
 
     expression_attribute_names = {
         "#measures": "measurements",
         "#tm": "testMethod",
         "#ms": "memorySize",
+        "#unit": "unit",
     }
 
     expression_attribute_values = {
         ":empty_list": [],
-        ":measurements": [time_in_millis],
+        ":measurements": [measurement],
         ":tm": test_method,
-        ":ms": memory_size
+        ":ms": memory_size,
+        ":unit": unit
     }
 
-    dynamodb = boto3.resource("dynamodb")
+    dynamodb = client_factory.get_resource("dynamodb")
     result_table = dynamodb.Table(TABLE_NAME)
 
     result_table.update_item(
         Key={
             "PK": "MEASUREMENT",
-            "SK": f"METHOD#{test_method}#MEMORY#{memory_size}"
+            "SK": f"METHOD#{test_method}#MEMORY#{memory_size}#SHARD#{shard_id}"
         },
         UpdateExpression=update_expression,
         ExpressionAttributeNames=expression_attribute_names,
@@ -60,38 +96,76 @@ def record_measurement_result(memory_size: str, test_method: str, time_in_millis
     )
 
 
+def query_measurement_items(table) -> typing.Iterable[dict]:
+    """Yields all measurement items (shards), one page at a time."""
+
+    query_arguments = {
+        "KeyConditionExpression": Key("PK").eq("MEASUREMENT")
+    }
+
+    while True:
+        query_result = table.query(**query_arguments)
+
+        yield from query_result["Items"]
+
+        if "LastEvaluatedKey" not in query_result:
+            break
+
+        query_arguments["ExclusiveStartKey"] = query_result["LastEvaluatedKey"]
+
+
+def iterate_measurement_shards(table) -> typing.Iterable[MeasurementShard]:
+    """
+    Yields the measurements of all shards, this includes items that were
+    written before the measurements were sharded (they're just one big shard).
+    """
+
+    for item in query_measurement_items(table):
+        yield MeasurementShard(
+            memory_size=item["memorySize"],
+            test_method=item["testMethod"],
+            measurements=item.get("measurements", []),
+        )
+
+
 def result_aggregator(event: dict, context):
 
-    dynamodb = boto3.resource("dynamodb")
+    dynamodb = client_factory.get_resource("dynamodb")
     result_table = dynamodb.Table(TABLE_NAME)
 
-    query_result = result_table.query(
-        KeyConditionExpression=Key("PK").eq("MEASUREMENT")
-    )
+    # memory size -> test method -> histogram
+    histograms: typing.Dict[str, typing.Dict[str, LatencyHistogram]] = \
+        collections.defaultdict(lambda: collections.defaultdict(LatencyHistogram))
 
-    result_dict = collections.defaultdict(dict)
-    
-    for item in query_result["Items"]:
+    # The histograms merge the shards of each configuration
+    for shard in iterate_measurement_shards(result_table):
+        histograms[shard.memory_size][shard.test_method].record_all(shard.measurements)
 
-        memory_size = item["memorySize"]
-        test_method = item["testMethod"]
+    test_methods = sorted({
+        test_method for by_method in histograms.values() for test_method in by_method
+    })
+
+    field_names = ["memorySize"]
+    for test_method in test_methods:
+        field_names += summary_field_names(test_method)
 
-        avg_value = int(statistics.mean([int(i) for i in item["measurements"]]))
-        
-        result_dict[memory_size][test_method] = avg_value
-        result_dict[memory_size]["memorySize"] = memory_size
-    
     mem_file = io.StringIO()
     writer = csv.DictWriter(
         mem_file,
-        fieldnames=["memorySize", "client", "resource"],
+        fieldnames=field_names,
         delimiter=";",
     )
-    
+
     writer.writeheader()
-    for value in result_dict.values():
-        writer.writerow(value)
-    
+    for memory_size in sorted(histograms, key=lambda size: int(size) if size.isdigit() else 0):
+
+        row = {"memorySize": memory_size}
+        for test_method in test_methods:
+            for stat, value in histograms[memory_size][test_method].summary().items():
+                row[f"{test_method}_{stat}"] = value
+
+        writer.writerow(row)
+
     print(mem_file.getvalue())
     return {"csvContent": mem_file.getvalue()}
 
@@ -99,20 +173,31 @@ def self_mutate(function_name: str):
     """
     Adds / updates the ELEMENT_OF_SURPRISE environment variable on this function.
     This results in old execution contexts being discarded for future events.
+
+    During a fan-out many invocations finish at the same time. Only one update
+    can run at a time, the others fail with a ResourceConflictException. That's
+    fine, the update that's already running discards this execution context too.
     """
     
-    lambda_client = boto3.client("lambda")
+    lambda_client = client_factory.get_client("lambda")
     function_config = lambda_client.get_function_configuration(
         FunctionName=function_name
     )
 
+    if function_config.get("LastUpdateStatus") == "InProgress":
+        LOGGER.debug("%s is already being updated, skipping the mutation", function_name)
+        return
+
     existing_env = function_config["Environment"]["Variables"]
     existing_env["ELEMENT_OF_SURPRISE"] = str(random.randint(1, 100_000))
 
-    lambda_client.update_function_configuration(
-        FunctionName=function_name,
-        Environment={"Variables": existing_env}
-    )
+    try:
+        lambda_client.update_function_configuration(
+            FunctionName=function_name,
+            Environment={"Variables": existing_env}
+        )
+    except lambda_client.exceptions.ResourceConflictException:
+        LOGGER.debug("%s is already being updated, skipping the mutation", function_name)
 
 def client_handler(event: dict, context):
 
@@ -133,7 +218,8 @@ def client_handler(event: dict, context):
     record_measurement_result(
         memory_size=MEMORY_SIZE,
         test_method="client",
-        time_in_millis=time_it_took_in_millis
+        time_in_millis=time_it_took_in_millis,
+        shard_id=context.aws_request_id
     )
 
     # Update the function to clear up existing execution contexts
@@ -158,17 +244,39 @@ def resource_handler(event: dict, context):
     record_measurement_result(
         memory_size=MEMORY_SIZE,
         test_method="resource",
-        time_in_millis=time_it_took_in_millis
+        time_in_millis=time_it_took_in_millis,
+        shard_id=context.aws_request_id
     )
 
     # Update the function to clear up existing execution contexts
     self_mutate(context.function_name)
 
 def invoke_handler(event: dict, context):
-
-    sns_topic = boto3.resource("sns").Topic(INVOKER_TOPIC_ARN)
+    """
+    Sends n messages to the invoker topic, the event looks like this:
+
+    {
+        "n": 100,                   # number of invocations
+        "mode": "sequential",       # or "fanout"
+        "concurrency": 10,          # fanout: number of parallel publishers
+        "rampUpSeconds": 0,         # fanout: time until the peak rate is reached
+        "rampUpProfile": "linear"   # fanout: none, linear or step
+    }
+    """
 
     n = int(event.get("n", 100))
+    mode = event.get("mode", "sequential")
+
+    if mode == "fanout":
+        return benchmark_driver.fan_out(
+            topic_arn=INVOKER_TOPIC_ARN,
+            n=n,
+            concurrency=int(event.get("concurrency", 10)),
+            ramp_up_seconds=float(event.get("rampUpSeconds", 0)),
+            ramp_up_profile=event.get("rampUpProfile", "linear"),
+        )
+
+    sns_topic = client_factory.get_resource("sns").Topic(INVOKER_TOPIC_ARN)
 
     for _ in range(n):
         sns_topic.publish(Message="Go for it.")
\ No newline at end of file
@@ -5,9 +5,8 @@ import typing
 import boto3
 import click
 
-from boto3.dynamodb.conditions import Key
-
 import cdk_s3_sns_latency.cdk_s3_sns_latency_stack as stack
+import cdk_s3_sns_latency.table_export as table_export
 
 BUCKET_WITH_LAMBDA: str = None
 BUCKET_WITH_SNS: str = None
@@ -15,7 +14,7 @@ MEASUREMENT_TABLE_NAME: str = None
 GENERATOR_FUNCTION_NAME: str = None
 
 
-def get_consistent_snapshot(table_name) -> typing.List[dict]:
+def get_consistent_snapshot(table_name, total_segments: int = 4) -> typing.List[dict]:
     """
     Takes a consistent snapshot of the order book table and return the dictionary representation.
     :return: dict of Order Summary representations
@@ -25,29 +24,17 @@ def get_consistent_snapshot(table_name) -> typing.List[dict]:
     order_book_table = dynamo_db.Table(table_name)
 
     # This just wraps the internal iterable based  method for compatibility.
-    return list(_get_consistent_snapshot(order_book_table))
+    return list(_get_consistent_snapshot(order_book_table, total_segments))
 
 
 def _get_consistent_snapshot(
         dynamodb_table: boto3.resources.base.ServiceResource,
-        _last_evaluated_key: dict = None
+        total_segments: int = 4,
+        **scan_arguments
     ) -> typing.Iterable[dict]:
 
-    query_arguments = {
-    }
-
-    if _last_evaluated_key is not None:
-        # This means we're paginating and have to add the start offset.
-        query_arguments["ExclusiveStartKey"] = _last_evaluated_key
-
-    scan_result = dynamodb_table.scan(**query_arguments)
-
-    for item in scan_result["Items"]:
-        yield item
-
-    if "LastEvaluatedKey" in scan_result:
-        # This means there's another page and we need to paginate
-        yield from _get_consistent_snapshot(dynamodb_table, scan_result["LastEvaluatedKey"])
+    # Scans the segments of the table in parallel, page after page without recursion.
+    yield from table_export.parallel_scan(dynamodb_table.name, total_segments, **scan_arguments)
 
 def get_params():
     """Get the information about the environment and store it in the global variables..."""
@@ -86,27 +73,41 @@ def start(number_of_measurements):
     click.secho("Done.", fg="green")
 
 @cli.command()
-def summary():
+@click.option("--segments", default=4, help="Number of parallel scan segments")
+def summary(segments):
     get_params()
 
     table = boto3.resource("dynamodb").Table(MEASUREMENT_TABLE_NAME)
-    
-    for bucket_name in [BUCKET_WITH_LAMBDA, BUCKET_WITH_SNS]:
 
-        s3_to_lambda_latencies = []
-        s3_to_sns_latencies = []
-        sns_to_lambda_latencies = []
+    latencies_by_bucket = {
+        bucket_name: {"s3ToLambdaMS": [], "s3ToSnsMS": [], "snsToLambdaMS": []}
+        for bucket_name in [BUCKET_WITH_LAMBDA, BUCKET_WITH_SNS]
+    }
 
-        click.secho(f"Exporting values for bucket {bucket_name}", fg="yellow")
+    click.secho(f"Exporting values from table {MEASUREMENT_TABLE_NAME}", fg="yellow")
+
+    # One parallel scan for both buckets, only the latencies are read
+    for item in _get_consistent_snapshot(
+            table,
+            segments,
+            ProjectionExpression="PK, s3ToLambdaMS, s3ToSnsMS, snsToLambdaMS"
+        ):
 
-        response = table.query(KeyConditionExpression=Key("PK").eq(bucket_name))
+        if item["PK"] in latencies_by_bucket:
+            for attribute_name, latencies in latencies_by_bucket[item["PK"]].items():
+                latencies.append(int(item[attribute_name]))
 
-        click.secho(f"Got {response['Count']} values...")
+    for bucket_name, latencies in latencies_by_bucket.items():
+
+        s3_to_lambda_latencies = latencies["s3ToLambdaMS"]
+        s3_to_sns_latencies = latencies["s3ToSnsMS"]
+        sns_to_lambda_latencies = latencies["snsToLambdaMS"]
+
+        click.secho(f"Exporting values for bucket {bucket_name}", fg="yellow")
+        click.secho(f"Got {len(s3_to_lambda_latencies)} values...")
 
-        for item in response["Items"]:
-            s3_to_lambda_latencies.append(int(item["s3ToLambdaMS"]))
-            s3_to_sns_latencies.append(int(item["s3ToSnsMS"]))
-            sns_to_lambda_latencies.append(int(item["snsToLambdaMS"]))
+        if not s3_to_lambda_latencies:
+            continue
 
         click.secho(f"[S3 -> Lambda] Mean latency for {bucket_name}: {statistics.mean(s3_to_lambda_latencies)}")
         click.secho(f"[S3 -> Lambda] Min latency for {bucket_name}: {min(s3_to_lambda_latencies)}")
@@ -119,13 +120,14 @@ def summary():
         click.secho(f"[SNS -> Lambda] Max latency for {bucket_name}: {max(sns_to_lambda_latencies)}")
 
 @cli.command()
-def clear():
+@click.option("--segments", default=4, help="Number of parallel scan segments")
+def clear(segments):
 
     get_params()
-    
-    items = get_consistent_snapshot(MEASUREMENT_TABLE_NAME)
 
-    click.confirm(f"Are you sure you want to delete {len(items)} items from table {MEASUREMENT_TABLE_NAME}?", abort=True)
+    item_count = table_export.count_items(MEASUREMENT_TABLE_NAME, segments)
+
+    click.confirm(f"Are you sure you want to delete {item_count} items from table {MEASUREMENT_TABLE_NAME}?", abort=True)
 
     ddb_resource = boto3.resource("dynamodb")
     table = ddb_resource.Table(MEASUREMENT_TABLE_NAME)
@@ -133,8 +135,16 @@ def clear():
     keys = [ item["AttributeName"] for item in table.key_schema ]
 
     click.echo(f'Got keys: {", ".join(keys)}')
-    
-    with click.progressbar(items, label="Deleting Items...") as delete_list, table.batch_writer() as batch:
+
+    # Streams the keys instead of loading the whole table first
+    items = _get_consistent_snapshot(
+        table,
+        segments,
+        ProjectionExpression=", ".join(f"#key{index}" for index in range(len(keys))),
+        ExpressionAttributeNames={f"#key{index}": key for index, key in enumerate(keys)}
+    )
+
+    with click.progressbar(items, length=item_count, label="Deleting Items...") as delete_list, table.batch_writer() as batch:
 
         for item in delete_list:
             
@@ -159,5 +169,19 @@ def clear():
         
         click.secho(f"Deleted {delete_count} objects from {bucket_name}")
 
+@cli.command()
+@click.argument("path")
+@click.option("--format", "file_format", type=click.Choice(["jsonl", "parquet"]), default="jsonl")
+@click.option("--segments", default=4, help="Number of parallel scan segments")
+@click.option("--state-file", help="Saves the progress there and resumes from it, JSONL only")
+def export(path, file_format, segments, state_file):
+    get_params()
+
+    click.secho(f"Exporting table {MEASUREMENT_TABLE_NAME} to {path}...", fg="yellow")
+
+    exported = table_export.export_table(MEASUREMENT_TABLE_NAME, path, file_format, segments, state_file)
+
+    click.secho(f"Exported {exported} items.", fg="green")
+
 if __name__ == "__main__":
     cli()
\ No newline at end of file
@@ -0,0 +1,464 @@
+"""
+Parallel scans and exports of DynamoDB tables.
+
+The table is split into segments (Segment/TotalSegments), which are scanned
+by a pool of worker threads at the same time. The workers hand their pages to
+the consumer through a bounded queue, so memory stays at a few pages no matter
+how large the table is. Items are yielded in no particular order.
+
+With a state file, the LastEvaluatedKey of each segment is saved once its page
+has been consumed, for exports once the page is on disk. An interrupted scan
+continues from there, which means the items of the last page of a segment may
+be delivered twice. The state file is deleted when every segment is finished.
+
+Parquet exports need pyarrow (pip install pyarrow).
+"""
+import base64
+import decimal
+import json
+import os
+import pickle
+import queue
+import tempfile
+import threading
+import typing
+
+import boto3
+from boto3.dynamodb.types import Binary, TypeDeserializer
+
+# A scan page is at most 1 MB, this many pages per segment may wait for the consumer
+DEFAULT_QUEUED_PAGES_PER_SEGMENT = 2
+
+# Rows per Parquet row group
+PARQUET_BATCH_SIZE = 10_000
+
+_INT64_RANGE = (-2 ** 63, 2 ** 63 - 1)
+
+_DESERIALIZER = TypeDeserializer()
+
+_DONE = object()
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as err:
+        raise ImportError("Parquet exports need pyarrow, install it with 'pip install pyarrow'.") from err
+
+    return pyarrow
+
+
+class _ScanFailed:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+class ScanState:
+    """
+    The LastEvaluatedKey of each segment and whether it's finished, saved as JSON.
+    Keys are stored in the low level format, e.g. {"PK": {"S": "..."}}, so binary keys aren't supported.
+    """
+
+    def __init__(self, path: typing.Optional[str], table_name: str, total_segments: int):
+        self.path = path
+        self.table_name = table_name
+        self.total_segments = total_segments
+        self.segments: typing.Dict[int, dict] = {
+            segment: {"lastEvaluatedKey": None, "finished": False} for segment in range(total_segments)
+        }
+        self._lock = threading.Lock()
+
+        if path is not None and os.path.exists(path):
+            self._load()
+
+    def _load(self):
+
+        with open(self.path, "r", encoding="utf-8") as state_file:
+            state = json.load(state_file)
+
+        if state["tableName"] != self.table_name or state["totalSegments"] != self.total_segments:
+            raise ValueError(
+                f"The state in {self.path} belongs to a scan of {state['tableName']} with "
+                f"{state['totalSegments']} segments, it can't be resumed with different parameters"
+            )
+
+        self.segments = {int(segment): progress for segment, progress in state["segments"].items()}
+
+        if self.is_finished():
+            raise ValueError(f"The scan in {self.path} is already finished, delete the file to start a new one")
+
+    def is_finished(self) -> bool:
+        return all(progress["finished"] for progress in self.segments.values())
+
+    def save(self):
+
+        if self.path is None:
+            return
+
+        with self._lock:
+
+            if self.is_finished():
+                # Nothing left to resume, a later run with the same file starts from scratch
+                if os.path.exists(self.path):
+                    os.remove(self.path)
+                return
+
+            state = {
+                "tableName": self.table_name,
+                "totalSegments": self.total_segments,
+                "segments": {str(segment): progress for segment, progress in self.segments.items()},
+            }
+
+            # Replaced atomically, an interrupted write never corrupts the state
+            temporary_path = self.path + ".tmp"
+            with open(temporary_path, "w", encoding="utf-8") as state_file:
+                json.dump(state, state_file)
+            os.replace(temporary_path, self.path)
+
+    def advance(self, segment: int, last_evaluated_key: typing.Optional[dict]):
+        with self._lock:
+            self.segments[segment] = {
+                "lastEvaluatedKey": last_evaluated_key,
+                "finished": last_evaluated_key is None,
+            }
+
+
+def _put(pages: queue.Queue, stopped: threading.Event, page: typing.Any):
+    """Blocks while the consumer is behind, wakes up regularly to check if it has gone away."""
+
+    while not stopped.is_set():
+        try:
+            pages.put(page, timeout=0.5)
+            return
+        except queue.Full:
+            continue
+
+
+def _scan_segment(
+        table_name: str,
+        segment: int,
+        total_segments: int,
+        start_key: typing.Optional[dict],
+        pages: queue.Queue,
+        stopped: threading.Event,
+        scan_arguments: dict,
+    ):
+    """Scans one segment and queues (segment, items, count, last evaluated key) for each page."""
+
+    # Clients are thread safe, but creating them from the shared session isn't
+    dynamodb = boto3.session.Session().client("dynamodb")
+
+    arguments = dict(scan_arguments, TableName=table_name, Segment=segment, TotalSegments=total_segments)
+    if start_key is not None:
+        arguments["ExclusiveStartKey"] = start_key
+
+    try:
+        while not stopped.is_set():
+            response = dynamodb.scan(**arguments)
+            _put(pages, stopped, (segment, response.get("Items", []), response["Count"], response.get("LastEvaluatedKey")))
+
+            if "LastEvaluatedKey" not in response:
+                return
+
+            arguments["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    except BaseException as err:  # pylint: disable=broad-except
+        _put(pages, stopped, _ScanFailed(err))
+    finally:
+        _put(pages, stopped, _DONE)
+
+
+def _parallel_scan_pages(
+        table_name: str,
+        total_segments: int,
+        state_file: typing.Optional[str],
+        max_queued_pages: typing.Optional[int],
+        scan_arguments: dict,
+    ) -> typing.Iterator[typing.Tuple[typing.List[dict], int, typing.Callable[[], None]]]:
+    """
+    Yields the raw items and count of each page together with a function that saves
+    the progress. Call it once the page is safely processed, e.g. written to disk.
+    """
+
+    state = ScanState(state_file, table_name, total_segments)
+
+    segments = [
+        (segment, progress["lastEvaluatedKey"])
+        for segment, progress in state.segments.items()
+        if not progress["finished"]
+    ]
+
+    pages: queue.Queue = queue.Queue(maxsize=max_queued_pages or DEFAULT_QUEUED_PAGES_PER_SEGMENT * total_segments)
+    stopped = threading.Event()
+
+    workers = [
+        threading.Thread(
+            target=_scan_segment,
+            args=(table_name, segment, total_segments, start_key, pages, stopped, scan_arguments),
+            name=f"scan-segment-{segment}",
+            daemon=True,
+        )
+        for segment, start_key in segments
+    ]
+    for worker in workers:
+        worker.start()
+
+    running = len(workers)
+
+    try:
+        while running:
+            page = pages.get()
+
+            if page is _DONE:
+                running -= 1
+                continue
+
+            if isinstance(page, _ScanFailed):
+                raise RuntimeError(f"Scanning {table_name} failed") from page.error
+
+            segment, items, count, last_evaluated_key = page
+
+            def _save_progress(segment=segment, last_evaluated_key=last_evaluated_key):
+                state.advance(segment, last_evaluated_key)
+                state.save()
+
+            yield items, count, _save_progress
+
+    finally:
+        # Also stops the workers if the consumer stops early
+        stopped.set()
+
+
+def parallel_scan(
+        table_name: str,
+        total_segments: int = 4,
+        state_file: typing.Optional[str] = None,
+        max_queued_pages: typing.Optional[int] = None,
+        **scan_arguments,
+    ) -> typing.Iterator[dict]:
+    """
+    Yields all items of the table, scanned by one thread per segment.
+    Additional arguments, e.g. ProjectionExpression or FilterExpression strings, are passed to scan.
+    """
+
+    for items, _, save_progress in _parallel_scan_pages(
+            table_name, total_segments, state_file, max_queued_pages, scan_arguments
+        ):
+        for item in items:
+            yield _deserialize(item)
+
+        # The consumer asked for more, so it's done with the page
+        save_progress()
+
+
+def _deserialize(item: dict) -> dict:
+    return {name: _DESERIALIZER.deserialize(value) for name, value in item.items()}
+
+
+def count_items(table_name: str, total_segments: int = 4, **scan_arguments) -> int:
+    """Counts the items with a parallel scan, unlike ItemCount on the table this is up to date."""
+
+    return sum(
+        count
+        for _, count, _ in _parallel_scan_pages(table_name, total_segments, None, None, dict(scan_arguments, Select="COUNT"))
+    )
+
+
+def _to_json(value: typing.Any) -> typing.Any:
+    if isinstance(value, decimal.Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    if isinstance(value, (bytes, bytearray, Binary)):
+        return base64.b64encode(bytes(value)).decode("ascii")
+    raise TypeError(f"Can't export values of type {type(value).__name__}")
+
+
+def export_jsonl(items: typing.Iterable[dict], path: str, append: bool = False) -> int:
+    """Writes one JSON document per item and returns the number of items."""
+
+    exported = 0
+    with open(path, "a" if append else "w", encoding="utf-8") as export_file:
+        for item in items:
+            export_file.write(json.dumps(item, default=_to_json) + "\n")
+            exported += 1
+
+    return exported
+
+
+def _parquet_kind(value: typing.Any) -> typing.Optional[str]:
+    """What a single attribute value needs as a Parquet column, None fits any column."""
+
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return "bool"
+    if isinstance(value, str):
+        return "string"
+    if isinstance(value, decimal.Decimal):
+        is_int64 = value == value.to_integral_value() and _INT64_RANGE[0] <= value <= _INT64_RANGE[1]
+        return "int64" if is_int64 else "float64"
+    if isinstance(value, (bytes, bytearray, Binary)):
+        return "binary"
+    return "json"
+
+
+def _parquet_column_type(kinds: typing.Set[str]) -> str:
+    """
+    Numbers are int64 as long as all of them are integral and float64 otherwise.
+    Maps, lists, sets and attributes with mixed types are stored as JSON strings.
+    """
+
+    if not kinds:
+        return "string"
+    if kinds <= {"int64", "float64"}:
+        return "float64" if "float64" in kinds else "int64"
+    if len(kinds) == 1:
+        return next(iter(kinds))
+    return "json"
+
+
+def parquet_columns(items: typing.Iterable[dict]) -> typing.Dict[str, str]:
+    """The column type of each attribute, taking every item into account."""
+
+    kinds: typing.Dict[str, typing.Set[str]] = {}
+    for item in items:
+        for name, value in item.items():
+            kind = _parquet_kind(value)
+            attribute_kinds = kinds.setdefault(name, set())
+            if kind is not None:
+                attribute_kinds.add(kind)
+
+    return {name: _parquet_column_type(attribute_kinds) for name, attribute_kinds in kinds.items()}
+
+
+def _to_parquet_value(value: typing.Any, column_type: str) -> typing.Any:
+
+    if value is None:
+        return None
+    if column_type == "int64":
+        return int(value)
+    if column_type == "float64":
+        return float(value)
+    if column_type == "binary":
+        return bytes(value)
+    if column_type == "json":
+        return json.dumps(value, default=_to_json)
+    return value
+
+
+def _spooled(path: str) -> typing.Iterator[dict]:
+    with open(path, "rb") as spool_file:
+        while True:
+            try:
+                yield pickle.load(spool_file)
+            except EOFError:
+                return
+
+
+def export_parquet(items: typing.Iterable[dict], path: str, batch_size: int = PARQUET_BATCH_SIZE) -> int:
+    """
+    Writes the items to a Parquet file, batch_size rows at a time, and returns the number of items.
+
+    Parquet needs the schema up front, but items can have any attributes. The items
+    are spooled to a temporary file first, which also collects the schema from all
+    of them, then they're written from there. See _parquet_column_type for the types.
+    """
+
+    pyarrow = _import_pyarrow()
+
+    spool_file = tempfile.NamedTemporaryFile(prefix="export-", suffix=".pickle", delete=False)
+    try:
+        with spool_file:
+            for item in items:
+                pickle.dump(item, spool_file)
+
+        columns = parquet_columns(_spooled(spool_file.name))
+        arrow_types = {
+            "bool": pyarrow.bool_(),
+            "string": pyarrow.string(),
+            "int64": pyarrow.int64(),
+            "float64": pyarrow.float64(),
+            "binary": pyarrow.binary(),
+            "json": pyarrow.string(),
+        }
+        schema = pyarrow.schema([(name, arrow_types[column_type]) for name, column_type in columns.items()])
+
+        exported = 0
+        batch: typing.List[dict] = []
+
+        with pyarrow.parquet.ParquetWriter(path, schema) as writer:
+            for item in _spooled(spool_file.name):
+                batch.append({name: _to_parquet_value(value, columns[name]) for name, value in item.items()})
+                exported += 1
+
+                if len(batch) == batch_size:
+                    writer.write_table(pyarrow.Table.from_pylist(batch, schema=schema))
+                    batch = []
+
+            if batch:
+                writer.write_table(pyarrow.Table.from_pylist(batch, schema=schema))
+
+    finally:
+        os.remove(spool_file.name)
+
+    return exported
+
+
+def export_table(
+        table_name: str,
+        path: str,
+        file_format: str = "jsonl",
+        total_segments: int = 4,
+        state_file: typing.Optional[str] = None,
+        **scan_arguments,
+    ) -> int:
+    """
+    Exports the table to a JSONL or Parquet file and returns the number of items.
+    Only JSONL exports can be resumed, a resumed export appends to the file.
+    """
+
+    if file_format not in ("jsonl", "parquet"):
+        raise ValueError(f"Unknown format {file_format!r}, use jsonl or parquet")
+
+    if file_format == "parquet" and state_file is not None:
+        raise ValueError("Parquet files can't be appended to, use jsonl to export with a state file")
+
+    if file_format == "parquet":
+        return export_parquet(parallel_scan(table_name, total_segments, **scan_arguments), path)
+
+    if state_file is None:
+        return export_jsonl(parallel_scan(table_name, total_segments, **scan_arguments), path)
+
+    return _export_jsonl_resumable(table_name, path, total_segments, state_file, scan_arguments)
+
+
+def _export_jsonl_resumable(
+        table_name: str,
+        path: str,
+        total_segments: int,
+        state_file: str,
+        scan_arguments: dict,
+    ) -> int:
+    """
+    Appends the pages to the file when resuming. The progress of a page is only
+    saved after the page has been flushed and synced, so a crash never skips items.
+    """
+
+    is_resumed = os.path.exists(state_file)
+    pages = _parallel_scan_pages(table_name, total_segments, state_file, None, scan_arguments)
+
+    exported = 0
+    with open(path, "a" if is_resumed else "w", encoding="utf-8") as export_file:
+        for items, _, save_progress in pages:
+            for item in items:
+                export_file.write(json.dumps(_deserialize(item), default=_to_json) + "\n")
+
+            export_file.flush()
+            os.fsync(export_file.fileno())
+            save_progress()
+
+            exported += len(items)
+
+    return exported
@@ -0,0 +1,63 @@
+from decimal import Decimal
+
+import pytest
+
+from cdk_s3_sns_latency.table_export import export_parquet, parquet_columns
+
+# The second batch has a non-integral number and an attribute the first batch doesn't know
+ITEMS = [
+    {"PK": "ORDER#1", "price": Decimal("10")},
+    {"PK": "ORDER#2", "price": Decimal("20")},
+    {"PK": "ORDER#3", "price": Decimal("1.5"), "note": "rush"},
+]
+
+
+def test_that_integral_and_non_integral_numbers_share_a_float_column():
+    """
+    Assert that a number column becomes float64 if any of the numbers isn't integral.
+    """
+
+    # Arrange
+    items = ITEMS
+
+    # Act
+    columns = parquet_columns(items)
+
+    # Assert
+    assert columns == {"PK": "string", "price": "float64", "note": "string"}
+
+
+def test_that_attributes_with_mixed_types_are_stored_as_json():
+    """
+    Assert that attributes that aren't the same type in all items become JSON strings.
+    """
+
+    # Arrange
+    items = [{"value": "text"}, {"value": Decimal("1")}, {"value": {"nested": True}}]
+
+    # Act
+    columns = parquet_columns(items)
+
+    # Assert
+    assert columns == {"value": "json"}
+
+
+def test_that_the_parquet_schema_covers_all_batches(tmp_path):
+    """
+    Assert that the export keeps the numbers and attributes of later batches.
+    """
+
+    # Arrange
+    pyarrow_parquet = pytest.importorskip("pyarrow.parquet")
+    path = str(tmp_path / "orders.parquet")
+
+    # Act
+    exported = export_parquet(iter(ITEMS), path, batch_size=2)
+
+    # Assert
+    assert exported == 3
+    assert pyarrow_parquet.read_table(path).to_pylist() == [
+        {"PK": "ORDER#1", "price": 10.0, "note": None},
+        {"PK": "ORDER#2", "price": 20.0, "note": None},
+        {"PK": "ORDER#3", "price": 1.5, "note": "rush"},
+    ]
@@ -0,0 +1,327 @@
+"""
+Load test for the view counter strategies in dynamodb_counter.py.
+
+Each strategy is driven by a number of threads that count views for a set of
+URLs, which are picked either uniformly or Zipf distributed (few hot URLs).
+The harness reports the throughput, latency percentiles, the errors DynamoDB
+returned (e.g. conditional check failures and transaction cancellations) and
+whether the final counts match the number of views that were sent.
+
+By default everything runs against a moto server in a background thread, which
+tells you about the number of calls and the error behavior, but not about the
+latency of the real service. moto isn't thread safe, so with a concurrency above
+one, the counts it reports for the transactional strategies can be slightly off.
+Use --endpoint-url to point it at DynamoDB Local instead, e.g.
+
+    docker run -p 8000:8000 amazon/dynamodb-local
+    python counter_load_test.py --endpoint-url http://localhost:8000 --skew zipf
+"""
+import argparse
+import bisect
+import collections
+import contextlib
+import io
+import itertools
+import logging
+import os
+import random
+import socket
+import statistics
+import threading
+import time
+import typing
+
+import client_factory
+import dynamodb_counter
+from write_behind_counter import WriteBehindCounter
+
+STRATEGIES = [
+    "very_naive",
+    "less_naive",
+    "accurate",
+    "accurate_with_ttl",
+    "sharded",
+    "batch",
+    "write_behind",
+]
+
+
+class ErrorCounter:
+    """Counts the error codes of all DynamoDB responses through the botocore event system."""
+
+    def __init__(self):
+        self.error_codes = collections.Counter()
+        self.cancellation_reasons = collections.Counter()
+        self._lock = threading.Lock()
+
+    def __call__(self, http_response, parsed, model, **kwargs):
+
+        error_code = parsed.get("Error", {}).get("Code")
+        if error_code is None:
+            return
+
+        with self._lock:
+            self.error_codes[error_code] += 1
+            for reason in parsed.get("CancellationReasons", []):
+                if reason.get("Code", "None") != "None":
+                    self.cancellation_reasons[reason["Code"]] += 1
+
+    def reset(self):
+        with self._lock:
+            self.error_codes.clear()
+            self.cancellation_reasons.clear()
+
+
+class KeyChooser:
+    """Picks URLs uniformly or following a Zipf distribution with the given exponent."""
+
+    def __init__(self, keys: int, skew: str = "uniform", zipf_exponent: float = 1.1):
+
+        self.urls = [f"https://example.com/blog/post-{idx}" for idx in range(keys)]
+
+        weights = [1.0] * keys if skew == "uniform" else [1 / rank ** zipf_exponent for rank in range(1, keys + 1)]
+        self._cumulative_weights = list(itertools.accumulate(weights))
+
+    def choose(self, rng: random.Random) -> str:
+        position = rng.random() * self._cumulative_weights[-1]
+        return self.urls[bisect.bisect_right(self._cumulative_weights, position)]
+
+
+def setup_environment(endpoint_url: typing.Optional[str]) -> ErrorCounter:
+    """Points the clients at DynamoDB Local or moto and registers the error counter."""
+
+    if endpoint_url is None:
+        from moto.server import ThreadedMotoServer
+
+        # Let the OS pick a free port for the server
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+
+        logging.getLogger("werkzeug").setLevel(logging.CRITICAL)
+        ThreadedMotoServer(ip_address="127.0.0.1", port=port, verbose=False).start()
+        endpoint_url = f"http://127.0.0.1:{port}"
+
+    os.environ["AWS_ENDPOINT_URL_DYNAMODB"] = endpoint_url
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "local")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "local")
+    os.environ.setdefault("AWS_DEFAULT_REGION", "eu-central-1")
+
+    # The hook only applies to clients that are created afterwards
+    client_factory.clear_cache()
+    error_counter = ErrorCounter()
+    client_factory.get_session().events.register("after-call.dynamodb", error_counter)
+
+    return error_counter
+
+
+def seed_counters(table_name: str, urls: typing.List[str]):
+    """The very naive counter fails unless the views attribute exists."""
+
+    table = client_factory.get_resource("dynamodb").Table(table_name)
+
+    with table.batch_writer(overwrite_by_pkeys=["PK", "SK"]) as batch:
+        for url in urls:
+            batch.put_item(Item={"PK": f"URL#{url}", "SK": "STATISTICS", "views": 0})
+
+
+def read_counters(strategy: str, table_name: str, urls: typing.List[str]) -> int:
+
+    if strategy == "sharded":
+        return sum(dynamodb_counter.get_sharded_view_count(url, table_name) for url in urls)
+
+    table = client_factory.get_resource("dynamodb").Table(table_name)
+    return sum(
+        int(table.get_item(Key={"PK": f"URL#{url}", "SK": "STATISTICS"}).get("Item", {}).get("views", 0))
+        for url in urls
+    )
+
+
+def run_load_test(
+        strategy: str,
+        table_name: str,
+        key_chooser: KeyChooser,
+        error_counter: ErrorCounter,
+        operations: int = 1000,
+        concurrency: int = 8,
+        duplicate_ratio: float = 0.0,
+        batch_size: int = 25,
+    ) -> dict:
+    """
+    Runs the operations for the strategy with concurrency threads and returns the results.
+    For the batch strategy, an operation is a batch of batch_size view events.
+    """
+
+    seed_counters(table_name, key_chooser.urls)
+    error_counter.reset()
+
+    sequence = itertools.count()
+    latencies_in_ms: typing.List[float] = []
+    failed_operations = collections.Counter()
+    lock = threading.Lock()
+
+    # Unique (time, clientId) pairs, duplicates are redelivered previous events
+    recent_events: typing.List[dict] = []
+
+    def _next_view_event(rng: random.Random) -> dict:
+        with lock:
+            if recent_events and rng.random() < duplicate_ratio:
+                return rng.choice(recent_events)
+
+            view_event = {
+                "url": key_chooser.choose(rng),
+                "time": str(next(sequence)),
+                "clientId": str(threading.get_ident()),
+            }
+            recent_events.append(view_event)
+            return view_event
+
+    write_behind_counter = WriteBehindCounter(table_name) if strategy == "write_behind" else None
+
+    def _operation(rng: random.Random):
+
+        if strategy == "batch":
+            dynamodb_counter.batch_view_counter(
+                [_next_view_event(rng) for _ in range(batch_size)], table_name
+            )
+            return
+
+        view_event = _next_view_event(rng)
+
+        if strategy == "very_naive":
+            dynamodb_counter.very_naive_view_counter(view_event, table_name)
+        elif strategy == "less_naive":
+            dynamodb_counter.less_naive_view_counter(view_event, table_name)
+        elif strategy == "accurate":
+            dynamodb_counter.accurate_view_counter(view_event, table_name)
+        elif strategy == "accurate_with_ttl":
+            dynamodb_counter.accurate_view_counter_with_ttl(view_event, table_name)
+        elif strategy == "sharded":
+            dynamodb_counter.sharded_view_counter(view_event, table_name)
+        elif strategy == "write_behind":
+            write_behind_counter.increment(view_event["url"])
+        else:
+            raise ValueError(f"Unknown strategy {strategy}")
+
+    def _worker(worker_id: int, worker_operations: int):
+
+        rng = random.Random(worker_id)
+        worker_latencies = []
+
+        for _ in range(worker_operations):
+            started_at = time.perf_counter()
+            try:
+                _operation(rng)
+            except Exception as err:
+                with lock:
+                    failed_operations[type(err).__name__] += 1
+            worker_latencies.append((time.perf_counter() - started_at) * 1000)
+
+        with lock:
+            latencies_in_ms.extend(worker_latencies)
+
+    workers = [
+        threading.Thread(
+            target=_worker,
+            args=(worker_id, operations // concurrency + (1 if worker_id < operations % concurrency else 0))
+        )
+        for worker_id in range(concurrency)
+    ]
+
+    # The accurate counters print every duplicate, that's too noisy here
+    with contextlib.redirect_stdout(io.StringIO()):
+        started_at = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        if write_behind_counter is not None:
+            write_behind_counter.close()
+        duration_in_seconds = time.perf_counter() - started_at
+
+    unique_views = len({(event["url"], event["time"], event["clientId"]) for event in recent_events})
+    sent_views = operations * (batch_size if strategy == "batch" else 1)
+
+    latencies_in_ms.sort()
+
+    def _percentile(percentile: float) -> float:
+        return latencies_in_ms[min(len(latencies_in_ms) - 1, int(percentile / 100 * len(latencies_in_ms)))]
+
+    return {
+        "strategy": strategy,
+        "operations": operations,
+        "durationSeconds": duration_in_seconds,
+        "operationsPerSecond": operations / duration_in_seconds,
+        "viewsPerSecond": sent_views / duration_in_seconds,
+        "p50Ms": _percentile(50),
+        "p90Ms": _percentile(90),
+        "p99Ms": _percentile(99),
+        "meanMs": statistics.fmean(latencies_in_ms),
+        "failedOperations": sum(failed_operations.values()),
+        "failureTypes": dict(failed_operations),
+        # Inside of transactions, they're reported as cancellation reasons
+        "conditionalCheckFailures": error_counter.error_codes["ConditionalCheckFailedException"] \
+            + error_counter.cancellation_reasons["ConditionalCheckFailed"],
+        "transactionCancellations": error_counter.error_codes["TransactionCanceledException"],
+        "errorCodes": dict(error_counter.error_codes),
+        "cancellationReasons": dict(error_counter.cancellation_reasons),
+        "sentViews": sent_views,
+        "uniqueViews": unique_views,
+        "countedViews": read_counters(strategy, table_name, key_chooser.urls),
+    }
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Compare the view counter strategies under load.")
+    parser.add_argument("--strategy", "-s", action="append", choices=STRATEGIES, help="Defaults to all strategies")
+    parser.add_argument("--operations", "-n", type=int, default=1000)
+    parser.add_argument("--concurrency", "-c", type=int, default=8)
+    parser.add_argument("--keys", "-k", type=int, default=100, help="Number of distinct URLs")
+    parser.add_argument("--skew", choices=["uniform", "zipf"], default="uniform")
+    parser.add_argument("--zipf-exponent", type=float, default=1.1)
+    parser.add_argument("--duplicate-ratio", type=float, default=0.0, help="Share of redelivered view events")
+    parser.add_argument("--batch-size", type=int, default=25, help="View events per operation of the batch strategy")
+    parser.add_argument("--endpoint-url", help="e.g. http://localhost:8000 for DynamoDB Local, uses moto if omitted")
+    parsed = parser.parse_args()
+
+    error_counter = setup_environment(parsed.endpoint_url)
+    dynamodb_counter.create_table_if_not_exists()
+
+    key_chooser = KeyChooser(parsed.keys, parsed.skew, parsed.zipf_exponent)
+
+    print(
+        "{0:>18} {1:>9} {2:>9} {3:>8} {4:>8} {5:>8} {6:>7} {7:>7} {8:>7} {9:>8} {10:>8}".format(
+            "strategy", "ops/s", "views/s", "p50 ms", "p90 ms", "p99 ms",
+            "failed", "ccf", "txcncl", "unique", "counted"
+        )
+    )
+
+    for strategy in parsed.strategy or STRATEGIES:
+        result = run_load_test(
+            strategy,
+            dynamodb_counter.TABLE_NAME,
+            key_chooser,
+            error_counter,
+            operations=parsed.operations,
+            concurrency=parsed.concurrency,
+            duplicate_ratio=parsed.duplicate_ratio,
+            batch_size=parsed.batch_size,
+        )
+
+        print(
+            "{strategy:>18} {operationsPerSecond:>9.1f} {viewsPerSecond:>9.1f} {p50Ms:>8.2f} {p90Ms:>8.2f} {p99Ms:>8.2f} "
+            "{failedOperations:>7} {conditionalCheckFailures:>7} {transactionCancellations:>7} "
+            "{uniqueViews:>8} {countedViews:>8}".format(**result)
+        )
+
+        # Start the next strategy with empty counters
+        client_factory.get_client("dynamodb").delete_table(TableName=dynamodb_counter.TABLE_NAME)
+        client_factory.get_client("dynamodb").get_waiter("table_not_exists").wait(TableName=dynamodb_counter.TABLE_NAME)
+        dynamodb_counter.create_table_if_not_exists()
+        client_factory.get_client("dynamodb").get_waiter("table_exists").wait(TableName=dynamodb_counter.TABLE_NAME)
+        dynamodb_counter._SHARDED_COUNTERS.clear()
+
+
+if __name__ == "__main__":
+    main()
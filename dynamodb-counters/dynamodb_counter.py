@@ -1,16 +1,20 @@
+import random
 import time
+import typing
 
-import boto3
 import boto3.dynamodb.conditions as conditions
 
+from botocore.config import Config
 from botocore.exceptions import ClientError
 
+import client_factory
+
 TABLE_NAME = "blog_data"
 
 def create_table_if_not_exists():
 
     try:
-        boto3.client("dynamodb").create_table(
+        client_factory.get_client("dynamodb").create_table(
             AttributeDefinitions=[
                 {"AttributeName": "PK", "AttributeType": "S"},
                 {"AttributeName": "SK", "AttributeType": "S"}
@@ -30,7 +34,7 @@ def create_table_if_not_exists():
             raise err
     
     try:
-        response = boto3.client("dynamodb").update_time_to_live(
+        response = client_factory.get_client("dynamodb").update_time_to_live(
             TableName=TABLE_NAME,
             TimeToLiveSpecification={
                 'Enabled': True,
@@ -45,7 +49,7 @@ def create_table_if_not_exists():
             raise err
 
 def very_naive_view_counter(view_event: dict, table_name: str):
-	table = boto3.resource("dynamodb").Table(table_name)
+	table = client_factory.get_resource("dynamodb").Table(table_name)
 
 	blog_url = view_event["url"]
 
@@ -65,30 +69,33 @@ def very_naive_view_counter(view_event: dict, table_name: str):
 	)
 
 def less_naive_view_counter(view_event: dict, table_name: str):
-	table = boto3.resource("dynamodb").Table(table_name)
+	# Increment the view counter by 1, creating it if it doesn't exist yet
+	increment_views(view_event["url"], 1, table_name)
 
-	blog_url = view_event["url"]
+def increment_views(url: str, increment: int, table_name: str):
+    """Adds increment to the views of the URL and initializes the counter if it doesn't exist yet."""
 
-	# Increment the view counter by 1
-	table.update_item(
-		Key={
-			"PK": f"URL#{blog_url}",
-			"SK": "STATISTICS"
-		},
-		UpdateExpression="SET #views = if_not_exists(#views, :init) + :inc",
+    table = client_factory.get_resource("dynamodb").Table(table_name)
+
+    table.update_item(
+        Key={
+            "PK": f"URL#{url}",
+            "SK": "STATISTICS"
+        },
+        UpdateExpression="SET #views = if_not_exists(#views, :init) + :inc",
         ExpressionAttributeNames={
             "#views": "views"
         },
         ExpressionAttributeValues={
-            ":inc": 1,
+            ":inc": increment,
             ":init": 0
         }
-	)
+    )
 
 def accurate_view_counter(view_event: dict, table_name: str):
 
     # transactions are only supported using the client API
-    client = boto3.client("dynamodb")
+    client = client_factory.get_client("dynamodb")
 
     partition_key = f"URL#{view_event['url']}"
     sort_key_stats = "STATISTICS"
@@ -138,7 +145,7 @@ def accurate_view_counter(view_event: dict, table_name: str):
 def accurate_view_counter_with_ttl(view_event: dict, table_name: str):
 
     # transactions are only supported using the client API
-    client = boto3.client("dynamodb")
+    client = client_factory.get_client("dynamodb")
 
     expire_after_seconds = 60 * 60 * 24 * 7 # a week
     current_time_as_epoch = int(time.time())
@@ -191,6 +198,305 @@ def accurate_view_counter_with_ttl(view_event: dict, table_name: str):
             raise err
 
 
+# A transaction can't contain more than 100 actions
+MAX_TRANSACTION_ITEMS = 100
+
+
+def _view_event_transaction_items(
+        view_events: typing.List[dict],
+        table_name: str,
+        expiry_time: int
+    ) -> typing.List[dict]:
+    """One conditional put per event as dedup marker and one aggregated update per URL."""
+
+    transaction_items = []
+    views_per_url: typing.Dict[str, int] = {}
+
+    for view_event in view_events:
+        transaction_items.append({
+            "Put": {
+                "TableName": table_name,
+                "Item": {
+                    "PK": {"S": f"URL#{view_event['url']}"},
+                    "SK": {"S": f"T#{view_event['time']}#CID#{view_event['clientId']}"},
+                    "ttl": {"N": str(expiry_time)}
+                },
+                "ConditionExpression": "attribute_not_exists(PK) and attribute_not_exists(SK)"
+            }
+        })
+        views_per_url[view_event["url"]] = views_per_url.get(view_event["url"], 0) + 1
+
+    for url, views in views_per_url.items():
+        transaction_items.append({
+            "Update": {
+                "TableName": table_name,
+                "Key": {
+                    "PK": {"S": f"URL#{url}"},
+                    "SK": {"S": "STATISTICS"}
+                },
+                "UpdateExpression": "ADD #views :inc",
+                "ExpressionAttributeNames": {
+                    "#views": "views"
+                },
+                "ExpressionAttributeValues": {
+                    ":inc": {"N": str(views)}
+                }
+            }
+        })
+
+    return transaction_items
+
+
+def _chunk_view_events(view_events: typing.List[dict]) -> typing.Iterator[typing.List[dict]]:
+    """Splits the events so that the markers and the URL updates of each chunk fit into a transaction."""
+
+    chunk, urls = [], set()
+
+    for view_event in view_events:
+        new_urls = len(urls | {view_event["url"]})
+        if chunk and len(chunk) + 1 + new_urls > MAX_TRANSACTION_ITEMS:
+            yield chunk
+            chunk, urls = [], set()
+
+        chunk.append(view_event)
+        urls.add(view_event["url"])
+
+    if chunk:
+        yield chunk
+
+
+def batch_view_counter(view_events: typing.List[dict], table_name: str, max_attempts: int = 5) -> int:
+    """
+    Counts a batch of view events (e.g. from SQS or Kinesis) exactly once and
+    returns how many of them hadn't been counted before.
+
+    Duplicates within the batch are dropped locally, the remaining events are
+    written in transactions of up to 100 items. Events whose marker already
+    exists are removed from the transaction, which is then retried.
+    """
+
+    client = client_factory.get_client("dynamodb")
+
+    expire_after_seconds = 60 * 60 * 24 * 7 # a week
+    expiry_time = int(time.time()) + expire_after_seconds
+
+    # Dedupe locally by (url, time, clientId), keeping the order
+    unique_events = list({
+        (view_event["url"], view_event["time"], view_event["clientId"]): view_event
+        for view_event in view_events
+    }.values())
+
+    counted = 0
+
+    for chunk in _chunk_view_events(unique_events):
+
+        attempt = 0
+        while chunk:
+
+            transaction_items = _view_event_transaction_items(chunk, table_name, expiry_time)
+
+            try:
+                client.transact_write_items(TransactItems=transaction_items)
+                counted += len(chunk)
+                break
+
+            except ClientError as err:
+                if err.response["Error"]["Code"] != 'TransactionCanceledException':
+                    raise err
+
+                # The reasons are in the same order as the items, the markers come first.
+                # Without a reason for every item we can't tell the duplicates apart, so nothing is dropped.
+                reasons = err.response.get("CancellationReasons") or []
+                if len(reasons) == len(transaction_items):
+                    remaining = [
+                        view_event for view_event, reason in zip(chunk, reasons)
+                        if reason.get("Code") != "ConditionalCheckFailed"
+                    ]
+                else:
+                    remaining = chunk
+
+                if len(remaining) < len(chunk):
+                    # Removing the duplicates doesn't count as an attempt
+                    print(f"{len(chunk) - len(remaining)} view events were already processed")
+                    chunk = remaining
+                    continue
+
+                # Conflicts with other transactions, back off before retrying
+                attempt += 1
+                if attempt >= max_attempts:
+                    raise RuntimeError(f"Couldn't count {len(chunk)} view events after {max_attempts} attempts")
+                time.sleep(random.uniform(0, 0.05 * 2 ** attempt))
+
+    return counted
+
+
+# Sort key of the item that stores the number of counter shards of a URL
+SHARD_CONFIG_SORT_KEY = "SHARD_CONFIG"
+
+MAX_COUNTER_SHARDS = 100
+
+THROTTLING_ERROR_CODES = {
+    "ProvisionedThroughputExceededException",
+    "ThrottlingException",
+    "RequestLimitExceeded",
+}
+
+
+class ShardedViewCounter:
+    """
+    Spreads the views of a URL across the items STATISTICS#0 to STATISTICS#<n-1>,
+    so a popular URL doesn't turn into a hot key.
+
+    The number of shards per URL starts at initial_shards and doubles (up to
+    max_shards) whenever a write gets throttled. It's stored in the SHARD_CONFIG
+    item of the URL, other writers pick it up after config_ttl_seconds.
+    """
+
+    def __init__(
+            self,
+            table_name: str,
+            initial_shards: int = 1,
+            max_shards: int = MAX_COUNTER_SHARDS,
+            config_ttl_seconds: int = 60,
+            max_attempts: int = 5,
+        ):
+
+        if not 1 <= initial_shards <= max_shards:
+            raise ValueError("initial_shards has to be between 1 and max_shards")
+
+        self.table_name = table_name
+        self.initial_shards = initial_shards
+        self.max_shards = max_shards
+        self.config_ttl_seconds = config_ttl_seconds
+        self.max_attempts = max_attempts
+
+        # Reads and config updates use the default retries.
+        self.table = client_factory.get_resource("dynamodb").Table(table_name)
+
+        # We handle throttled increments ourselves, retries in botocore would hide them from us.
+        self._increment_table = client_factory.get_resource(
+            "dynamodb",
+            config=Config(retries={"total_max_attempts": 1, "mode": "standard"}),
+        ).Table(table_name)
+
+        # url -> (shard count, loaded at)
+        self._shard_counts: typing.Dict[str, typing.Tuple[int, float]] = {}
+
+    def _load_shard_count(self, url: str) -> int:
+
+        response = self.table.get_item(
+            Key={"PK": f"URL#{url}", "SK": SHARD_CONFIG_SORT_KEY}
+        )
+        shard_count = int(response.get("Item", {}).get("shardCount", self.initial_shards))
+
+        self._shard_counts[url] = (shard_count, time.monotonic())
+        return shard_count
+
+    def get_shard_count(self, url: str) -> int:
+
+        shard_count, loaded_at = self._shard_counts.get(url, (None, 0))
+        if shard_count is None or time.monotonic() - loaded_at > self.config_ttl_seconds:
+            shard_count = self._load_shard_count(url)
+
+        return shard_count
+
+    def _grow_shards(self, url: str) -> int:
+        """Doubles the number of shards for the URL, unless someone else already did that."""
+
+        new_shard_count = min(self.get_shard_count(url) * 2, self.max_shards)
+
+        try:
+            self.table.update_item(
+                Key={"PK": f"URL#{url}", "SK": SHARD_CONFIG_SORT_KEY},
+                UpdateExpression="SET #shards = :shards",
+                ConditionExpression=conditions.Or(
+                    conditions.Attr("shardCount").not_exists(),
+                    conditions.Attr("shardCount").lt(new_shard_count),
+                ),
+                ExpressionAttributeNames={"#shards": "shardCount"},
+                ExpressionAttributeValues={":shards": new_shard_count},
+            )
+        except ClientError as err:
+            if err.response["Error"]["Code"] not in THROTTLING_ERROR_CODES | {"ConditionalCheckFailedException"}:
+                raise err
+
+        return self._load_shard_count(url)
+
+    def increment(self, url: str, increment: int = 1):
+
+        for attempt in range(self.max_attempts):
+
+            shard = random.randrange(self.get_shard_count(url))
+
+            try:
+                self._increment_table.update_item(
+                    Key={
+                        "PK": f"URL#{url}",
+                        "SK": f"STATISTICS#{shard}"
+                    },
+                    UpdateExpression="SET #views = if_not_exists(#views, :init) + :inc",
+                    ExpressionAttributeNames={
+                        "#views": "views"
+                    },
+                    ExpressionAttributeValues={
+                        ":inc": increment,
+                        ":init": 0
+                    }
+                )
+                return
+
+            except ClientError as err:
+                if err.response["Error"]["Code"] not in THROTTLING_ERROR_CODES:
+                    raise err
+
+                self._grow_shards(url)
+                time.sleep(random.uniform(0, 0.05 * 2 ** attempt))
+
+        raise RuntimeError(f"Couldn't count the view for {url} after {self.max_attempts} attempts")
+
+    def get_views(self, url: str) -> int:
+        """
+        Sums up the views of all shards with a single query, this includes the
+        STATISTICS item of the unsharded counters.
+        """
+
+        query_arguments = {
+            "KeyConditionExpression": conditions.Key("PK").eq(f"URL#{url}") \
+                & conditions.Key("SK").begins_with("STATISTICS"),
+            "ProjectionExpression": "#views",
+            "ExpressionAttributeNames": {"#views": "views"},
+        }
+
+        views = 0
+        while True:
+            response = self.table.query(**query_arguments)
+            views += sum(int(item.get("views", 0)) for item in response["Items"])
+
+            if "LastEvaluatedKey" not in response:
+                return views
+
+            query_arguments["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+_SHARDED_COUNTERS: typing.Dict[str, ShardedViewCounter] = {}
+
+
+def _get_sharded_counter(table_name: str) -> ShardedViewCounter:
+
+    if table_name not in _SHARDED_COUNTERS:
+        _SHARDED_COUNTERS[table_name] = ShardedViewCounter(table_name)
+
+    return _SHARDED_COUNTERS[table_name]
+
+
+def sharded_view_counter(view_event: dict, table_name: str):
+    _get_sharded_counter(table_name).increment(view_event["url"])
+
+
+def get_sharded_view_count(url: str, table_name: str) -> int:
+    return _get_sharded_counter(table_name).get_views(url)
+
+
 def main():
 
     create_table_if_not_exists()
@@ -204,6 +510,9 @@ def main():
     # less_naive_view_counter(view_event, TABLE_NAME)
     # very_naive_view_counter(view_event, TABLE_NAME)
     # accurate_view_counter(view_event, TABLE_NAME)
+    # sharded_view_counter(view_event, TABLE_NAME)
+    # batch_view_counter([view_event, view_event], TABLE_NAME)
+    # print(get_sharded_view_count(view_event["url"], TABLE_NAME))
     accurate_view_counter_with_ttl(view_event, TABLE_NAME)
 
 if __name__ == "__main__":
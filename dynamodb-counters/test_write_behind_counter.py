@@ -0,0 +1,76 @@
+# pylint: disable=redefined-outer-name
+import threading
+import time
+
+import pytest
+from botocore.exceptions import EndpointConnectionError
+
+from write_behind_counter import WriteBehindCounter
+
+
+@pytest.fixture
+def written():
+    """Records the increments that reached the table, except for the unreachable URL."""
+    return {}
+
+
+@pytest.fixture
+def counter(written):
+    """Provides a WriteBehindCounter that flushes often and gives up quickly."""
+
+    lock = threading.Lock()
+
+    def increment_function(url: str, increment: int, table_name: str):
+        if url == "unreachable":
+            raise EndpointConnectionError(endpoint_url="http://localhost:8000")
+
+        with lock:
+            written[url] = written.get(url, 0) + increment
+
+    counter = WriteBehindCounter(
+        "views",
+        flush_interval_seconds=0.05,
+        max_attempts=2,
+        base_backoff_seconds=0.001,
+        increment_function=increment_function,
+    )
+    yield counter
+    counter.close()
+
+
+def test_that_connection_errors_drop_the_increments(counter, written):
+    """
+    Assert that increments that can't be written are counted as dropped and don't affect the others.
+    """
+
+    # Arrange
+    for _ in range(3):
+        counter.increment("unreachable")
+        counter.increment("reachable")
+
+    # Act
+    counter.flush()
+
+    # Assert
+    assert counter.metrics()["droppedIncrements"] == 3
+    assert written == {"reachable": 3}
+
+
+def test_that_the_counter_keeps_flushing_after_connection_errors(counter, written):
+    """
+    Assert that the background flushes continue after a flush ran into connection errors.
+    """
+
+    # Arrange
+    counter.increment("unreachable")
+    counter.flush()
+
+    # Act
+    counter.increment("reachable", 2)
+    deadline = time.monotonic() + 5
+    while counter.metrics()["flushedIncrements"] < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    # Assert
+    assert written == {"reachable": 2}
+    assert counter.metrics()["flushedIncrements"] == 2
@@ -0,0 +1,148 @@
+"""
+Buffers view counter increments in memory and writes them to DynamoDB in the background.
+
+Instead of one UpdateItem per page view, the increments are summed up per URL
+and flushed as one update per URL when the buffer holds max_buffered_keys URLs
+or flush_interval_seconds have passed, whichever comes first.
+
+Increments that are still buffered when the process dies are lost, so call
+close() on shutdown to drain the buffer.
+"""
+import random
+import threading
+import time
+import typing
+
+from botocore.exceptions import ClientError
+
+from dynamodb_counter import increment_views
+
+
+class WriteBehindCounter:
+    """Thread safe write-behind buffer for the view counter, flushes from a background thread."""
+
+    def __init__(
+            self,
+            table_name: str,
+            flush_interval_seconds: float = 1.0,
+            max_buffered_keys: int = 1000,
+            max_attempts: int = 5,
+            base_backoff_seconds: float = 0.05,
+            increment_function: typing.Callable[[str, int, str], None] = increment_views,
+        ):
+
+        self.table_name = table_name
+        self.flush_interval_seconds = flush_interval_seconds
+        self.max_buffered_keys = max_buffered_keys
+        self.max_attempts = max_attempts
+        self.base_backoff_seconds = base_backoff_seconds
+        self._increment_function = increment_function
+
+        self._buffer: typing.Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._flush_requested = threading.Event()
+        self._closed = False
+
+        # Metrics
+        self.flushes = 0
+        self.flushed_increments = 0
+        self.dropped_increments = 0
+        self.last_flush_latency_ms = 0.0
+        self.max_flush_latency_ms = 0.0
+
+        self._thread = threading.Thread(target=self._run, name="write-behind-counter", daemon=True)
+        self._thread.start()
+
+    def increment(self, url: str, increment: int = 1):
+        """Adds the increment to the buffer, this doesn't talk to DynamoDB."""
+
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("The counter is already closed")
+
+            self._buffer[url] = self._buffer.get(url, 0) + increment
+            buffered_keys = len(self._buffer)
+
+        if buffered_keys >= self.max_buffered_keys:
+            self._flush_requested.set()
+
+    def _write_with_retries(self, url: str, increment: int) -> bool:
+
+        for attempt in range(self.max_attempts):
+            try:
+                self._increment_function(url, increment, self.table_name)
+                return True
+            except Exception as err:  # pylint: disable=broad-except
+                # Connection errors and timeouts must not end the flush thread either
+                reason = err.response["Error"]["Code"] if isinstance(err, ClientError) else repr(err)
+                print(f"Flushing {increment} views for {url} failed: {reason}")
+                if attempt + 1 < self.max_attempts:
+                    time.sleep(random.uniform(0, self.base_backoff_seconds * 2 ** attempt))
+
+        return False
+
+    def flush(self):
+        """Writes everything that's currently buffered, one update per URL."""
+
+        with self._lock:
+            buffer, self._buffer = self._buffer, {}
+
+        if not buffer:
+            return
+
+        started_at = time.perf_counter()
+        flushed_increments = dropped_increments = 0
+
+        for url, increment in buffer.items():
+            if self._write_with_retries(url, increment):
+                flushed_increments += increment
+            else:
+                dropped_increments += increment
+
+        flush_latency_ms = (time.perf_counter() - started_at) * 1000
+
+        # flush may run on the background thread and the caller's thread at the same time
+        with self._lock:
+            self.flushed_increments += flushed_increments
+            self.dropped_increments += dropped_increments
+            self.last_flush_latency_ms = flush_latency_ms
+            self.max_flush_latency_ms = max(self.max_flush_latency_ms, flush_latency_ms)
+            self.flushes += 1
+
+    def _run(self):
+
+        while not self._closed:
+            self._flush_requested.wait(self.flush_interval_seconds)
+            self._flush_requested.clear()
+            self.flush()
+
+    def close(self):
+        """Stops the background thread and drains the buffer."""
+
+        with self._lock:
+            self._closed = True
+
+        self._flush_requested.set()
+        self._thread.join()
+
+        # Increments that arrived while the last flush was running
+        self.flush()
+
+    def __enter__(self) -> "WriteBehindCounter":
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def metrics(self) -> dict:
+
+        with self._lock:
+            return {
+                "bufferedKeys": len(self._buffer),
+                "bufferedIncrements": sum(self._buffer.values()),
+                "flushes": self.flushes,
+                "flushedIncrements": self.flushed_increments,
+                "droppedIncrements": self.dropped_increments,
+                "lastFlushLatencyMs": self.last_flush_latency_ms,
+                "maxFlushLatencyMs": self.max_flush_latency_ms,
+            }
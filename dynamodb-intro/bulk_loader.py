@@ -0,0 +1,266 @@
+"""
+Bulk loads synthetic authors and books into the library table from library_example.py.
+
+The items are generated as a stream, nothing is kept in memory. The authors are
+split into one segment per worker thread, each worker generates the items of
+its segment and writes them with BatchWriteItem, 25 at a time. Items that
+DynamoDB didn't process, e.g. because the table is throttled, are retried with
+exponential backoff. The throughput is printed while the load runs.
+
+It runs against a moto server in a background thread by default. Use
+--endpoint-url for DynamoDB Local or any other endpoint, e.g.
+
+    docker run -p 8000:8000 amazon/dynamodb-local
+    python bulk_loader.py --endpoint-url http://localhost:8000 --create-table --authors 10000 --books-per-author 100
+"""
+import argparse
+import datetime
+import logging
+import os
+import random
+import socket
+import threading
+import time
+import typing
+
+import boto3
+
+# BatchWriteItem accepts at most 25 items per request
+MAX_BATCH_WRITE_ITEMS = 25
+
+
+def generate_author(author_index: int, rng: random.Random) -> dict:
+
+    author_name = f"author_{author_index}"
+    birthday = datetime.date(1920, 1, 1) + datetime.timedelta(days=rng.randrange(30_000))
+
+    return {
+        "PK": f"AUTHOR#{author_name}",
+        "SK": "METADATA",
+        "type": "AUTHOR",
+        "Name": author_name,
+        "Birthday": birthday.isoformat()
+    }
+
+
+def generate_book(author_index: int, book_index: int, books_per_author: int, rng: random.Random) -> dict:
+
+    author_name = f"author_{author_index}"
+
+    # Derived from the position instead of random, so ISBNs never collide
+    book_isbn = f"978-{1_000_000_000 + author_index * books_per_author + book_index}"
+
+    return {
+        "PK": f"AUTHOR#{author_name}",
+        "SK": f"ISBN#{book_isbn}",
+        "type": "BOOK",
+        "Author": author_name,
+        "Title": f"book_{book_index} by {author_name}",
+        "Pages": rng.randint(50, 1500),
+        "GSI1PK": f"ISBN#{book_isbn}",
+        "GSI1SK": f"ISBN#{book_isbn}"
+    }
+
+
+def generate_items(
+        num_authors: int,
+        books_per_author: int,
+        segment: int = 0,
+        total_segments: int = 1,
+        seed: typing.Optional[int] = None,
+    ) -> typing.Iterator[dict]:
+    """Yields the authors of the segment, each followed by their books."""
+
+    rng = random.Random(None if seed is None else seed * total_segments + segment)
+
+    for author_index in range(segment, num_authors, total_segments):
+        yield generate_author(author_index, rng)
+
+        for book_index in range(books_per_author):
+            yield generate_book(author_index, book_index, books_per_author, rng)
+
+
+class LoadProgress:
+    """Counts the written items and retries of all workers."""
+
+    def __init__(self):
+        self.items = 0
+        self.retries = 0
+        self.started_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def add(self, items: int = 0, retries: int = 0):
+        with self._lock:
+            self.items += items
+            self.retries += retries
+
+    def summary(self) -> dict:
+        duration = time.monotonic() - self.started_at
+        return {
+            "items": self.items,
+            "retries": self.retries,
+            "durationSeconds": duration,
+            "itemsPerSecond": self.items / duration if duration > 0 else 0.0,
+        }
+
+
+def write_batch(
+        dynamodb,
+        table_name: str,
+        items: typing.List[dict],
+        progress: LoadProgress,
+        max_attempts: int = 10,
+        base_backoff_seconds: float = 0.05,
+        max_backoff_seconds: float = 5.0,
+    ):
+    """Writes up to 25 items and retries the unprocessed ones with exponential backoff and jitter."""
+
+    request_items = {table_name: [{"PutRequest": {"Item": item}} for item in items]}
+
+    for attempt in range(max_attempts):
+        response = dynamodb.batch_write_item(RequestItems=request_items)
+
+        unprocessed_items = response.get("UnprocessedItems") or {}
+        unprocessed_count = len(unprocessed_items.get(table_name, []))
+        progress.add(items=len(request_items[table_name]) - unprocessed_count)
+
+        if not unprocessed_count:
+            return
+
+        progress.add(retries=1)
+        request_items = unprocessed_items
+        time.sleep(random.uniform(0, min(max_backoff_seconds, base_backoff_seconds * 2 ** attempt)))
+
+    raise RuntimeError(f"Couldn't write {unprocessed_count} items after {max_attempts} attempts")
+
+
+def load_segment(
+        table_name: str,
+        num_authors: int,
+        books_per_author: int,
+        segment: int,
+        total_segments: int,
+        progress: LoadProgress,
+        seed: typing.Optional[int] = None,
+    ):
+    """Generates and writes the items of one segment."""
+
+    # Each worker needs its own session, they aren't thread safe
+    dynamodb = boto3.session.Session().resource("dynamodb")
+
+    batch = []
+    for item in generate_items(num_authors, books_per_author, segment, total_segments, seed):
+        batch.append(item)
+
+        if len(batch) == MAX_BATCH_WRITE_ITEMS:
+            write_batch(dynamodb, table_name, batch, progress)
+            batch = []
+
+    if batch:
+        write_batch(dynamodb, table_name, batch, progress)
+
+
+def bulk_load(
+        table_name: str,
+        num_authors: int,
+        books_per_author: int,
+        workers: int = 8,
+        report_interval_seconds: typing.Optional[float] = 5.0,
+        seed: typing.Optional[int] = None,
+    ) -> dict:
+    """Loads the authors and their books on a pool of worker threads and returns the throughput."""
+
+    progress = LoadProgress()
+    errors: typing.List[BaseException] = []
+    finished = threading.Event()
+
+    def _worker(segment: int):
+        try:
+            load_segment(table_name, num_authors, books_per_author, segment, workers, progress, seed)
+        except BaseException as err:  # pylint: disable=broad-except
+            errors.append(err)
+
+    def _report():
+        while not finished.wait(report_interval_seconds):
+            summary = progress.summary()
+            print(f"{summary['items']} items, {summary['itemsPerSecond']:.0f} items/s, {summary['retries']} retries")
+
+    threads = [threading.Thread(target=_worker, args=(segment,), name=f"loader-{segment}") for segment in range(workers)]
+    for thread in threads:
+        thread.start()
+
+    if report_interval_seconds:
+        threading.Thread(target=_report, name="loader-report", daemon=True).start()
+
+    for thread in threads:
+        thread.join()
+    finished.set()
+
+    if errors:
+        raise RuntimeError(f"{len(errors)} of {workers} workers failed") from errors[0]
+
+    return progress.summary()
+
+
+def setup_environment(endpoint_url: typing.Optional[str]):
+    """Points the clients at the endpoint, starts a moto server if there is none."""
+
+    if endpoint_url is None:
+        from moto.server import ThreadedMotoServer
+
+        # Let the OS pick a free port for the server
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+
+        logging.getLogger("werkzeug").setLevel(logging.CRITICAL)
+        ThreadedMotoServer(ip_address="127.0.0.1", port=port, verbose=False).start()
+        endpoint_url = f"http://127.0.0.1:{port}"
+
+    os.environ["AWS_ENDPOINT_URL_DYNAMODB"] = endpoint_url
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "local")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "local")
+    os.environ.setdefault("AWS_DEFAULT_REGION", "eu-central-1")
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Bulk load synthetic authors and books into the library table.")
+    parser.add_argument("--table-name", help="Defaults to the table of library_example.py")
+    parser.add_argument("--authors", type=int, default=1000)
+    parser.add_argument("--books-per-author", type=int, default=10)
+    parser.add_argument("--workers", "-w", type=int, default=8)
+    parser.add_argument("--seed", type=int, help="Makes the generated attributes reproducible")
+    parser.add_argument("--report-interval", type=float, default=5.0, help="Seconds between progress reports")
+    parser.add_argument("--create-table", action="store_true", help="Create the table before loading")
+    parser.add_argument("--endpoint-url", help="e.g. http://localhost:8000 for DynamoDB Local, uses moto if omitted")
+    args = parser.parse_args()
+
+    setup_environment(args.endpoint_url)
+
+    # It creates its resources on import, which needs the region and endpoint from above
+    import library_example
+
+    table_name = args.table_name or library_example.TABLE_NAME
+
+    # A fresh moto server has no tables
+    if args.create_table or args.endpoint_url is None:
+        library_example.create_table(table_name)
+
+    summary = bulk_load(
+        table_name,
+        args.authors,
+        args.books_per_author,
+        workers=args.workers,
+        report_interval_seconds=args.report_interval,
+        seed=args.seed,
+    )
+
+    print(
+        f"Loaded {summary['items']} items in {summary['durationSeconds']:.1f}s, "
+        f"{summary['itemsPerSecond']:.0f} items/s, {summary['retries']} retries"
+    )
+
+
+if __name__ == "__main__":
+    main()
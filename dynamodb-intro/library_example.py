@@ -3,12 +3,13 @@ import random
 import typing
 
 import boto3
-import boto3.dynamodb.conditions as conditions
+
+from library_repository import LibraryRepository
 
 TABLE_NAME = "LibraryV2"
 TABLE_RESOURCE = boto3.resource("dynamodb").Table(TABLE_NAME)
 
-def create_table():
+def create_table(table_name: str = TABLE_NAME):
     ddb = boto3.client("dynamodb")
     ddb.create_table(
         AttributeDefinitions=[
@@ -17,7 +18,7 @@ def create_table():
             {"AttributeName": "GSI1PK", "AttributeType": "S"},
             {"AttributeName": "GSI1SK", "AttributeType": "S"}
         ],
-        TableName=TABLE_NAME,
+        TableName=table_name,
         KeySchema=[{"AttributeName": "PK", "KeyType": "HASH"}, {"AttributeName": "SK", "KeyType": "RANGE"}],
         BillingMode="PAY_PER_REQUEST",
         GlobalSecondaryIndexes=[
@@ -73,51 +74,23 @@ def get_some_books():
 
     TABLE_RESOURCE
 
-def get_author_by_name(author_name: str) -> dict:
-
-    table = boto3.resource("dynamodb").Table(TABLE_NAME)
+# Keeps its resources, reads all pages and runs bulk lookups in parallel
+REPOSITORY = LibraryRepository(TABLE_NAME)
 
-    response = table.get_item(
-        Key={
-            "PK": f"AUTHOR#{author_name}",
-            "SK": "METADATA"
-        }
-    )
-
-    return response["Item"]
+def get_author_by_name(author_name: str) -> typing.Optional[dict]:
+    return REPOSITORY.get_author(author_name)
 
 def get_all_author_information(author_name: str) -> typing.List[dict]:
-
-    table = boto3.resource("dynamodb").Table(TABLE_NAME)
-
-    response = table.query(
-        KeyConditionExpression=conditions.Key("PK").eq(f"AUTHOR#{author_name}")
-    )
-
-    return response["Items"]
+    return REPOSITORY.get_all_author_information(author_name)
 
 def get_books_by_author(author_name: str) -> typing.List[dict]:
+    return REPOSITORY.get_books_by_author(author_name)
 
-    table = boto3.resource("dynamodb").Table(TABLE_NAME)
-
-    response = table.query(
-        KeyConditionExpression=conditions.Key("PK").eq(f"AUTHOR#{author_name}") \
-            & conditions.Key("SK").begins_with("ISBN")
-    )
-
-    return response["Items"]
-
-def get_book_by_isbn(isbn: str) -> dict:
+def get_book_by_isbn(isbn: str) -> typing.Optional[dict]:
+    return REPOSITORY.get_book_by_isbn(isbn)
 
-    table = boto3.resource("dynamodb").Table(TABLE_NAME)
-
-    response = table.query(
-        KeyConditionExpression=conditions.Key("GSI1PK").eq(f"ISBN#{isbn}") \
-            & conditions.Key("GSI1SK").eq(f"ISBN#{isbn}"),
-        IndexName="GSI1"
-    )
-
-    return response["Items"][0]
+def get_author_page(author_name: str) -> dict:
+    return REPOSITORY.get_author_page(author_name)
 
 def create_table_with_sample_data():
     create_table()
@@ -130,5 +103,9 @@ if __name__ == "__main__":
     # print(get_author_by_name("author_1"))
     # print(get_all_author_information("author_1"))
     # print(get_books_by_author("author_1"))
+    # print(get_author_page("author_1"))
+
+    # cached_repository = LibraryRepository(TABLE_NAME, cache_ttl_seconds=60)
+    # print(cached_repository.get_authors_information(["author_1", "author_2"]))
 
     # print(get_book_by_isbn("978-1123541827"))
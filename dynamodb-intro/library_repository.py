@@ -0,0 +1,272 @@
+"""
+Read access to the library table from library_example.py.
+
+The repository keeps its table resources around instead of creating them for
+each call, reads all pages of a query, runs lookups for many authors or ISBNs
+in parallel and can cache the results for a while.
+
+An author page, i.e. the author and all of their books, is a single query
+because both live in the same item collection.
+"""
+import concurrent.futures
+import copy
+import threading
+import time
+import typing
+
+import boto3
+import boto3.dynamodb.conditions as conditions
+
+# BatchGetItem accepts at most 100 keys per request
+MAX_BATCH_GET_KEYS = 100
+
+
+class TTLCache:
+    """A small thread safe cache whose entries expire after ttl_seconds."""
+
+    def __init__(self, ttl_seconds: float, max_entries: int = 10_000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: typing.Dict[typing.Hashable, typing.Tuple[float, typing.Any]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: typing.Hashable) -> typing.Tuple[bool, typing.Any]:
+        """Returns (True, value) on a hit and (False, None) otherwise."""
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return False, None
+
+            return True, value
+
+    def put(self, key: typing.Hashable, value: typing.Any):
+
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                # Drop the entry that expires first
+                del self._entries[min(self._entries, key=lambda entry_key: self._entries[entry_key][0])]
+
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class LibraryRepository:
+    """
+    Queries for authors and books. Pass cache_ttl_seconds to cache the results,
+    max_workers limits the parallel requests of the bulk lookups.
+    """
+
+    def __init__(
+            self,
+            table_name: str,
+            max_workers: int = 8,
+            cache_ttl_seconds: typing.Optional[float] = None,
+        ):
+
+        self.table_name = table_name
+        self.max_workers = max_workers
+        self.cache = TTLCache(cache_ttl_seconds) if cache_ttl_seconds else None
+
+        # Resources aren't thread safe, so each thread gets its own
+        self._local = threading.local()
+        self._session = boto3.session.Session()
+        self._session_lock = threading.Lock()
+
+        # The pool lives as long as the repository, so its threads keep their resources
+        self._executor: typing.Optional[concurrent.futures.ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+
+    @property
+    def dynamodb(self):
+        """The service resource of the current thread."""
+
+        resource = getattr(self._local, "resource", None)
+        if resource is None:
+            # Creating resources from the same session at the same time isn't safe either
+            with self._session_lock:
+                resource = self._session.resource("dynamodb")
+            self._local.resource = resource
+
+        return resource
+
+    @property
+    def table(self):
+        """The table resource of the current thread."""
+
+        table = getattr(self._local, "table", None)
+        if table is None:
+            table = self._local.table = self.dynamodb.Table(self.table_name)
+
+        return table
+
+    def _cached(self, key: tuple, load: typing.Callable[[], typing.Any]) -> typing.Any:
+        """
+        Read-through cache, load is only called on a miss. Callers get a copy,
+        so changing a result doesn't change what later calls return.
+        """
+
+        if self.cache is None:
+            return load()
+
+        is_hit, value = self.cache.get(key)
+        if not is_hit:
+            value = load()
+            self.cache.put(key, value)
+
+        return copy.deepcopy(value)
+
+    def _query_all(self, **query_arguments) -> typing.List[dict]:
+        """Runs the query and follows LastEvaluatedKey until all pages are read."""
+
+        items = []
+        while True:
+            response = self.table.query(**query_arguments)
+            items += response["Items"]
+
+            if "LastEvaluatedKey" not in response:
+                return items
+
+            query_arguments["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    def _parallel(self, function: typing.Callable[[str], typing.Any], arguments: typing.Iterable[str]) -> dict:
+
+        unique_arguments = list(dict.fromkeys(arguments))
+
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="library-repository"
+                )
+            executor = self._executor
+
+        return dict(zip(unique_arguments, executor.map(function, unique_arguments)))
+
+    def close(self):
+        """Stops the worker threads of the bulk lookups."""
+
+        with self._executor_lock:
+            executor, self._executor = self._executor, None
+
+        if executor is not None:
+            executor.shutdown()
+
+    def __enter__(self) -> "LibraryRepository":
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def get_author(self, author_name: str) -> typing.Optional[dict]:
+
+        def _load():
+            response = self.table.get_item(
+                Key={
+                    "PK": f"AUTHOR#{author_name}",
+                    "SK": "METADATA"
+                }
+            )
+            return response.get("Item")
+
+        return self._cached(("author", author_name), _load)
+
+    def get_all_author_information(self, author_name: str) -> typing.List[dict]:
+        """The author's metadata and all of their books."""
+
+        return self._cached(
+            ("author_information", author_name),
+            lambda: self._query_all(
+                KeyConditionExpression=conditions.Key("PK").eq(f"AUTHOR#{author_name}")
+            )
+        )
+
+    def get_author_page(self, author_name: str) -> dict:
+        """The author and their books from a single (paginated) query."""
+
+        author, books = None, []
+        for item in self.get_all_author_information(author_name):
+            if item["SK"] == "METADATA":
+                author = item
+            elif item["SK"].startswith("ISBN#"):
+                books.append(item)
+
+        return {"author": author, "books": books}
+
+    def get_books_by_author(self, author_name: str) -> typing.List[dict]:
+
+        return self._cached(
+            ("books_by_author", author_name),
+            lambda: self._query_all(
+                KeyConditionExpression=conditions.Key("PK").eq(f"AUTHOR#{author_name}") \
+                    & conditions.Key("SK").begins_with("ISBN")
+            )
+        )
+
+    def get_book_by_isbn(self, isbn: str) -> typing.Optional[dict]:
+
+        def _load():
+            items = self._query_all(
+                KeyConditionExpression=conditions.Key("GSI1PK").eq(f"ISBN#{isbn}") \
+                    & conditions.Key("GSI1SK").eq(f"ISBN#{isbn}"),
+                IndexName="GSI1"
+            )
+            return items[0] if items else None
+
+        return self._cached(("book_by_isbn", isbn), _load)
+
+    def get_books_by_isbns(self, isbns: typing.Iterable[str]) -> typing.Dict[str, typing.Optional[dict]]:
+        """
+        Looks up the ISBNs in parallel through the GSI. The base table needs the
+        author as well, use get_books if you know it, that's a lot cheaper.
+        """
+
+        return self._parallel(self.get_book_by_isbn, isbns)
+
+    def get_authors_information(self, author_names: typing.Iterable[str]) -> typing.Dict[str, typing.List[dict]]:
+        """Queries the item collections of the authors in parallel."""
+
+        return self._parallel(self.get_all_author_information, author_names)
+
+    def get_books(
+            self,
+            author_isbn_pairs: typing.Iterable[typing.Tuple[str, str]],
+            max_attempts: int = 5
+        ) -> typing.List[dict]:
+        """
+        Reads the books by their (author name, ISBN) with BatchGetItem, 100 keys per request.
+        Keys that DynamoDB didn't process are retried with exponential backoff.
+        """
+
+        keys = [
+            {"PK": f"AUTHOR#{author_name}", "SK": f"ISBN#{isbn}"}
+            for author_name, isbn in dict.fromkeys(author_isbn_pairs)
+        ]
+
+        books = []
+
+        for start in range(0, len(keys), MAX_BATCH_GET_KEYS):
+
+            request_items = {self.table_name: {"Keys": keys[start:start + MAX_BATCH_GET_KEYS]}}
+
+            for attempt in range(max_attempts):
+                response = self.dynamodb.batch_get_item(RequestItems=request_items)
+                books += response["Responses"].get(self.table_name, [])
+
+                request_items = response.get("UnprocessedKeys") or {}
+                if not request_items:
+                    break
+
+                if attempt + 1 < max_attempts:
+                    time.sleep(0.05 * 2 ** attempt)
+            else:
+                raise RuntimeError(f"Couldn't read all books after {max_attempts} attempts")
+
+        return books
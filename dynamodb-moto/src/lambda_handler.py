@@ -1,12 +1,13 @@
 import os
-import boto3
 import boto3.dynamodb.conditions as conditions
 
+import client_factory
+
 ENV_TABLE_NAME = "TABLE_NAME"
 
 def get_table_resource():
 
-    dynamodb_resource = boto3.resource("dynamodb")
+    dynamodb_resource = client_factory.get_resource("dynamodb")
     table_name = os.environ[ENV_TABLE_NAME]
     return dynamodb_resource.Table(table_name)
 
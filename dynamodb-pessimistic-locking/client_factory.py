@@ -0,0 +1,119 @@
+"""
+Creates boto3 sessions, clients and resources once per execution context.
+
+Creating a client parses the service model, resolves credentials and sets up
+the endpoint resolution, which takes a couple of milliseconds even when boto3
+is already imported. Handlers should get their clients from here instead of
+calling boto3.client in the request path.
+
+Call preload at the module level of the handler to do the work during the
+init phase of the Lambda function, i.e. before the first request arrives.
+
+Clients are thread safe, resources aren't - don't share resources between threads.
+"""
+import threading
+import typing
+
+import boto3
+from botocore.config import Config
+
+_LOCK = threading.Lock()
+
+_SESSIONS: typing.Dict[typing.Optional[str], boto3.session.Session] = {}
+_CLIENTS: typing.Dict[tuple, typing.Any] = {}
+_RESOURCES: typing.Dict[tuple, typing.Any] = {}
+
+
+def _config_key(config: typing.Optional[Config]) -> typing.Optional[tuple]:
+    """Configs aren't hashable, but the options the user provided are."""
+
+    if config is None:
+        return None
+
+    options = getattr(config, "_user_provided_options", None)
+    if options is None:
+        return (id(config),)
+
+    return tuple(sorted((key, repr(value)) for key, value in options.items()))
+
+
+def get_session(region_name: typing.Optional[str] = None) -> boto3.session.Session:
+    """Returns the cached session for the region, None means the default region."""
+
+    session = _SESSIONS.get(region_name)
+    if session is None:
+        with _LOCK:
+            session = _SESSIONS.get(region_name)
+            if session is None:
+                session = boto3.session.Session(region_name=region_name)
+                _SESSIONS[region_name] = session
+
+    return session
+
+
+def get_client(
+        service_name: str,
+        region_name: typing.Optional[str] = None,
+        config: typing.Optional[Config] = None,
+        endpoint_url: typing.Optional[str] = None,
+    ):
+    """Returns the cached client for (service, region, config, endpoint) or creates it."""
+
+    cache_key = (service_name, region_name, _config_key(config), endpoint_url)
+
+    client = _CLIENTS.get(cache_key)
+    if client is None:
+        session = get_session(region_name)
+        with _LOCK:
+            client = _CLIENTS.get(cache_key)
+            if client is None:
+                client = session.client(service_name, config=config, endpoint_url=endpoint_url)
+                _CLIENTS[cache_key] = client
+
+    return client
+
+
+def get_resource(
+        service_name: str,
+        region_name: typing.Optional[str] = None,
+        config: typing.Optional[Config] = None,
+        endpoint_url: typing.Optional[str] = None,
+    ):
+    """Returns the cached resource for (service, region, config, endpoint) or creates it."""
+
+    cache_key = (service_name, region_name, _config_key(config), endpoint_url)
+
+    resource = _RESOURCES.get(cache_key)
+    if resource is None:
+        session = get_session(region_name)
+        with _LOCK:
+            resource = _RESOURCES.get(cache_key)
+            if resource is None:
+                resource = session.resource(service_name, config=config, endpoint_url=endpoint_url)
+                _RESOURCES[cache_key] = resource
+
+    return resource
+
+
+def preload(*service_names: str, region_name: typing.Optional[str] = None, resources: bool = False):
+    """
+    Creates the clients (and resources) for the services up front, which loads
+    the service models and resolves the credentials. Call it at the module level.
+    """
+
+    for service_name in service_names:
+        get_client(service_name, region_name=region_name)
+        if resources:
+            get_resource(service_name, region_name=region_name)
+
+    # Credentials are resolved lazily, make sure that happens now as well.
+    get_session(region_name).get_credentials()
+
+
+def clear_cache():
+    """Forgets all sessions, clients and resources, e.g. between tests."""
+
+    with _LOCK:
+        _SESSIONS.clear()
+        _CLIENTS.clear()
+        _RESOURCES.clear()
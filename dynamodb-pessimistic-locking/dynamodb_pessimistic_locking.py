@@ -1,29 +1,152 @@
+import contextlib
+import logging
+import random
+import threading
+import time
 import typing
+import uuid
 
-from datetime import datetime, timedelta
-import boto3
+from datetime import datetime, timedelta, timezone
 from boto3.dynamodb import conditions
 
+import client_factory
+
 TABLE_NAME = "locks"
 
+LOGGER = logging.getLogger(__name__)
+
+
+class LockMetrics:
+    """
+    Collects what happens to the locks: acquire latency, attempts per acquire,
+    hold times, expirations (a holder lost its lock) and steals (an expired lock
+    was taken over). Subclass it and extend the on_* hooks to publish the
+    numbers elsewhere, e.g. as CloudWatch metrics.
+    """
+
+    def __init__(self):
+        self.acquisitions = 0
+        self.failed_acquisitions = 0
+        self.releases = 0
+        self.failed_releases = 0
+        self.expirations = 0
+        self.steals = 0
+
+        self.acquire_latencies_seconds: typing.List[float] = []
+        self.attempts_per_acquire: typing.List[int] = []
+        self.hold_times_seconds: typing.List[float] = []
+
+        self._acquired_at: typing.Dict[typing.Tuple[str, str], float] = {}
+        self._lock = threading.Lock()
+
+    def on_acquire(
+            self,
+            resource_name: str,
+            transaction_id: str,
+            latency_seconds: float,
+            attempts: int,
+            acquired: bool,
+            stolen: bool = False,
+        ):
+
+        with self._lock:
+            self.acquire_latencies_seconds.append(latency_seconds)
+            self.attempts_per_acquire.append(attempts)
+
+            if not acquired:
+                self.failed_acquisitions += 1
+                return
+
+            self.acquisitions += 1
+            self.steals += int(stolen)
+            self._acquired_at[(resource_name, transaction_id)] = time.monotonic()
+
+    def on_release(self, resource_name: str, transaction_id: str, released: bool):
+
+        with self._lock:
+            acquired_at = self._acquired_at.pop((resource_name, transaction_id), None)
+
+            if not released:
+                # The lock expired and may already belong to someone else
+                self.failed_releases += 1
+                return
+
+            self.releases += 1
+            if acquired_at is not None:
+                self.hold_times_seconds.append(time.monotonic() - acquired_at)
+
+    def on_expiration(self, resource_name: str, transaction_id: str):
+
+        with self._lock:
+            self.expirations += 1
+            self._acquired_at.pop((resource_name, transaction_id), None)
+
+    def summary(self) -> dict:
+
+        def _mean(values: typing.List[float]) -> float:
+            return sum(values) / len(values) if values else 0.0
+
+        with self._lock:
+            return {
+                "acquisitions": self.acquisitions,
+                "failedAcquisitions": self.failed_acquisitions,
+                "releases": self.releases,
+                "failedReleases": self.failed_releases,
+                "expirations": self.expirations,
+                "steals": self.steals,
+                "meanAcquireLatencySeconds": _mean(self.acquire_latencies_seconds),
+                "maxAcquireLatencySeconds": max(self.acquire_latencies_seconds, default=0.0),
+                "meanAttemptsPerAcquire": _mean(self.attempts_per_acquire),
+                "meanHoldTimeSeconds": _mean(self.hold_times_seconds),
+            }
+
+
+# Receives the metrics of the module level functions and of lock clients without their own
+_LOCK_METRICS: typing.Optional[LockMetrics] = None
+
+
+def set_lock_metrics(metrics: typing.Optional[LockMetrics]):
+    """Installs the metrics hooks, None turns them off."""
+
+    global _LOCK_METRICS
+    _LOCK_METRICS = metrics
+
+
+def _utc_timestamp(offset_in_seconds: float = 0) -> str:
+    """
+    ISO timestamps in UTC with a fixed format, so they can be compared as strings
+    no matter which timezone the workers run in.
+    """
+
+    return (datetime.now(timezone.utc) + timedelta(seconds=offset_in_seconds)).isoformat(
+        timespec="milliseconds"
+    )
+
+
+def _lock_key(resource_name: str) -> dict:
+    return {"PK": "LOCK", "SK": f"RES#{resource_name}"}
+
+
+def _low_level_lock_key(resource_name: str) -> dict:
+    return {"PK": {"S": "LOCK"}, "SK": {"S": f"RES#{resource_name}"}}
+
 
 def acquire_lock(
     resource_name: str, timeout_in_seconds: int, transaction_id: str
 ) -> bool:
 
-    dynamodb = boto3.resource("dynamodb")
+    dynamodb = client_factory.get_resource("dynamodb")
     ex = dynamodb.meta.client.exceptions
     table = dynamodb.Table(TABLE_NAME)
 
-    now = datetime.now().isoformat(timespec="seconds")
-    new_timeout = (datetime.now() + timedelta(seconds=timeout_in_seconds)).isoformat(
-        timespec="seconds"
-    )
+    now = _utc_timestamp()
+    new_timeout = _utc_timestamp(timeout_in_seconds)
+    started_at = time.monotonic()
 
     try:
 
-        table.update_item(
-            Key={"PK": "LOCK", "SK": f"RES#{resource_name}"},
+        response = table.update_item(
+            Key=_lock_key(resource_name),
             UpdateExpression="SET #tx_id = :tx_id, #timeout = :timeout",
             ExpressionAttributeNames={
                 "#tx_id": "transaction_id",
@@ -34,31 +157,482 @@ def acquire_lock(
                 ":timeout": new_timeout,
             },
             ConditionExpression=conditions.Or(
-                conditions.Attr("SK").not_exists(),  # New Item, i.e. no lock
+                conditions.Attr("transaction_id").not_exists(),  # No lock
                 conditions.Attr("timeout").lt(now),  # Old lock is timed out
             ),
+            ReturnValues="UPDATED_OLD",
         )
 
+        if _LOCK_METRICS is not None:
+            _LOCK_METRICS.on_acquire(
+                resource_name, transaction_id, time.monotonic() - started_at, 1, True,
+                stolen="transaction_id" in response.get("Attributes", {}),
+            )
+
         return True
 
     except ex.ConditionalCheckFailedException:
         # It's already locked
+        if _LOCK_METRICS is not None:
+            _LOCK_METRICS.on_acquire(resource_name, transaction_id, time.monotonic() - started_at, 1, False)
         return False
 
 
 def release_lock(resource_name: str, transaction_id: str) -> bool:
 
-    dynamodb = boto3.resource("dynamodb")
+    dynamodb = client_factory.get_resource("dynamodb")
     table = dynamodb.Table(TABLE_NAME)
 
     ex = dynamodb.meta.client.exceptions
 
     try:
-        table.delete_item(
-            Key={"PK": "LOCK", "SK": f"RES#{resource_name}"},
+        # The item stays, it holds the fencing token counter of the LockClient
+        table.update_item(
+            Key=_lock_key(resource_name),
+            UpdateExpression="REMOVE #tx_id, #timeout",
+            ExpressionAttributeNames={
+                "#tx_id": "transaction_id",
+                "#timeout": "timeout",
+            },
             ConditionExpression=conditions.Attr("transaction_id").eq(transaction_id),
         )
-        return True
+        is_released = True
 
     except (ex.ConditionalCheckFailedException, ex.ResourceNotFoundException):
-        return False
+        is_released = False
+
+    if _LOCK_METRICS is not None:
+        _LOCK_METRICS.on_release(resource_name, transaction_id, is_released)
+
+    return is_released
+
+
+# A transaction can't contain more than 100 actions
+MAX_LOCKS_PER_TRANSACTION = 100
+
+
+def _unique_resource_names(resource_names: typing.Iterable[str]) -> typing.List[str]:
+    """A transaction can't touch the same item twice, so duplicates are removed."""
+
+    unique_names = sorted(set(resource_names))
+
+    if len(unique_names) > MAX_LOCKS_PER_TRANSACTION:
+        raise ValueError(f"At most {MAX_LOCKS_PER_TRANSACTION} locks can be handled at once")
+
+    return unique_names
+
+
+def acquire_locks(
+    resource_names: typing.Iterable[str], timeout_in_seconds: int, transaction_id: str
+) -> bool:
+    """
+    Acquires the locks for all resources in a single transaction, i.e. either
+    all of them or none. Returns False if at least one of them is taken.
+    """
+
+    # Transactions are only supported using the client API
+    client = client_factory.get_client("dynamodb")
+
+    now = _utc_timestamp()
+    new_timeout = _utc_timestamp(timeout_in_seconds)
+    unique_names = _unique_resource_names(resource_names)
+    started_at = time.monotonic()
+
+    try:
+        client.transact_write_items(
+            TransactItems=[
+                {
+                    "Update": {
+                        "TableName": TABLE_NAME,
+                        "Key": {
+                            "PK": {"S": "LOCK"},
+                            "SK": {"S": f"RES#{resource_name}"},
+                        },
+                        "UpdateExpression": "SET #tx_id = :tx_id, #timeout = :timeout",
+                        "ConditionExpression": "attribute_not_exists(#tx_id) OR #timeout < :now",
+                        "ExpressionAttributeNames": {
+                            "#tx_id": "transaction_id",
+                            "#timeout": "timeout",
+                        },
+                        "ExpressionAttributeValues": {
+                            ":tx_id": {"S": transaction_id},
+                            ":timeout": {"S": new_timeout},
+                            ":now": {"S": now},
+                        },
+                    }
+                }
+                for resource_name in unique_names
+            ]
+        )
+        are_locked = True
+
+    except client.exceptions.TransactionCanceledException:
+        # At least one of them is already locked or another transaction interfered
+        are_locked = False
+
+    if _LOCK_METRICS is not None:
+        # Transactions don't return the old values, so we can't tell whether a lock was stolen
+        for resource_name in unique_names:
+            _LOCK_METRICS.on_acquire(
+                resource_name, transaction_id, time.monotonic() - started_at, 1, are_locked
+            )
+
+    return are_locked
+
+
+def release_locks(resource_names: typing.Iterable[str], transaction_id: str) -> bool:
+    """
+    Releases the locks for all resources in a single transaction.
+    Returns False and releases none of them if any lock isn't held by the transaction.
+    """
+
+    client = client_factory.get_client("dynamodb")
+    unique_names = _unique_resource_names(resource_names)
+
+    try:
+        client.transact_write_items(
+            TransactItems=[
+                {
+                    "Update": {
+                        "TableName": TABLE_NAME,
+                        "Key": {
+                            "PK": {"S": "LOCK"},
+                            "SK": {"S": f"RES#{resource_name}"},
+                        },
+                        "UpdateExpression": "REMOVE #tx_id, #timeout",
+                        "ConditionExpression": "#tx_id = :tx_id",
+                        "ExpressionAttributeNames": {
+                            "#tx_id": "transaction_id",
+                            "#timeout": "timeout",
+                        },
+                        "ExpressionAttributeValues": {
+                            ":tx_id": {"S": transaction_id},
+                        },
+                    }
+                }
+                for resource_name in unique_names
+            ]
+        )
+        are_released = True
+
+    except (client.exceptions.TransactionCanceledException, client.exceptions.ResourceNotFoundException):
+        are_released = False
+
+    if _LOCK_METRICS is not None:
+        for resource_name in unique_names:
+            _LOCK_METRICS.on_release(resource_name, transaction_id, are_released)
+
+    return are_released
+
+
+class LockNotAcquiredError(Exception):
+    """The lock couldn't be acquired before the deadline."""
+
+
+class Lock:
+    """A lock held by a LockClient, the fencing token increases with every acquisition of the resource."""
+
+    def __init__(self, resource_name: str, transaction_id: str, fencing_token: int, timeout: str):
+        self.resource_name = resource_name
+        self.transaction_id = transaction_id
+        self.fencing_token = fencing_token
+        self.timeout = timeout
+
+        # Set when a renewal fails, i.e. someone else took over the lock
+        self.lost = False
+
+        # Set if the lock was taken over from a holder whose lease had expired
+        self.stolen = False
+
+    def __repr__(self):
+        return f"Lock({self.resource_name!r}, {self.transaction_id!r}, fencing_token={self.fencing_token})"
+
+
+class LockClient:
+    """
+    Acquires, renews and releases locks in the lock table.
+
+    Locks are leases that expire after lease_duration_seconds. As long as the
+    client holds a lock, a background thread renews it every
+    heartbeat_interval_seconds, so slow workers don't lose it.
+
+    Each acquisition returns a fencing token, which is larger than the tokens of
+    all previous holders. Pass it on to the protected resource, so it can reject
+    writes from a holder whose lease has expired in the meantime.
+    """
+
+    def __init__(
+            self,
+            table_name: str = TABLE_NAME,
+            lease_duration_seconds: float = 10,
+            heartbeat_interval_seconds: typing.Optional[float] = None,
+            base_backoff_seconds: float = 0.05,
+            max_backoff_seconds: float = 2,
+            metrics: typing.Optional[LockMetrics] = None,
+        ):
+
+        self.table_name = table_name
+        self.lease_duration_seconds = lease_duration_seconds
+        self.heartbeat_interval_seconds = heartbeat_interval_seconds or lease_duration_seconds / 3
+        self.base_backoff_seconds = base_backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self._own_metrics = metrics
+
+        # The heartbeat thread renews the locks as well, so this uses the thread safe client.
+        self._dynamodb = client_factory.get_client("dynamodb")
+        self._exceptions = self._dynamodb.exceptions
+
+        self._held_locks: typing.Dict[str, Lock] = {}
+        self._held_locks_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._heartbeat_thread: typing.Optional[threading.Thread] = None
+        self._heartbeat_lock = threading.Lock()
+
+    @property
+    def metrics(self) -> typing.Optional[LockMetrics]:
+        return self._own_metrics if self._own_metrics is not None else _LOCK_METRICS
+
+    def try_acquire(self, resource_name: str, transaction_id: typing.Optional[str] = None) -> typing.Optional[Lock]:
+        """A single attempt to acquire the lock, returns None if it's held by someone else."""
+
+        transaction_id = transaction_id or str(uuid.uuid4())
+        started_at = time.monotonic()
+
+        lock = self._try_acquire(resource_name, transaction_id)
+
+        if self.metrics is not None:
+            self.metrics.on_acquire(
+                resource_name, transaction_id, time.monotonic() - started_at, 1,
+                lock is not None, stolen=lock is not None and lock.stolen,
+            )
+
+        return lock
+
+    def _try_acquire(self, resource_name: str, transaction_id: str) -> typing.Optional[Lock]:
+
+        new_timeout = _utc_timestamp(self.lease_duration_seconds)
+
+        try:
+            response = self._dynamodb.update_item(
+                TableName=self.table_name,
+                Key=_low_level_lock_key(resource_name),
+                UpdateExpression="SET #tx_id = :tx_id, #timeout = :timeout ADD #token :one",
+                ExpressionAttributeNames={
+                    "#tx_id": "transaction_id",
+                    "#timeout": "timeout",
+                    "#token": "fencing_token",
+                },
+                ExpressionAttributeValues={
+                    ":tx_id": {"S": transaction_id},
+                    ":timeout": {"S": new_timeout},
+                    ":now": {"S": _utc_timestamp()},
+                    ":one": {"N": "1"},
+                },
+                ConditionExpression="attribute_not_exists(#tx_id) OR #timeout < :now",
+                ReturnValues="UPDATED_OLD",
+            )
+        except self._exceptions.ConditionalCheckFailedException:
+            return None
+
+        old_values = response.get("Attributes", {})
+
+        lock = Lock(
+            resource_name,
+            transaction_id,
+            int(old_values.get("fencing_token", {}).get("N", 0)) + 1,
+            new_timeout,
+        )
+
+        # Someone else's lock expired and we took it over
+        lock.stolen = "transaction_id" in old_values
+
+        with self._held_locks_lock:
+            self._held_locks[resource_name] = lock
+        self._ensure_heartbeat()
+
+        return lock
+
+    def acquire(
+            self,
+            resource_name: str,
+            transaction_id: typing.Optional[str] = None,
+            wait_timeout_seconds: typing.Optional[float] = None,
+        ) -> Lock:
+        """
+        Retries with jittered exponential backoff until the lock is acquired.
+        Raises LockNotAcquiredError if that doesn't happen within wait_timeout_seconds,
+        None means waiting forever.
+        """
+
+        transaction_id = transaction_id or str(uuid.uuid4())
+        started_at = time.monotonic()
+        deadline = None if wait_timeout_seconds is None else started_at + wait_timeout_seconds
+        attempt = 0
+
+        while True:
+            lock = self._try_acquire(resource_name, transaction_id)
+            if lock is not None:
+                if self.metrics is not None:
+                    self.metrics.on_acquire(
+                        resource_name, transaction_id, time.monotonic() - started_at, attempt + 1,
+                        True, stolen=lock.stolen,
+                    )
+                return lock
+
+            backoff = random.uniform(0, min(self.max_backoff_seconds, self.base_backoff_seconds * 2 ** attempt))
+            attempt += 1
+
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    if self.metrics is not None:
+                        self.metrics.on_acquire(
+                            resource_name, transaction_id, time.monotonic() - started_at, attempt, False
+                        )
+                    raise LockNotAcquiredError(
+                        f"Couldn't acquire the lock for {resource_name} within {wait_timeout_seconds}s"
+                    )
+                backoff = min(backoff, remaining)
+
+            time.sleep(backoff)
+
+    def renew(self, lock: Lock) -> bool:
+        """Extends the lease, returns False and marks the lock as lost if it isn't ours anymore."""
+
+        new_timeout = _utc_timestamp(self.lease_duration_seconds)
+
+        try:
+            self._dynamodb.update_item(
+                TableName=self.table_name,
+                Key=_low_level_lock_key(lock.resource_name),
+                UpdateExpression="SET #timeout = :timeout",
+                ExpressionAttributeNames={
+                    "#tx_id": "transaction_id",
+                    "#timeout": "timeout",
+                },
+                ExpressionAttributeValues={
+                    ":tx_id": {"S": lock.transaction_id},
+                    ":timeout": {"S": new_timeout},
+                },
+                ConditionExpression="#tx_id = :tx_id",
+            )
+        except self._exceptions.ConditionalCheckFailedException:
+            if not self._forget(lock):
+                # Released in the meantime, e.g. while the heartbeat was renewing it
+                return False
+
+            lock.lost = True
+            if self.metrics is not None:
+                self.metrics.on_expiration(lock.resource_name, lock.transaction_id)
+            return False
+
+        lock.timeout = new_timeout
+        return True
+
+    def release(self, lock: Lock) -> bool:
+        """Releases the lock, returns False if it wasn't ours anymore."""
+
+        self._forget(lock)
+
+        try:
+            self._dynamodb.update_item(
+                TableName=self.table_name,
+                Key=_low_level_lock_key(lock.resource_name),
+                UpdateExpression="REMOVE #tx_id, #timeout",
+                ExpressionAttributeNames={
+                    "#tx_id": "transaction_id",
+                    "#timeout": "timeout",
+                },
+                ExpressionAttributeValues={
+                    ":tx_id": {"S": lock.transaction_id},
+                },
+                ConditionExpression="#tx_id = :tx_id",
+            )
+            is_released = True
+        except self._exceptions.ConditionalCheckFailedException:
+            is_released = False
+
+        if self.metrics is not None:
+            if not is_released and not lock.lost:
+                # The lease ran out before the heartbeat noticed
+                self.metrics.on_expiration(lock.resource_name, lock.transaction_id)
+            self.metrics.on_release(lock.resource_name, lock.transaction_id, is_released)
+
+        lock.lost = lock.lost or not is_released
+        return is_released
+
+    @contextlib.contextmanager
+    def lock(
+            self,
+            resource_name: str,
+            wait_timeout_seconds: typing.Optional[float] = None,
+        ) -> typing.Iterator[Lock]:
+        """Holds the lock for the duration of the with block."""
+
+        lock = self.acquire(resource_name, wait_timeout_seconds=wait_timeout_seconds)
+        try:
+            yield lock
+        finally:
+            self.release(lock)
+
+    def _forget(self, lock: Lock) -> bool:
+        """Returns False if the lock wasn't held (anymore)."""
+
+        with self._held_locks_lock:
+            if self._held_locks.get(lock.resource_name) is lock:
+                del self._held_locks[lock.resource_name]
+                return True
+            return False
+
+    def _is_held(self, lock: Lock) -> bool:
+        with self._held_locks_lock:
+            return self._held_locks.get(lock.resource_name) is lock
+
+    def _ensure_heartbeat(self):
+
+        # Threads acquiring locks at the same time would otherwise start several heartbeats
+        with self._heartbeat_lock:
+            if self._heartbeat_thread is None or not self._heartbeat_thread.is_alive():
+                self._stopped.clear()
+                self._heartbeat_thread = threading.Thread(
+                    target=self._heartbeat, name="lock-heartbeat", daemon=True
+                )
+                self._heartbeat_thread.start()
+
+    def _heartbeat(self):
+
+        while not self._stopped.wait(self.heartbeat_interval_seconds):
+            with self._held_locks_lock:
+                held_locks = list(self._held_locks.values())
+
+            for lock in held_locks:
+                if not self._is_held(lock):
+                    # Released since the snapshot was taken
+                    continue
+
+                try:
+                    self.renew(lock)
+                except Exception:  # pylint: disable=broad-except
+                    # Keep renewing the other locks, this one may still be ours
+                    LOGGER.exception("Renewing the lock for %s failed", lock.resource_name)
+
+    def close(self, release_held_locks: bool = True):
+        """Stops the heartbeat and releases the locks that are still held."""
+
+        self._stopped.set()
+        with self._heartbeat_lock:
+            heartbeat_thread = self._heartbeat_thread
+        if heartbeat_thread is not None:
+            heartbeat_thread.join()
+
+        if release_held_locks:
+            with self._held_locks_lock:
+                held_locks = list(self._held_locks.values())
+            for lock in held_locks:
+                self.release(lock)
+
+    def __enter__(self) -> "LockClient":
+        return self
+
+    def __exit__(self, *args):
+        self.close()
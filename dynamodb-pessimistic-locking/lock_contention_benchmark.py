@@ -0,0 +1,203 @@
+"""
+Benchmark for lock contention: N worker processes compete for M resources.
+
+Each worker repeatedly picks a random resource, acquires its lock with the
+LockClient, holds it for a while and releases it. At the end the benchmark
+reports the throughput, the acquire latency and attempts, steals and
+expirations, how evenly the locks were distributed between the workers
+(Jain's fairness index, 1.0 means perfectly fair) and whether two workers
+ever held the same lock at the same time.
+
+By default it starts a moto server in the background, which needs moto[server].
+moto doesn't apply concurrent conditional writes atomically, so a few overlaps
+and expirations can show up there that DynamoDB wouldn't allow. Use
+--endpoint-url to run it against DynamoDB Local instead, e.g.
+
+    docker run -p 8000:8000 amazon/dynamodb-local
+    python lock_contention_benchmark.py --endpoint-url http://localhost:8000 -n 8 -m 2
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import random
+import socket
+import statistics
+import time
+import typing
+
+import client_factory
+from dynamodb_pessimistic_locking import (
+    LockClient,
+    LockMetrics,
+    LockNotAcquiredError,
+    TABLE_NAME,
+)
+
+
+def jain_fairness_index(values: typing.List[float]) -> float:
+    """(sum x)^2 / (n * sum x^2), 1.0 if all values are equal, 1/n if one gets everything."""
+
+    sum_of_squares = sum(value ** 2 for value in values)
+    if sum_of_squares == 0:
+        return 1.0
+
+    return sum(values) ** 2 / (len(values) * sum_of_squares)
+
+
+def start_moto_server() -> str:
+    """Starts a moto server in a background thread and returns its endpoint."""
+
+    from moto.server import ThreadedMotoServer
+
+    # Let the OS pick a free port for the server
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+
+    logging.getLogger("werkzeug").setLevel(logging.CRITICAL)
+    ThreadedMotoServer(ip_address="127.0.0.1", port=port, verbose=False).start()
+
+    return f"http://127.0.0.1:{port}"
+
+
+def create_table_if_not_exists():
+
+    client = client_factory.get_client("dynamodb")
+
+    try:
+        client.create_table(
+            AttributeDefinitions=[
+                {"AttributeName": "PK", "AttributeType": "S"},
+                {"AttributeName": "SK", "AttributeType": "S"},
+            ],
+            TableName=TABLE_NAME,
+            KeySchema=[
+                {"AttributeName": "PK", "KeyType": "HASH"},
+                {"AttributeName": "SK", "KeyType": "RANGE"},
+            ],
+            BillingMode="PAY_PER_REQUEST",
+        )
+        client.get_waiter("table_exists").wait(TableName=TABLE_NAME)
+    except client.exceptions.ResourceInUseException:
+        pass
+
+
+def run_worker(
+        worker_id: int,
+        endpoint_url: str,
+        resources: int,
+        duration_seconds: float,
+        hold_seconds: float,
+        lease_duration_seconds: float,
+        wait_timeout_seconds: float,
+    ) -> dict:
+    """Runs in its own process, returns the metrics summary and the hold intervals."""
+
+    os.environ["AWS_ENDPOINT_URL_DYNAMODB"] = endpoint_url
+
+    rng = random.Random(worker_id)
+    metrics = LockMetrics()
+    intervals = []
+
+    with LockClient(lease_duration_seconds=lease_duration_seconds, metrics=metrics) as lock_client:
+
+        stop_at = time.time() + duration_seconds
+        while time.time() < stop_at:
+
+            resource_name = f"resource-{rng.randrange(resources)}"
+
+            try:
+                lock = lock_client.acquire(resource_name, wait_timeout_seconds=wait_timeout_seconds)
+            except LockNotAcquiredError:
+                continue
+
+            acquired_at = time.time()
+            time.sleep(hold_seconds)
+            released_at = time.time()
+
+            lock_client.release(lock)
+            intervals.append((resource_name, lock.fencing_token, acquired_at, released_at))
+
+    return {
+        "workerId": worker_id,
+        "summary": metrics.summary(),
+        "acquireLatenciesSeconds": metrics.acquire_latencies_seconds,
+        "intervals": intervals,
+    }
+
+
+def count_overlaps(intervals: typing.List[typing.Tuple[str, int, float, float]]) -> int:
+    """Number of times a worker acquired a lock that another worker was still holding."""
+
+    overlaps = 0
+    by_resource: typing.Dict[str, list] = {}
+    for resource_name, *interval in intervals:
+        by_resource.setdefault(resource_name, []).append(interval)
+
+    for resource_intervals in by_resource.values():
+        resource_intervals.sort(key=lambda interval: interval[1])
+        for previous, current in zip(resource_intervals, resource_intervals[1:]):
+            if current[1] < previous[2]:
+                overlaps += 1
+
+    return overlaps
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Measure throughput and fairness of the DynamoDB locks under contention.")
+    parser.add_argument("--processes", "-n", type=int, default=4)
+    parser.add_argument("--resources", "-m", type=int, default=1)
+    parser.add_argument("--duration", "-d", type=float, default=10, help="Seconds each worker runs")
+    parser.add_argument("--hold", type=float, default=0.01, help="Seconds a lock is held")
+    parser.add_argument("--lease", type=float, default=5, help="Lease duration in seconds")
+    parser.add_argument("--wait-timeout", type=float, default=5, help="Seconds to wait for a lock")
+    parser.add_argument("--endpoint-url", help="e.g. http://localhost:8000 for DynamoDB Local, uses moto if omitted")
+    parsed = parser.parse_args()
+
+    os.environ.setdefault("AWS_DEFAULT_REGION", "eu-central-1")
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "local")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "local")
+
+    endpoint_url = parsed.endpoint_url or start_moto_server()
+    os.environ["AWS_ENDPOINT_URL_DYNAMODB"] = endpoint_url
+    create_table_if_not_exists()
+
+    # Spawn instead of fork, the moto server threads live in this process
+    with multiprocessing.get_context("spawn").Pool(parsed.processes) as pool:
+        results = pool.starmap(
+            run_worker,
+            [
+                (
+                    worker_id, endpoint_url, parsed.resources, parsed.duration,
+                    parsed.hold, parsed.lease, parsed.wait_timeout,
+                )
+                for worker_id in range(parsed.processes)
+            ]
+        )
+
+    acquisitions = [result["summary"]["acquisitions"] for result in results]
+    latencies_in_ms = sorted(
+        latency * 1000 for result in results for latency in result["acquireLatenciesSeconds"]
+    )
+    intervals = [interval for result in results for interval in result["intervals"]]
+
+    def _percentile(percentile: float) -> float:
+        if not latencies_in_ms:
+            return 0.0
+        return latencies_in_ms[min(len(latencies_in_ms) - 1, int(percentile / 100 * len(latencies_in_ms)))]
+
+    print(f"Workers / resources:           {parsed.processes} / {parsed.resources}")
+    print(f"Acquisitions:                  {sum(acquisitions)} ({sum(acquisitions) / parsed.duration:.1f}/s)")
+    print(f"Timed out acquisitions:        {sum(result['summary']['failedAcquisitions'] for result in results)}")
+    print(f"Acquire latency p50/p90/p99:   {_percentile(50):.1f} / {_percentile(90):.1f} / {_percentile(99):.1f} ms")
+    print(f"Attempts per acquire (mean):   {statistics.fmean(result['summary']['meanAttemptsPerAcquire'] for result in results):.2f}")
+    print(f"Steals / expirations:          {sum(result['summary']['steals'] for result in results)} / {sum(result['summary']['expirations'] for result in results)}")
+    print(f"Acquisitions per worker:       {acquisitions}")
+    print(f"Jain's fairness index:         {jain_fairness_index(acquisitions):.3f}")
+    print(f"Overlapping holds:             {count_overlaps(intervals)}")
+
+
+if __name__ == "__main__":
+    main()
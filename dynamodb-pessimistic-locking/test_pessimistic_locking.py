@@ -1,4 +1,5 @@
 # pylint: disable=redefined-outer-name,unused-argument
+import threading
 import time
 
 import boto3
@@ -8,9 +9,16 @@ import pytest
 
 from dynamodb_pessimistic_locking import (
     acquire_lock,
+    acquire_locks,
     release_lock,
+    release_locks,
+    set_lock_metrics,
+    LockClient,
+    LockMetrics,
+    LockNotAcquiredError,
     TABLE_NAME,
 )
+from lock_contention_benchmark import jain_fairness_index
 
 
 def create_table_if_not_exists():
@@ -157,3 +165,254 @@ def test_that_a_lock_cant_be_released_if_the_tx_doesnt_match(existing_table):
 
     # Assert
     assert not lock_released
+
+
+def test_that_multiple_locks_can_be_acquired_at_once(existing_table):
+    """
+    Assert that a set of free resources can be locked in one go.
+    """
+
+    # Arrange
+
+    # Act
+    are_locked = acquire_locks(["a", "b", "c"], 10, "tx-1")
+
+    # Assert
+    assert are_locked
+    assert not acquire_lock("b", 10, "tx-2")
+
+
+def test_that_multiple_locks_are_all_or_nothing(existing_table):
+    """
+    Assert that none of the resources get locked if one of them is already taken.
+    """
+
+    # Arrange
+    acquire_lock("b", 10, "tx-1")
+
+    # Act
+    are_locked = acquire_locks(["a", "b", "c"], 10, "tx-2")
+
+    # Assert
+    assert not are_locked
+    assert acquire_lock("a", 10, "tx-3")
+    assert acquire_lock("c", 10, "tx-3")
+
+
+def test_that_multiple_locks_can_be_released_at_once(existing_table):
+    """
+    Assert that the locks are released together and can be acquired again.
+    """
+
+    # Arrange
+    acquire_locks(["a", "b", "a"], 10, "tx-1")
+
+    # Act
+    are_released = release_locks(["a", "b"], "tx-1")
+
+    # Assert
+    assert are_released
+    assert acquire_locks(["a", "b"], 10, "tx-2")
+
+
+def test_that_multiple_locks_arent_released_with_a_foreign_lock(existing_table):
+    """
+    Assert that no lock is released if one of them belongs to another transaction.
+    """
+
+    # Arrange
+    acquire_lock("a", 10, "tx-1")
+    acquire_lock("b", 10, "tx-2")
+
+    # Act
+    are_released = release_locks(["a", "b"], "tx-1")
+
+    # Assert
+    assert not are_released
+    assert not acquire_lock("a", 10, "tx-3")
+
+
+def test_that_more_than_100_locks_are_rejected(existing_table):
+    """
+    Assert that we don't try to lock more resources than a transaction supports.
+    """
+
+    # Arrange
+    resource_names = [f"resource-{idx}" for idx in range(101)]
+
+    # Act & Assert
+    with pytest.raises(ValueError):
+        acquire_locks(resource_names, 10, "tx-1")
+
+
+@pytest.fixture
+def lock_client(existing_table):
+    """Provides a LockClient with a short lease."""
+    client = LockClient(lease_duration_seconds=2, heartbeat_interval_seconds=0.5)
+    yield client
+    client.close()
+
+
+def test_that_the_lock_client_returns_increasing_fencing_tokens(lock_client):
+    """
+    Assert that each acquisition of a resource gets a larger fencing token.
+    """
+
+    # Arrange
+    first_lock = lock_client.acquire("resource")
+    lock_client.release(first_lock)
+
+    # Act
+    second_lock = lock_client.acquire("resource")
+
+    # Assert
+    assert second_lock.fencing_token > first_lock.fencing_token
+
+
+def test_that_the_lock_client_gives_up_at_the_deadline(lock_client):
+    """
+    Assert that a blocking acquire raises an exception if the lock stays taken.
+    """
+
+    # Arrange
+    acquire_lock("resource", 60, "tx-1")
+
+    # Act & Assert
+    with pytest.raises(LockNotAcquiredError):
+        lock_client.acquire("resource", wait_timeout_seconds=0.5)
+
+
+def test_that_the_lock_client_waits_for_the_release(lock_client):
+    """
+    Assert that a blocking acquire succeeds once the other holder releases the lock.
+    """
+
+    # Arrange
+    acquire_lock("resource", 60, "tx-1")
+    threading.Timer(0.3, release_lock, args=("resource", "tx-1")).start()
+
+    # Act
+    lock = lock_client.acquire("resource", wait_timeout_seconds=5)
+
+    # Assert
+    assert lock.transaction_id != "tx-1"
+
+
+def test_that_the_heartbeat_keeps_the_lock_beyond_the_lease(lock_client):
+    """
+    Assert that the lock isn't lost while the client holds it, even after the lease duration.
+    """
+
+    # Arrange
+    lock = lock_client.acquire("resource")
+
+    # Act
+    time.sleep(3)
+
+    # Assert
+    assert not acquire_lock("resource", 5, "tx-2")
+    assert lock_client.renew(lock)
+    assert not lock.lost
+
+
+def test_that_a_renewal_detects_a_lost_lock(lock_client):
+    """
+    Assert that renewing a lock that someone else took over marks it as lost.
+    """
+
+    # Arrange
+    lock = lock_client.acquire("resource")
+    release_lock("resource", lock.transaction_id)
+    acquire_lock("resource", 60, "tx-2")
+
+    # Act
+    is_renewed = lock_client.renew(lock)
+
+    # Assert
+    assert not is_renewed
+    assert lock.lost
+    assert not lock_client.release(lock)
+
+
+@pytest.fixture
+def lock_metrics(existing_table):
+    """Installs metrics hooks for the module level functions."""
+    metrics = LockMetrics()
+    set_lock_metrics(metrics)
+    yield metrics
+    set_lock_metrics(None)
+
+
+def test_that_the_metrics_record_acquisitions_and_hold_times(lock_metrics):
+    """
+    Assert that successful and failed acquisitions and the hold time are recorded.
+    """
+
+    # Arrange
+    acquire_lock("resource", 10, "tx-1")
+    acquire_lock("resource", 10, "tx-2")
+
+    # Act
+    release_lock("resource", "tx-1")
+
+    # Assert
+    summary = lock_metrics.summary()
+    assert summary["acquisitions"] == 1
+    assert summary["failedAcquisitions"] == 1
+    assert summary["releases"] == 1
+    assert len(lock_metrics.hold_times_seconds) == 1
+
+
+def test_that_the_metrics_record_steals(lock_metrics):
+    """
+    Assert that taking over an expired lock is counted as a steal.
+    """
+
+    # Arrange
+    acquire_lock("resource", 1, "tx-1")
+    time.sleep(2)
+
+    # Act
+    acquire_lock("resource", 10, "tx-2")
+
+    # Assert
+    assert lock_metrics.steals == 1
+
+
+def test_that_the_metrics_record_attempts_and_expirations(existing_table):
+    """
+    Assert that the lock client reports its attempts and notices expired locks.
+    """
+
+    # Arrange
+    metrics = LockMetrics()
+    lock_client = LockClient(lease_duration_seconds=60, metrics=metrics)
+    acquire_lock("resource", 1, "tx-1")
+
+    # Act
+    lock = lock_client.acquire("resource", wait_timeout_seconds=5)
+    release_lock("resource", lock.transaction_id)
+    lock_client.release(lock)
+    lock_client.close()
+
+    # Assert
+    assert metrics.attempts_per_acquire[0] > 1
+    assert metrics.steals == 1
+    assert metrics.expirations == 1
+    assert metrics.failed_releases == 1
+
+
+def test_that_the_fairness_index_is_one_for_equal_shares():
+    """
+    Assert that Jain's fairness index ranges from 1/n to 1.
+    """
+
+    # Arrange
+
+    # Act
+    fair = jain_fairness_index([5, 5, 5, 5])
+    unfair = jain_fairness_index([20, 0, 0, 0])
+
+    # Assert
+    assert fair == pytest.approx(1.0)
+    assert unfair == pytest.approx(0.25)
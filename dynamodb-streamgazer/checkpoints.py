@@ -0,0 +1,176 @@
+"""
+Checkpoint stores remember the last processed sequence number of each shard,
+and which shards have been read completely, so streamgazer can resume after a restart.
+
+- MemoryCheckpointStore: forgets everything when the process ends, the default
+- FileCheckpointStore: one JSON file per shard in a local directory
+- DynamoDBCheckpointStore: one item per shard in a DynamoDB table with the keys PK and SK
+"""
+import abc
+import json
+import os
+import typing
+
+import boto3
+from boto3.dynamodb.conditions import Key
+
+
+class CheckpointStore(abc.ABC):
+    """Base class, a checkpoint is the sequence number of the last record that was processed."""
+
+    @abc.abstractmethod
+    def get_checkpoint(self, shard_id: str) -> typing.Optional[str]:
+        pass
+
+    @abc.abstractmethod
+    def put_checkpoint(self, shard_id: str, sequence_number: str):
+        pass
+
+    @abc.abstractmethod
+    def is_finished(self, shard_id: str) -> bool:
+        pass
+
+    @abc.abstractmethod
+    def mark_finished(self, shard_id: str):
+        """The shard is closed and all of its records have been processed."""
+
+    @abc.abstractmethod
+    def has_checkpoints(self) -> bool:
+        """False if we've never seen this stream before."""
+
+
+class MemoryCheckpointStore(CheckpointStore):
+
+    def __init__(self):
+        self._checkpoints: typing.Dict[str, str] = {}
+        self._finished: typing.Set[str] = set()
+
+    def get_checkpoint(self, shard_id: str) -> typing.Optional[str]:
+        return self._checkpoints.get(shard_id)
+
+    def put_checkpoint(self, shard_id: str, sequence_number: str):
+        self._checkpoints[shard_id] = sequence_number
+
+    def is_finished(self, shard_id: str) -> bool:
+        return shard_id in self._finished
+
+    def mark_finished(self, shard_id: str):
+        self._finished.add(shard_id)
+
+    def has_checkpoints(self) -> bool:
+        return bool(self._checkpoints or self._finished)
+
+
+class FileCheckpointStore(CheckpointStore):
+    """
+    Stores one JSON file per shard in the directory. Files are replaced
+    atomically, so a crash never leaves a half written checkpoint behind.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, shard_id: str) -> str:
+        return os.path.join(self.directory, f"{shard_id}.json")
+
+    def _read(self, shard_id: str) -> dict:
+        try:
+            with open(self._path(shard_id), "r", encoding="utf-8") as checkpoint_file:
+                return json.load(checkpoint_file)
+        except FileNotFoundError:
+            return {}
+
+    def _write(self, shard_id: str, checkpoint: dict):
+
+        temporary_path = self._path(shard_id) + ".tmp"
+        with open(temporary_path, "w", encoding="utf-8") as checkpoint_file:
+            json.dump(checkpoint, checkpoint_file)
+            checkpoint_file.flush()
+            os.fsync(checkpoint_file.fileno())
+
+        os.replace(temporary_path, self._path(shard_id))
+
+    def get_checkpoint(self, shard_id: str) -> typing.Optional[str]:
+        return self._read(shard_id).get("sequenceNumber")
+
+    def put_checkpoint(self, shard_id: str, sequence_number: str):
+        self._write(shard_id, {"shardId": shard_id, "sequenceNumber": sequence_number, "finished": False})
+
+    def is_finished(self, shard_id: str) -> bool:
+        return self._read(shard_id).get("finished", False)
+
+    def mark_finished(self, shard_id: str):
+        checkpoint = self._read(shard_id)
+        checkpoint.update({"shardId": shard_id, "finished": True})
+        self._write(shard_id, checkpoint)
+
+    def has_checkpoints(self) -> bool:
+        return any(name.endswith(".json") for name in os.listdir(self.directory))
+
+
+class DynamoDBCheckpointStore(CheckpointStore):
+    """
+    Stores the checkpoints of a stream in a table with the string keys PK and SK,
+    PK is STREAM#<stream arn> and SK is SHARD#<shard id>.
+    """
+
+    def __init__(self, table_name: str, stream_arn: str):
+        self.table_name = table_name
+        self.stream_arn = stream_arn
+        self._table = None
+
+        # Shards don't reopen, so finished is safe to cache
+        self._finished: typing.Set[str] = set()
+
+    @property
+    def table(self):
+        # Created lazily, so the store can be passed to other processes
+        if self._table is None:
+            self._table = boto3.resource("dynamodb").Table(self.table_name)
+        return self._table
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_table"] = None
+        return state
+
+    def _key(self, shard_id: str) -> dict:
+        return {"PK": f"STREAM#{self.stream_arn}", "SK": f"SHARD#{shard_id}"}
+
+    def get_checkpoint(self, shard_id: str) -> typing.Optional[str]:
+        item = self.table.get_item(Key=self._key(shard_id)).get("Item", {})
+        return item.get("sequenceNumber")
+
+    def put_checkpoint(self, shard_id: str, sequence_number: str):
+        self.table.update_item(
+            Key=self._key(shard_id),
+            UpdateExpression="SET #seq = :seq",
+            ExpressionAttributeNames={"#seq": "sequenceNumber"},
+            ExpressionAttributeValues={":seq": sequence_number},
+        )
+
+    def is_finished(self, shard_id: str) -> bool:
+
+        if shard_id not in self._finished:
+            item = self.table.get_item(Key=self._key(shard_id)).get("Item", {})
+            if item.get("finished", False):
+                self._finished.add(shard_id)
+
+        return shard_id in self._finished
+
+    def mark_finished(self, shard_id: str):
+        self.table.update_item(
+            Key=self._key(shard_id),
+            UpdateExpression="SET #finished = :true",
+            ExpressionAttributeNames={"#finished": "finished"},
+            ExpressionAttributeValues={":true": True},
+        )
+        self._finished.add(shard_id)
+
+    def has_checkpoints(self) -> bool:
+        response = self.table.query(
+            KeyConditionExpression=Key("PK").eq(f"STREAM#{self.stream_arn}"),
+            Limit=1,
+        )
+        return len(response["Items"]) > 0
@@ -0,0 +1,256 @@
+"""
+Hands batches of change records to the handlers on a pool of worker threads.
+
+Records are assigned to lanes by their item key, each lane has one worker and
+a bounded queue. Changes to the same item always end up in the same lane and
+are processed in order. Different items are processed in parallel.
+When a lane's queue is full, submit blocks. That back-pressure slows down the
+shard readers instead of piling up records in memory.
+
+Batch handlers take a list of records, per_record turns a handler for single
+records into one. An optional pipeline filters the records before they're queued.
+"""
+import collections
+import json
+import queue
+import threading
+import time
+import traceback
+import typing
+import zlib
+
+BatchHandler = typing.Callable[[typing.List[dict]], None]
+
+
+def per_record(handler: typing.Callable[[dict], None]) -> BatchHandler:
+    """Adapts a handler for single records to batches."""
+
+    def _batch_handler(records: typing.List[dict]):
+        for record in records:
+            handler(record)
+
+    _batch_handler.__name__ = getattr(handler, "__name__", "per_record")
+    return _batch_handler
+
+
+def record_lane(record: dict, lanes: int) -> int:
+    """The lane for the item the record belongs to, stable across processes."""
+
+    item_keys = json.dumps(record["dynamodb"]["Keys"], sort_keys=True)
+    return zlib.crc32(item_keys.encode("utf-8")) % lanes
+
+
+class _Ticket:
+    """Tracks a submitted batch until all of its lanes are done with it."""
+
+    def __init__(self, pending_lanes: int, on_done: typing.Optional[typing.Callable[[], None]]):
+        self.pending_lanes = pending_lanes
+        self.on_done = on_done
+        self.done = False
+
+
+class DispatchStats:
+    """Throughput and lag, i.e. how old the records are when the handlers are done with them."""
+
+    def __init__(self):
+        self.total_records = 0
+        self._interval_records = 0
+        self._interval_lags: typing.List[float] = []
+        self._interval_started_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def record_processed(self, records: typing.List[dict]):
+
+        now = time.time()
+        lags = [
+            now - record["dynamodb"]["ApproximateCreationDateTime"].timestamp()
+            for record in records
+            if "ApproximateCreationDateTime" in record.get("dynamodb", {})
+        ]
+
+        with self._lock:
+            self.total_records += len(records)
+            self._interval_records += len(records)
+            self._interval_lags.extend(lags)
+
+    def snapshot(self) -> dict:
+        """Returns the numbers since the last snapshot and starts a new interval."""
+
+        with self._lock:
+            now = time.monotonic()
+            elapsed = max(now - self._interval_started_at, 1e-9)
+            lags = sorted(self._interval_lags)
+
+            result = {
+                "recordsPerSecond": self._interval_records / elapsed,
+                "totalRecords": self.total_records,
+                "lagP50Seconds": lags[len(lags) // 2] if lags else 0.0,
+                "lagMaxSeconds": lags[-1] if lags else 0.0,
+            }
+
+            self._interval_records = 0
+            self._interval_lags = []
+            self._interval_started_at = now
+
+        return result
+
+
+class BatchDispatcher:
+    """
+    Runs the batch handlers on one worker thread per lane. Checkpoint callbacks
+    (on_done) are called in submission order per source, once every record of
+    the batch and of all earlier batches from that source has been handled.
+    """
+
+    def __init__(
+            self,
+            handlers: typing.List[BatchHandler],
+            workers: int = 4,
+            max_queued_batches: int = 100,
+            stats_interval_seconds: typing.Optional[float] = None,
+            name: str = "",
+            pipeline: typing.Optional[typing.Callable[[typing.List[dict]], typing.List[dict]]] = None,
+        ):
+
+        if workers < 1:
+            raise ValueError(f"The dispatcher needs at least one worker, got {workers}")
+
+        self.handlers = handlers
+        self.pipeline = pipeline
+        self.workers = workers
+        self.name = name
+        self.stats = DispatchStats()
+
+        self._queues = [queue.Queue(maxsize=max_queued_batches) for _ in range(workers)]
+        self._pending: typing.Dict[typing.Any, typing.Deque[_Ticket]] = collections.defaultdict(collections.deque)
+        self._pending_lock = threading.Condition()
+        self._error: typing.Optional[BaseException] = None
+
+        # The latest checkpoint callback of each source that hasn't run yet
+        self._callbacks: typing.Dict[typing.Any, typing.Callable[[], None]] = {}
+        self._callback_locks: typing.Dict[typing.Any, threading.Lock] = collections.defaultdict(threading.Lock)
+
+        self._threads = [
+            threading.Thread(target=self._work, args=(lane,), name=f"dispatch-lane-{lane}", daemon=True)
+            for lane in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+        self._stopped = threading.Event()
+        if stats_interval_seconds is not None:
+            threading.Thread(
+                target=self._print_stats, args=(stats_interval_seconds,), name="dispatch-stats", daemon=True
+            ).start()
+
+    def _raise_if_failed(self):
+        if self._error is not None:
+            raise RuntimeError("A handler failed, stopping the dispatch") from self._error
+
+    def submit(
+            self,
+            records: typing.List[dict],
+            source: typing.Any = None,
+            on_done: typing.Optional[typing.Callable[[], None]] = None,
+        ):
+        """Queues the records, blocks while the lanes they belong to are full."""
+
+        self._raise_if_failed()
+
+        if self.pipeline is not None:
+            records = self.pipeline(records)
+
+        records_by_lane: typing.Dict[int, typing.List[dict]] = collections.defaultdict(list)
+        for record in records:
+            records_by_lane[record_lane(record, self.workers)].append(record)
+
+        ticket = _Ticket(len(records_by_lane), on_done)
+        with self._pending_lock:
+            self._pending[source].append(ticket)
+
+        if not records_by_lane:
+            self._complete(source, ticket)
+            return
+
+        for lane, lane_records in records_by_lane.items():
+            self._queues[lane].put((source, ticket, lane_records))
+
+    def _work(self, lane: int):
+
+        while True:
+            source, ticket, records = self._queues[lane].get()
+
+            try:
+                for handler in self.handlers:
+                    handler(records)
+                self.stats.record_processed(records)
+            except BaseException as err:  # pylint: disable=broad-except
+                traceback.print_exc()
+                self._error = self._error or err
+
+                # Wake up everyone waiting for this source, they'll see the error
+                with self._pending_lock:
+                    self._pending_lock.notify_all()
+                continue
+
+            with self._pending_lock:
+                ticket.pending_lanes -= 1
+                is_complete = ticket.pending_lanes == 0
+
+            if is_complete:
+                self._complete(source, ticket)
+
+    def _complete(self, source: typing.Any, ticket: _Ticket):
+        """Marks the ticket as done and runs the callback of the last leading ticket that is done."""
+
+        with self._pending_lock:
+            ticket.done = True
+            pending = self._pending[source]
+
+            while pending and pending[0].done:
+                finished = pending.popleft()
+                if finished.on_done is not None:
+                    # Only the latest checkpoint matters
+                    self._callbacks[source] = finished.on_done
+
+            callback_lock = self._callback_locks[source]
+
+        # The callback runs outside of the pending lock, so slow checkpoint writes don't
+        # block the other lanes. The callback lock keeps the callbacks of a source in order.
+        with callback_lock:
+            with self._pending_lock:
+                callback = self._callbacks.get(source)
+
+            try:
+                if callback is not None:
+                    callback()
+            finally:
+                with self._pending_lock:
+                    if callback is not None and self._callbacks.get(source) is callback:
+                        del self._callbacks[source]
+                    self._pending_lock.notify_all()
+
+    def drain(self, source: typing.Any = None):
+        """Waits until all batches of the source have been handled."""
+
+        with self._pending_lock:
+            while (self._pending[source] or source in self._callbacks) and self._error is None:
+                self._pending_lock.wait()
+
+        self._raise_if_failed()
+
+    def _print_stats(self, interval_seconds: float):
+
+        while not self._stopped.wait(interval_seconds):
+            stats = self.stats.snapshot()
+            queued = sum(lane_queue.qsize() for lane_queue in self._queues)
+            print(
+                "[stats{0}] {recordsPerSecond:.1f} records/s, lag p50 {lagP50Seconds:.1f}s "
+                "max {lagMaxSeconds:.1f}s, {1} batches queued, {totalRecords} records total".format(
+                    f" {self.name}" if self.name else "", queued, **stats
+                )
+            )
+
+    def close(self):
+        """Stops printing the stats, the daemon workers end with the process."""
+        self._stopped.set()
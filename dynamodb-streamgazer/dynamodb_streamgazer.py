@@ -1,6 +1,9 @@
 #! /usr/bin/env python
 import argparse
+import asyncio
 import collections
+import functools
+import logging
 import multiprocessing as mp
 import time
 import typing
@@ -9,6 +12,13 @@ from datetime import datetime
 
 import boto3
 
+from checkpoints import CheckpointStore, DynamoDBCheckpointStore, FileCheckpointStore, MemoryCheckpointStore
+from dispatch import BatchDispatcher, per_record
+from pipeline import compile_pipeline
+from recording import RecordWriter, replay
+
+LOGGER = logging.getLogger(__name__)
+
 Shard = collections.namedtuple(
     typename="Shard",
     field_names=[
@@ -65,17 +75,37 @@ def list_open_shards(stream_arn: str) -> typing.List[Shard]:
 
     return open_shards
 
-def get_shard_iterator(shard: Shard, iterator_type: str = "LATEST") -> str:
+def get_shard_iterator(shard: Shard, iterator_type: str = "LATEST", sequence_number: typing.Optional[str] = None) -> str:
     client = boto3.client("dynamodbstreams")
 
-    response = client.get_shard_iterator(
-        StreamArn=shard.stream_arn,
-        ShardId=shard.shard_id,
-        ShardIteratorType=iterator_type
-    )
-    
+    position_args = {}
+    if sequence_number is not None:
+        position_args["SequenceNumber"] = sequence_number
+
+    try:
+        response = client.get_shard_iterator(
+            StreamArn=shard.stream_arn,
+            ShardId=shard.shard_id,
+            ShardIteratorType=iterator_type,
+            **position_args
+        )
+    except client.exceptions.TrimmedDataAccessException:
+        log_trimmed_checkpoint(shard, sequence_number)
+        response = client.get_shard_iterator(
+            StreamArn=shard.stream_arn,
+            ShardId=shard.shard_id,
+            ShardIteratorType="TRIM_HORIZON"
+        )
+
     return response["ShardIterator"]
 
+def log_trimmed_checkpoint(shard: Shard, sequence_number: typing.Optional[str]):
+    LOGGER.warning(
+        "The checkpoint %s of shard %s is older than the stream's 24h retention, "
+        "continuing with the oldest record that's left, the records in between are lost",
+        sequence_number, shard.shard_id
+    )
+
 def get_next_records(shard_iterator: str) -> typing.Tuple[typing.List[dict], str]:
     client = boto3.client("dynamodbstreams")
 
@@ -85,44 +115,293 @@ def get_next_records(shard_iterator: str) -> typing.Tuple[typing.List[dict], str
 
     return response["Records"], response.get("NextShardIterator")
 
-def shard_watcher(shard: Shard, callables: typing.List[typing.Callable], start_at_oldest = False):
-    
-    shard_iterator_type = "TRIM_HORIZON" if start_at_oldest else "LATEST"
-    shard_iterator = get_shard_iterator(shard, shard_iterator_type)
+def starting_position(
+        shard: Shard,
+        start_at_oldest: bool,
+        checkpoint_store: CheckpointStore
+    ) -> typing.Tuple[str, typing.Optional[str]]:
+    """The iterator type and sequence number to start reading the shard from, checkpoints win."""
+
+    sequence_number = checkpoint_store.get_checkpoint(shard.shard_id)
+    if sequence_number is not None:
+        return "AFTER_SEQUENCE_NUMBER", sequence_number
+
+    return ("TRIM_HORIZON" if start_at_oldest else "LATEST"), None
+
+def make_dispatcher(
+        callables: typing.List[typing.Callable],
+        batch_callables: typing.Optional[typing.List[typing.Callable]] = None,
+        workers: int = 4,
+        max_queued_batches: int = 100,
+        stats_interval_seconds: typing.Optional[float] = None,
+        name: str = "",
+        pipeline_options: typing.Optional[dict] = None
+    ) -> BatchDispatcher:
+    """
+    callables receive one record at a time, batch_callables a list of records.
+    The pipeline_options are passed on to pipeline.compile_pipeline.
+    """
+
+    handlers = [per_record(handler) for handler in callables] + list(batch_callables or [])
+
+    return BatchDispatcher(
+        handlers,
+        workers=workers,
+        max_queued_batches=max_queued_batches,
+        stats_interval_seconds=stats_interval_seconds,
+        name=name,
+        pipeline=compile_pipeline(**(pipeline_options or {}))
+    )
+
+def shard_watcher(
+        shard: Shard,
+        callables: typing.List[typing.Callable],
+        start_at_oldest = False,
+        checkpoint_store: typing.Optional[CheckpointStore] = None,
+        dispatch_options: typing.Optional[dict] = None
+    ):
+
+    checkpoint_store = checkpoint_store or MemoryCheckpointStore()
+
+    # Threads don't survive the trip into the watcher process, so the dispatcher is created here
+    dispatcher = make_dispatcher(callables, name=shard.shard_id, **(dispatch_options or {}))
+
+    shard_iterator_type, sequence_number = starting_position(shard, start_at_oldest, checkpoint_store)
+    shard_iterator = get_shard_iterator(shard, shard_iterator_type, sequence_number)
 
     while shard_iterator is not None:
         records, shard_iterator = get_next_records(shard_iterator)
 
-        for record in records:
-            for handler in callables:
-                handler(record)
+        if records:
+            # The checkpoint is written once the handlers are done with the batch
+            dispatcher.submit(
+                records,
+                source=shard.shard_id,
+                on_done=functools.partial(
+                    checkpoint_store.put_checkpoint, shard.shard_id, records[-1]["dynamodb"]["SequenceNumber"]
+                )
+            )
         
         time.sleep(0.5)
 
-def start_watching(stream_arn: str, callables: typing.List[typing.Callable]) -> None:
-
+    # The shard is closed and drained, its children can start now
+    dispatcher.drain(shard.shard_id)
+    checkpoint_store.mark_finished(shard.shard_id)
+    dispatcher.close()
+
+class LineageScheduler:
+    """
+    Decides which shards to read and when. A child shard is only started once
+    its parent has been read completely, so the changes to an item are
+    processed in order even when a shard splits.
+
+    On the very first start, i.e. without any checkpoints, the history of the
+    stream is skipped: closed shards are marked as finished and the open shards
+    are read from the latest record. Shards that show up later are read from
+    the oldest record. With checkpoints, every shard continues where it stopped.
+    """
+
+    def __init__(self, checkpoint_store: CheckpointStore):
+        self.checkpoint_store = checkpoint_store
+        self.started: typing.Set[str] = set()
+        self._initial_loop = True
+
+    def _is_drained(self, shard_id: typing.Optional[str], known_shard_ids: typing.Set[str]) -> bool:
+        # Parents that were trimmed from the stream (after 24 hours) can't hold anything back
+        return shard_id is None \
+            or shard_id not in known_shard_ids \
+            or self.checkpoint_store.is_finished(shard_id)
+
+    def shards_to_start(self, all_shards: typing.List[Shard]) -> typing.List[typing.Tuple[Shard, bool]]:
+        """Returns the shards that can be started now, with whether to start at the oldest record."""
+
+        if self._initial_loop:
+            self._initial_loop = False
+
+            if not self.checkpoint_store.has_checkpoints():
+                for shard in all_shards:
+                    if not is_open_shard(shard):
+                        self.checkpoint_store.mark_finished(shard.shard_id)
+
+                open_shards = [shard for shard in all_shards if is_open_shard(shard)]
+                self.started.update(shard.shard_id for shard in open_shards)
+                return [(shard, False) for shard in open_shards]
+
+        known_shard_ids = {shard.shard_id for shard in all_shards}
+        ready = []
+
+        for shard in all_shards:
+            if shard.shard_id in self.started or self.checkpoint_store.is_finished(shard.shard_id):
+                continue
+
+            if self._is_drained(shard.parent_shard_id, known_shard_ids):
+                self.started.add(shard.shard_id)
+                ready.append((shard, True))
+
+        return ready
+
+def start_watching(
+        stream_arn: str,
+        callables: typing.List[typing.Callable],
+        checkpoint_store: typing.Optional[CheckpointStore] = None,
+        dispatch_options: typing.Optional[dict] = None
+    ) -> None:
+    """dispatch_options are passed on to make_dispatcher, each shard process gets its own dispatcher."""
+
+    checkpoint_store = checkpoint_store or MemoryCheckpointStore()
+    scheduler = LineageScheduler(checkpoint_store)
     shard_to_watcher: typing.Dict[str, mp.Process] = {}
-    initial_loop = True
 
     while True:
 
-        open_shards = list_open_shards(stream_arn=stream_arn)
-        start_at_oldest = True
-        if initial_loop:
-            start_at_oldest = False
-            initial_loop = False
+        # Watchers run in their own processes, they can't tell the in-memory store that they're done
+        for shard_id, process in shard_to_watcher.items():
+            if not process.is_alive() and process.exitcode == 0 and not checkpoint_store.is_finished(shard_id):
+                checkpoint_store.mark_finished(shard_id)
 
-        for shard in open_shards:
-            if shard.shard_id not in shard_to_watcher:
+        all_shards = list_all_shards(stream_arn=stream_arn)
 
-                print("Starting watcher for shard:", shard.shard_id)
-                args = (shard, callables, start_at_oldest)
-                process = mp.Process(target=shard_watcher, args=args)
-                shard_to_watcher[shard.shard_id] = process
-                process.start()
+        for shard, start_at_oldest in scheduler.shards_to_start(all_shards):
+
+            print("Starting watcher for shard:", shard.shard_id)
+            args = (shard, callables, start_at_oldest, checkpoint_store, dispatch_options)
+            process = mp.Process(target=shard_watcher, args=args)
+            shard_to_watcher[shard.shard_id] = process
+            process.start()
                 
         time.sleep(10)
 
+# GetRecords returns at most 1000 records, a full batch means there's more waiting
+MAX_RECORDS_PER_BATCH = 1000
+
+# Polling intervals of the async reader, it polls faster while records are flowing
+MIN_POLL_INTERVAL_SECONDS = 0.2
+MAX_POLL_INTERVAL_SECONDS = 2.0
+
+# Shared by all shard watchers of the async reader
+MAX_CONCURRENT_REQUESTS = 50
+
+def _import_aiobotocore():
+    try:
+        import aiobotocore.config
+        import aiobotocore.session
+    except ImportError as err:
+        raise ImportError(
+            "The async reader needs aiobotocore, install it with 'pip install aiobotocore'."
+        ) from err
+
+    return aiobotocore
+
+def next_poll_interval(number_of_records: int, current_interval: float) -> float:
+    """Poll again right away for full batches, back off exponentially while the shard is idle."""
+
+    if number_of_records >= MAX_RECORDS_PER_BATCH:
+        return 0
+    if number_of_records > 0:
+        return MIN_POLL_INTERVAL_SECONDS
+
+    return min(max(current_interval, MIN_POLL_INTERVAL_SECONDS) * 2, MAX_POLL_INTERVAL_SECONDS)
+
+async def async_shard_watcher(
+        client,
+        shard: Shard,
+        dispatcher: BatchDispatcher,
+        start_at_oldest = False,
+        checkpoint_store: typing.Optional[CheckpointStore] = None
+    ):
+
+    checkpoint_store = checkpoint_store or MemoryCheckpointStore()
+
+    shard_iterator_type, sequence_number = await asyncio.to_thread(
+        starting_position, shard, start_at_oldest, checkpoint_store
+    )
+
+    position_args = {}
+    if sequence_number is not None:
+        position_args["SequenceNumber"] = sequence_number
+
+    try:
+        response = await client.get_shard_iterator(
+            StreamArn=shard.stream_arn,
+            ShardId=shard.shard_id,
+            ShardIteratorType=shard_iterator_type,
+            **position_args
+        )
+    except client.exceptions.TrimmedDataAccessException:
+        log_trimmed_checkpoint(shard, sequence_number)
+        response = await client.get_shard_iterator(
+            StreamArn=shard.stream_arn,
+            ShardId=shard.shard_id,
+            ShardIteratorType="TRIM_HORIZON"
+        )
+    shard_iterator = response["ShardIterator"]
+    poll_interval = MIN_POLL_INTERVAL_SECONDS
+
+    while shard_iterator is not None:
+        response = await client.get_records(ShardIterator=shard_iterator)
+        records, shard_iterator = response["Records"], response.get("NextShardIterator")
+
+        if records:
+            # Submitting blocks while the dispatcher is busy, that mustn't block the other shards
+            await asyncio.to_thread(
+                dispatcher.submit,
+                records,
+                source=shard.shard_id,
+                on_done=functools.partial(
+                    checkpoint_store.put_checkpoint, shard.shard_id, records[-1]["dynamodb"]["SequenceNumber"]
+                )
+            )
+
+        if shard_iterator is not None:
+            poll_interval = next_poll_interval(len(records), poll_interval)
+            await asyncio.sleep(poll_interval)
+
+    await asyncio.to_thread(dispatcher.drain, shard.shard_id)
+    await asyncio.to_thread(checkpoint_store.mark_finished, shard.shard_id)
+
+async def async_start_watching(
+        stream_arn: str,
+        callables: typing.List[typing.Callable],
+        checkpoint_store: typing.Optional[CheckpointStore] = None,
+        dispatch_options: typing.Optional[dict] = None
+    ) -> None:
+    """
+    Like start_watching, but all shards are read by tasks in this process
+    instead of one process per shard. They share a single dispatcher.
+    """
+
+    aiobotocore = _import_aiobotocore()
+
+    session = aiobotocore.session.get_session()
+    config = aiobotocore.config.AioConfig(max_pool_connections=MAX_CONCURRENT_REQUESTS)
+
+    checkpoint_store = checkpoint_store or MemoryCheckpointStore()
+    scheduler = LineageScheduler(checkpoint_store)
+    dispatcher = make_dispatcher(callables, **(dispatch_options or {}))
+
+    async with session.create_client("dynamodbstreams", config=config) as client:
+
+        shard_to_watcher: typing.Dict[str, asyncio.Task] = {}
+
+        while True:
+
+            # Surface errors of watchers that crashed
+            for shard_id, task in shard_to_watcher.items():
+                if task.done() and not task.cancelled() and task.exception() is not None:
+                    raise task.exception()
+
+            all_shards = await asyncio.to_thread(list_all_shards, stream_arn=stream_arn)
+            shards_to_start = await asyncio.to_thread(scheduler.shards_to_start, all_shards)
+
+            for shard, start_at_oldest in shards_to_start:
+
+                print("Starting watcher for shard:", shard.shard_id)
+                shard_to_watcher[shard.shard_id] = asyncio.create_task(
+                    async_shard_watcher(client, shard, dispatcher, start_at_oldest, checkpoint_store)
+                )
+
+            await asyncio.sleep(10)
+
 def print_summary(change_record: dict):
 
     changed_at:datetime = change_record["dynamodb"]["ApproximateCreationDateTime"]
@@ -144,22 +423,82 @@ def print_change_record(change_record: dict):
 def main():
 
     parser = argparse.ArgumentParser(description="See what's going on in DynamoDB Streams in near real-time 🔍")
-    parser.add_argument("stream_arn", type=str, help="The ARN of the stream you want to watch.")
+    parser.add_argument("stream_arn", type=str, nargs="?", help="The ARN of the stream you want to watch, not needed for --replay.")
     parser.add_argument("--print-record", "-pr", action="store_true", help="Print each change record. If nothing else is selected, this is the default.")
     parser.add_argument("--print-summary", "-ps", action="store_true", help="Print a summary of a change record")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="Read all shards in a single process with asyncio, requires aiobotocore.")
+    checkpoint_group = parser.add_mutually_exclusive_group()
+    checkpoint_group.add_argument("--checkpoint-dir", help="Store the progress per shard in this directory and resume from it.")
+    checkpoint_group.add_argument("--checkpoint-table", help="Store the progress per shard in this DynamoDB table (string keys PK and SK) and resume from it.")
+    parser.add_argument("--workers", type=int, default=4, help="Number of threads that run the handlers, records of the same item stay in order.")
+    parser.add_argument("--print-stats", action="store_true", help="Print the throughput and the lag behind the table every 10 seconds.")
+    parser.add_argument("--event-name", "-e", action="append", choices=["INSERT", "MODIFY", "REMOVE"], help="Only watch these events, can be repeated.")
+    parser.add_argument("--key-prefix", "-k", action="append", default=[], metavar="ATTRIBUTE=PREFIX", help="Only watch items whose key attribute starts with the prefix, e.g. PK=USER#")
+    parser.add_argument("--where", "-w", action="append", metavar="CONDITION", help="Only watch items that match the condition, e.g. status=active or price>=10")
+    parser.add_argument("--project", "-p", action="append", default=[], metavar="ATTRIBUTES", help="Only keep these (comma separated) attributes besides the keys.")
+    parser.add_argument("--dedupe", action="store_true", help="Drop records whose sequence number has been seen recently.")
+    parser.add_argument("--record", metavar="FILE", help="Append the change records to this file as JSON lines, compressed if it ends in .zst")
+    parser.add_argument("--replay", metavar="FILE", help="Send the change records from a recording to the handlers instead of watching a stream.")
+    parser.add_argument("--speed", type=float, default=1.0, help="Replay speed, 1 is the original pace, 10 ten times as fast, 0 as fast as possible.")
     parsed = parser.parse_args()
 
+    if parsed.stream_arn is None and parsed.replay is None:
+        parser.error("Either a stream_arn or --replay is required.")
+
+    key_prefixes = {}
+    for key_prefix in parsed.key_prefix:
+        attribute_name, separator, prefix = key_prefix.partition("=")
+        if not separator:
+            parser.error(f"--key-prefix needs the format ATTRIBUTE=PREFIX, got {key_prefix}")
+        key_prefixes[attribute_name] = prefix
+
+    pipeline_options = {
+        "event_names": parsed.event_name,
+        "key_prefixes": key_prefixes,
+        "conditions": parsed.where,
+        "projection": [name.strip() for names in parsed.project for name in names.split(",") if name.strip()],
+        "dedupe": parsed.dedupe,
+    }
+
+    try:
+        compile_pipeline(**pipeline_options)
+    except ValueError as err:
+        parser.error(str(err))
+
+    dispatch_options = {
+        "workers": parsed.workers,
+        "stats_interval_seconds": 10 if parsed.print_stats else None,
+        "pipeline_options": pipeline_options,
+        "batch_callables": [RecordWriter(parsed.record)] if parsed.record else [],
+    }
+
+    checkpoint_store = MemoryCheckpointStore()
+    if parsed.checkpoint_dir is not None:
+        checkpoint_store = FileCheckpointStore(parsed.checkpoint_dir)
+    elif parsed.checkpoint_table is not None:
+        checkpoint_store = DynamoDBCheckpointStore(parsed.checkpoint_table, parsed.stream_arn)
+
     handlers = []
     if parsed.print_record:
         handlers.append(print_change_record)
     if parsed.print_summary:
         handlers.append(print_summary)
     
-    if len(handlers) == 0:
+    if len(handlers) == 0 and parsed.record is None:
         # When no handlers are set, we default to printing the record
         handlers.append(print_change_record)
 
-    start_watching(parsed.stream_arn, handlers)
+    if parsed.replay is not None:
+        dispatcher = make_dispatcher(handlers, **dispatch_options)
+        result = replay(parsed.replay, dispatcher, parsed.speed)
+        dispatcher.close()
+        print("Replayed {records} records in {durationSeconds:.2f}s ({recordsPerSecond:.1f} records/s)".format(**result))
+        return
+
+    if parsed.use_async:
+        asyncio.run(async_start_watching(parsed.stream_arn, handlers, checkpoint_store, dispatch_options))
+    else:
+        start_watching(parsed.stream_arn, handlers, checkpoint_store, dispatch_options)
 
 if __name__ == "__main__":
     main()
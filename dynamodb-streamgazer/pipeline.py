@@ -0,0 +1,181 @@
+"""
+Filters, projects and dedupes change records before they reach the handlers.
+
+The configuration is turned into a single function once, so each record only
+goes through the checks that are actually configured:
+
+- event_names: keep only these event names, e.g. INSERT and MODIFY
+- key_prefixes: keep records whose key attributes start with a prefix, e.g. {"PK": "USER#"}
+- conditions: attribute conditions on the new image (or the old image for REMOVE), like "status=active" or "price>=10"
+- projection: only keep these attributes in the images, the keys are always kept
+- dedupe: drop records whose sequence number has been seen recently
+"""
+import collections
+import decimal
+import operator
+import re
+import threading
+import typing
+
+RecordPipeline = typing.Callable[[typing.List[dict]], typing.List[dict]]
+
+_CONDITION_PATTERN = re.compile(r"^\s*([^!<>=\s]+)\s*(=|!=|<=|>=|<|>)\s*(.*?)\s*$")
+
+_OPERATORS = {
+    "=": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+}
+
+# Remembering this many sequence numbers for dedupe takes around 10 MB
+DEDUPE_WINDOW = 100_000
+
+
+def _attribute_value(record: dict, attribute_name: str) -> typing.Any:
+    """The plain value of the attribute in the new or old image, numbers are Decimals."""
+
+    change = record["dynamodb"]
+    image = change.get("NewImage") or change.get("OldImage") or change.get("Keys", {})
+
+    attribute_value = image.get(attribute_name)
+    if attribute_value is None:
+        return None
+
+    (data_type, value), = attribute_value.items()
+    if data_type == "N":
+        return decimal.Decimal(value)
+
+    return value
+
+
+def parse_condition(condition: str) -> typing.Callable[[dict], bool]:
+    """Turns attribute<op>value into a check, numbers are compared as numbers."""
+
+    match = _CONDITION_PATTERN.match(condition)
+    if match is None:
+        raise ValueError(f"Invalid condition {condition!r}, use e.g. status=active or price>=10")
+
+    attribute_name, operator_symbol, expected = match.groups()
+    compare = _OPERATORS[operator_symbol]
+
+    try:
+        expected_number = decimal.Decimal(expected)
+    except decimal.InvalidOperation:
+        expected_number = None
+
+    def _check(record: dict) -> bool:
+        value = _attribute_value(record, attribute_name)
+        if value is None:
+            return False
+        if isinstance(value, decimal.Decimal):
+            return expected_number is not None and compare(value, expected_number)
+        return compare(str(value), expected)
+
+    return _check
+
+
+def _key_prefix_check(attribute_name: str, prefix: str) -> typing.Callable[[dict], bool]:
+
+    def _check(record: dict) -> bool:
+        attribute_value = record["dynamodb"]["Keys"].get(attribute_name)
+        if attribute_value is None:
+            return False
+        (_, value), = attribute_value.items()
+        return str(value).startswith(prefix)
+
+    return _check
+
+
+def _projector(attribute_names: typing.Iterable[str]) -> typing.Callable[[dict], dict]:
+
+    attribute_names = frozenset(attribute_names)
+
+    def _project(record: dict) -> dict:
+        change = dict(record["dynamodb"])
+        for image_name in ("NewImage", "OldImage"):
+            if image_name in change:
+                change[image_name] = {
+                    name: value for name, value in change[image_name].items()
+                    if name in attribute_names or name in change["Keys"]
+                }
+        return {**record, "dynamodb": change}
+
+    return _project
+
+
+def _deduper(window: int) -> typing.Callable[[dict], bool]:
+    """Returns True for sequence numbers that haven't been seen in the last window records."""
+
+    seen: typing.Set[str] = set()
+    order: typing.Deque[str] = collections.deque()
+
+    # Shard readers may submit at the same time
+    lock = threading.Lock()
+
+    def _is_new(record: dict) -> bool:
+        sequence_number = record["dynamodb"]["SequenceNumber"]
+
+        with lock:
+            if sequence_number in seen:
+                return False
+
+            seen.add(sequence_number)
+            order.append(sequence_number)
+            if len(order) > window:
+                seen.discard(order.popleft())
+            return True
+
+    return _is_new
+
+
+def compile_pipeline(
+        event_names: typing.Optional[typing.Iterable[str]] = None,
+        key_prefixes: typing.Optional[typing.Dict[str, str]] = None,
+        conditions: typing.Optional[typing.Iterable[str]] = None,
+        projection: typing.Optional[typing.Iterable[str]] = None,
+        dedupe: bool = False,
+        dedupe_window: int = DEDUPE_WINDOW,
+    ) -> typing.Optional[RecordPipeline]:
+    """Returns a function that turns a batch of records into the ones to handle, None if nothing is configured."""
+
+    checks: typing.List[typing.Callable[[dict], bool]] = []
+
+    # The cheap checks go first
+    if event_names:
+        allowed_event_names = frozenset(event_names)
+        checks.append(lambda record: record["eventName"] in allowed_event_names)
+
+    for attribute_name, prefix in (key_prefixes or {}).items():
+        checks.append(_key_prefix_check(attribute_name, prefix))
+
+    for condition in conditions or []:
+        checks.append(parse_condition(condition))
+
+    # Dedupe last, so filtered records don't take up space in the window
+    if dedupe:
+        checks.append(_deduper(dedupe_window))
+
+    project = _projector(projection) if projection else None
+
+    if not checks and project is None:
+        return None
+
+    if len(checks) == 1:
+        predicate = checks[0]
+    else:
+        def predicate(record: dict) -> bool:
+            for check in checks:
+                if not check(record):
+                    return False
+            return True
+
+    if project is None:
+        return lambda records: [record for record in records if predicate(record)]
+
+    if not checks:
+        return lambda records: [project(record) for record in records]
+
+    return lambda records: [project(record) for record in records if predicate(record)]
@@ -0,0 +1,148 @@
+"""
+Records change records to a file and replays them later, without a live stream.
+
+The file contains one JSON document per line. If its name ends in .zst, it's
+compressed with zstandard (pip install zstandard). Each batch is appended as
+its own zstd frame, so the file stays readable even if the recording stops
+in the middle. The datetimes and binary values of the records are tagged, so
+they come back as the same types.
+
+Replays follow the ApproximateCreationDateTime of the records: speed 1 is the
+original pace, 10 is ten times as fast and 0 is as fast as the handlers go.
+"""
+import base64
+import datetime
+import io
+import json
+import threading
+import time
+import typing
+
+# Replayed records are submitted to the dispatcher in batches of at most this size
+REPLAY_BATCH_SIZE = 1000
+
+
+def _import_zstandard():
+    try:
+        import zstandard
+    except ImportError as err:
+        raise ImportError(
+            "Compressed recordings need zstandard, install it with 'pip install zstandard'."
+        ) from err
+
+    return zstandard
+
+
+def _is_compressed(path: str) -> bool:
+    return path.endswith(".zst")
+
+
+def _encode(value: typing.Any) -> typing.Any:
+    if isinstance(value, datetime.datetime):
+        return {"$datetime": value.isoformat()}
+    if isinstance(value, (bytes, bytearray)):
+        return {"$bytes": base64.b64encode(value).decode("ascii")}
+    raise TypeError(f"Can't record values of type {type(value).__name__}")
+
+
+def _decode(document: dict) -> typing.Any:
+    if len(document) == 1:
+        if "$datetime" in document:
+            return datetime.datetime.fromisoformat(document["$datetime"])
+        if "$bytes" in document:
+            return base64.b64decode(document["$bytes"])
+    return document
+
+
+class RecordWriter:
+    """A batch handler that appends the records to the file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock: typing.Optional[threading.Lock] = None
+
+    def __getstate__(self):
+        # The watcher processes create their own lock
+        return {"path": self.path, "_lock": None}
+
+    def __call__(self, records: typing.List[dict]):
+
+        data = "".join(json.dumps(record, default=_encode) + "\n" for record in records).encode("utf-8")
+
+        if _is_compressed(self.path):
+            data = _import_zstandard().ZstdCompressor().compress(data)
+
+        if self._lock is None:
+            self._lock = threading.Lock()
+
+        # One write per batch, in append mode, so lanes and processes don't mix up their lines
+        with self._lock, open(self.path, "ab") as recording:
+            recording.write(data)
+
+
+def read_records(path: str) -> typing.Iterator[dict]:
+    """Yields the records of a recording in the order they were written."""
+
+    with open(path, "rb") as recording:
+
+        if _is_compressed(path):
+            reader = _import_zstandard().ZstdDecompressor().stream_reader(recording, read_across_frames=True)
+            lines = io.TextIOWrapper(reader, encoding="utf-8")
+        else:
+            lines = io.TextIOWrapper(recording, encoding="utf-8")
+
+        for line in lines:
+            if line.strip():
+                yield json.loads(line, object_hook=_decode)
+
+
+def _created_at(record: dict) -> typing.Optional[float]:
+    created_at = record.get("dynamodb", {}).get("ApproximateCreationDateTime")
+    return created_at.timestamp() if created_at is not None else None
+
+
+def replay(path: str, dispatcher, speed: float = 1.0) -> dict:
+    """
+    Submits the recorded records to the dispatcher, paced by their creation time,
+    waits until the handlers are done and returns the throughput.
+    """
+
+    started_at = time.monotonic()
+    first_created_at = None
+    replayed = 0
+    batch: typing.List[dict] = []
+
+    for record in read_records(path):
+
+        created_at = _created_at(record)
+
+        if speed > 0 and created_at is not None:
+            if first_created_at is None:
+                first_created_at = created_at
+
+            due_in = (created_at - first_created_at) / speed - (time.monotonic() - started_at)
+            if due_in > 0:
+                # Hand over what's due before we wait
+                if batch:
+                    dispatcher.submit(batch)
+                    batch = []
+                time.sleep(due_in)
+
+        batch.append(record)
+        replayed += 1
+
+        if len(batch) >= REPLAY_BATCH_SIZE:
+            dispatcher.submit(batch)
+            batch = []
+
+    if batch:
+        dispatcher.submit(batch)
+
+    dispatcher.drain()
+    duration = time.monotonic() - started_at
+
+    return {
+        "records": replayed,
+        "durationSeconds": duration,
+        "recordsPerSecond": replayed / duration if duration > 0 else 0.0,
+    }